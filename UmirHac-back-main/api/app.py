@@ -2,17 +2,30 @@ from fastapi import FastAPI, Request
 from fastapi.responses import JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.security import HTTPBearer
-from api.routers import auth, script_generator, folders
+from api.routers import auth, script_generator, folders, files
+from api.metrics import METRICS_TOKEN, metrics_middleware, metrics_endpoint, start_metrics_server
+from api.compression import CompressionMiddleware
+from api.logging_config import setup_logging, request_id_middleware
+from api.tracing import setup_tracing, tracing_middleware
+from api.auth_tokens import token_verifier, InvalidToken
+from api.scripts.image_gc import start_gc_worker
+from api.scripts.job_queue import start_job_workers
+from api.schemas.schemas import init_db
 
-from jose import jwt, JWTError
-from datetime import datetime, timezone
 from dotenv import load_dotenv
+import logging
 import os
 
 load_dotenv()
-
-SECRET_KEY = os.getenv("SECRET_KEY", "your-secret-key-here")
-ALGORITHM = "HS256"
+setup_logging()
+setup_tracing()
+# Миграции схемы при старте (DB_AUTO_CREATE=0 — их применяют отдельно: alembic upgrade head)
+if os.getenv("DB_AUTO_CREATE", "1") != "0":
+    init_db()
+start_gc_worker()
+start_job_workers()
+start_metrics_server()
+logger = logging.getLogger("api.auth")
 
 # Настройка авторизации для Swagger
 security = HTTPBearer(description="Введите токен JWT в формате: Bearer &lt;token&gt;")
@@ -39,9 +52,12 @@ PUBLIC_PATHS = {
     "/auth/login",
     "/auth/register",
     "/docs",
-    "/openapi.json"
+    "/openapi.json",
 }
 
+# Подписанные ссылки на файлы (api/routers/files.py) проверяются по подписи, а не по JWT
+PUBLIC_PREFIXES = ("/files/",)
+
 
 def _strip_bearer(auth_header: str | None):
     if not auth_header:
@@ -53,7 +69,8 @@ def _strip_bearer(auth_header: str | None):
 
 @app.middleware("http")
 async def jwt_auth_middleware(request: Request, call_next):
-    if request.method == "OPTIONS" or request.url.path in PUBLIC_PATHS:
+    if (request.method == "OPTIONS" or request.url.path in PUBLIC_PATHS
+            or request.url.path.startswith(PUBLIC_PREFIXES)):
         return await call_next(request)
 
     raw = request.headers.get("Authorization")
@@ -62,21 +79,33 @@ async def jwt_auth_middleware(request: Request, call_next):
         return JSONResponse(status_code=401, content={"detail": "Authorization header is missing or invalid"})
 
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        exp = payload.get("exp")
-        if exp is not None and datetime.fromtimestamp(exp, tz=timezone.utc) < datetime.now(tz=timezone.utc):
-            return JSONResponse(status_code=401, content={"detail": "Token expired"})
-        username: str = payload.get("sub")
-        if username is None:
-            raise JWTError("No sub in token")
-        print(f"Middleware: decoded token, username/sub: {username}")
-        request.state.user = username
-    except JWTError as e:
-        print(f"JWT Error: {e}")
-        return JSONResponse(status_code=401, content={"detail": "Token is invalid or expired"})
+        claims = token_verifier.verify(token)
+    except InvalidToken as e:
+        logger.info("jwt rejected: %s", e.detail)
+        return JSONResponse(status_code=401, content={"detail": e.detail})
+
+    # uid есть в токенах, выданных после его добавления: get_current_user берёт пользователя из claims без БД
+    request.state.user = claims["sub"]
+    request.state.user_id = claims.get("uid")
+    request.state.claims = claims
+    logger.debug("token verified", extra={"user": claims["sub"]})
 
     return await call_next(request)
 
+# Сжатие ответов (api/compression.py): внутри метрик, в латентность входит и оно
+app.add_middleware(CompressionMiddleware)
+
+# Добавлены последними — внешние слои: в латентность входит и проверка токена,
+# а request_id есть у всех записей запроса
+app.middleware("http")(metrics_middleware)
+app.middleware("http")(tracing_middleware)
+app.middleware("http")(request_id_middleware)
+# /metrics проверяет свой токен (METRICS_TOKEN), а не JWT пользователя; без токена маршрута нет
+if METRICS_TOKEN:
+    PUBLIC_PATHS.add("/metrics")
+    app.add_api_route("/metrics", metrics_endpoint, methods=["GET"], include_in_schema=False)
+
 app.include_router(auth.router)
 app.include_router(script_generator.router)
-app.include_router(folders.router)
\ No newline at end of file
+app.include_router(folders.router)
+app.include_router(files.router)
\ No newline at end of file
@@ -0,0 +1,460 @@
+"""
+Архив проектов (холодное хранилище).
+Проекты архивной папки переносятся в сжатые архивы: один tar.gz на проект
+с ключом "<ARCHIVE_PREFIX><user_id>/<project_id>/<id>.tar.gz", внутри —
+manifest.json, сценарий (scenario.json) и файлы изображений (files/<ключ>).
+В манифесте — image_paths / image_descriptions проекта, записи
+scenario_element_images и список файлов (ключ, размер, sha256).
+
+После архивации у проекта выставлен archive_key, JSON картинок и записи
+scenario_element_images убраны из БД, ссылки на блобы отпущены (файлы удалит
+сборщик мусора, если на них больше никто не ссылается), сценарий и старые
+файлы блоков удалены из хранилища. image_generation_status и сводка проекта
+остаются — список проектов показывает их без обращения к архиву.
+
+Восстановление — при снятии архивности с папки (фоновой задачей) или лениво,
+при первом обращении к сценарию / картинкам проекта (ensure_restored): файлы
+возвращаются под прежними ключами (блобы адресованы содержимым), архив удаляется.
+Проекты, восстановленные при обращении, снова архивирует
+`python -m api.scripts.archive_projects`, если их не трогали ARCHIVE_IDLE секунд.
+
+Архивы не оканчиваются на .png, поэтому сборщик мусора изображений их не трогает;
+для S3 префикс ARCHIVE_PREFIX удобно перевести правилом жизненного цикла бакета
+в холодный класс хранения.
+"""
+import hashlib
+import json
+import logging
+import os
+import tarfile
+import tempfile
+import uuid
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from io import BytesIO
+from typing import Any, Dict, IO, List, Optional
+
+from fastapi import BackgroundTasks, HTTPException
+from sqlalchemy import func, update
+from sqlalchemy.orm import Session, object_session
+
+from .schemas.schemas import Folder, Project, ProjectStatus, ScenarioElementImage
+from .storage import CHUNK_SIZE, Storage, get_storage, storage_key
+from .image_store import IMAGE_FIELDS, blob_hash, put_image, release_image
+from .metrics import PROJECT_ARCHIVE_BYTES, PROJECT_ARCHIVE_OPERATIONS
+from .tracing import span
+from .scripts import job_queue
+
+logger = logging.getLogger("api.archive")
+
+ARCHIVE_PREFIX = os.getenv("ARCHIVE_PREFIX", "archive/")
+ARCHIVE_COMPRESS_LEVEL = int(os.getenv("ARCHIVE_COMPRESS_LEVEL", "6"))
+ARCHIVE_IDLE = float(os.getenv("ARCHIVE_IDLE", "86400"))
+# Архив собирается / читается во временном файле; до этого размера — в памяти
+SPOOL_SIZE = 16 * 1024 * 1024
+
+MANIFEST = "manifest.json"
+SCENARIO = "scenario.json"
+FORMAT = 1
+
+
+def _blocks(field_value: Optional[str]) -> List[Dict[str, Any]]:
+    try:
+        blocks = json.loads(field_value or "{}").get("blocks") or []
+    except (json.JSONDecodeError, TypeError, AttributeError):
+        return []
+    return [entry for entry in blocks if isinstance(entry, dict)]
+
+
+def _references(image_paths: Optional[str], element_images: List[Dict[str, Any]]) -> Counter:
+    """Число ссылок на каждый ключ изображения (как в image_gc.collect_references)"""
+    refs: Counter = Counter()
+    for entry in _blocks(image_paths):
+        for field in IMAGE_FIELDS:
+            key = storage_key(entry.get(field))
+            if key:
+                refs[key] += 1
+    for img in element_images:
+        key = storage_key(img.get("image_path"))
+        if key:
+            refs[key] += 1
+    return refs
+
+
+def _busy(project: Project) -> bool:
+    """Сценарий или картинки проекта ещё генерируются — архивировать нельзя"""
+    if project.status == ProjectStatus.in_progress:
+        return True
+    return any(entry.get("status") == ProjectStatus.in_progress.value
+               for entry in _blocks(project.image_generation_status))
+
+
+def _add_file(tar: tarfile.TarFile, name: str, data: bytes):
+    info = tarfile.TarInfo(name)
+    info.size = len(data)
+    tar.addfile(info, BytesIO(data))
+
+
+def _chunks(f: IO[bytes]):
+    f.seek(0)
+    while True:
+        chunk = f.read(CHUNK_SIZE)
+        if not chunk:
+            break
+        yield chunk
+
+
+def _archive_key(project: Project) -> str:
+    # Своё имя у каждой архивации: параллельная попытка не перезапишет чужой архив
+    return f"{ARCHIVE_PREFIX}{project.user_id}/{project.id}/{uuid.uuid4().hex}.tar.gz"
+
+
+def archive_project(db: Session, project: Project) -> bool:
+    """
+    Переносит файлы проекта в архив. False — архивировать нечего, проект занят
+    генерацией, изменился, пока собирался архив, или какого-то из его файлов нет
+    в хранилище (тогда архив не сохраняется). Архив остаётся единственной копией
+    файлов, поэтому ссылки на отсутствующие файлы в него не переносятся — проект
+    остаётся в горячем хранилище, пока их не исправят.
+    """
+    if project.archive_key is not None:
+        return False
+    if _busy(project):
+        PROJECT_ARCHIVE_OPERATIONS.labels("archive", "skipped").inc()
+        return False
+
+    storage = get_storage()
+    image_paths, result_path = project.image_paths, project.result_path
+    scenario_key = storage_key(result_path)
+    rows = db.query(ScenarioElementImage).filter(ScenarioElementImage.project_id == project.id).all()
+    element_images = [
+        {
+            "id": img.id,
+            "element_index": img.element_index,
+            "image_path": img.image_path,
+            "image_description": img.image_description,
+            "status": img.status.value,
+            "created_at": img.created_at.isoformat() if img.created_at else None,
+            "updated_at": img.updated_at.isoformat() if img.updated_at else None,
+        }
+        for img in rows
+    ]
+    refs = _references(image_paths, element_images)
+    if not scenario_key and not refs:
+        return False
+
+    key = _archive_key(project)
+    now = datetime.now(timezone.utc)
+    manifest: Dict[str, Any] = {
+        "format": FORMAT,
+        "project_id": project.id,
+        "user_id": project.user_id,
+        "archived_at": now.isoformat(),
+        "scenario": None,
+        "image_paths": image_paths,
+        "image_descriptions": project.image_descriptions,
+        "element_images": element_images,
+        "files": [],
+    }
+
+    with span("archive.build", project_id=project.id, files=len(refs)), \
+            tempfile.SpooledTemporaryFile(max_size=SPOOL_SIZE) as bundle:
+        scenario, missing = None, []
+        with tarfile.open(fileobj=bundle, mode="w:gz", compresslevel=ARCHIVE_COMPRESS_LEVEL) as tar:
+            if scenario_key:
+                try:
+                    scenario = storage.read(scenario_key)
+                except FileNotFoundError:
+                    scenario = None
+                if scenario is not None:
+                    _add_file(tar, SCENARIO, scenario)
+                    manifest["scenario"] = {"key": scenario_key, "name": SCENARIO, "size": len(scenario)}
+
+            files_bytes = len(scenario or b"")
+            # По одному файлу в памяти: чтение следующих идёт, пока пишется текущий
+            for file_key, raw in storage.iter_read_many(sorted(refs)):
+                if raw is None:
+                    missing.append(file_key)
+                    continue
+                name = f"files/{file_key}"
+                _add_file(tar, name, raw)
+                manifest["files"].append({
+                    "key": file_key, "name": name, "size": len(raw), "sha256": hashlib.sha256(raw).hexdigest(),
+                })
+                files_bytes += len(raw)
+
+            # Манифест — последним: в нём размеры и хэши уже записанных файлов
+            _add_file(tar, MANIFEST, json.dumps(manifest, ensure_ascii=False).encode("utf-8"))
+
+        if missing:
+            PROJECT_ARCHIVE_OPERATIONS.labels("archive", "skipped").inc()
+            logger.warning("project not archived: referenced files are missing",
+                           extra={"project_id": project.id, "missing": missing})
+            return False
+
+        bundle_size = bundle.tell()
+        storage.write_stream(key, _chunks(bundle), content_type="application/gzip")
+
+    try:
+        # Проект не должен был измениться, пока собирался архив; строка проекта
+        # остаётся заблокированной до commit, поэтому и сценарий сверяется после этого
+        claimed = db.execute(
+            update(Project)
+            .where(
+                Project.id == project.id,
+                Project.archive_key.is_(None),
+                Project.image_paths.is_not_distinct_from(image_paths),
+                Project.result_path.is_not_distinct_from(result_path),
+            )
+            .values(archive_key=key, archived_at=now, image_paths=None, image_descriptions=None,
+                    updated_at=Project.updated_at)
+            .execution_options(synchronize_session=False)
+        ).rowcount
+        if claimed and scenario_key and manifest["scenario"] is not None:
+            claimed = storage.read(scenario_key) == scenario
+        if not claimed:
+            db.rollback()
+            storage.delete(key)
+            PROJECT_ARCHIVE_OPERATIONS.labels("archive", "skipped").inc()
+            return False
+
+        legacy = []
+        for ref_key, count in refs.items():
+            if blob_hash(ref_key) is None:
+                legacy.append(ref_key)
+                continue
+            for _ in range(count):
+                release_image(db, ref_key)
+        for img in rows:
+            db.delete(img)
+        db.commit()
+    except Exception:
+        db.rollback()
+        storage.delete(key)
+        PROJECT_ARCHIVE_OPERATIONS.labels("archive", "failed").inc()
+        raise
+
+    # Файлы, на которые больше нет ссылок из БД, — уже после commit
+    for file_key in legacy + ([scenario_key] if manifest["scenario"] else []):
+        try:
+            storage.delete(file_key)
+        except Exception as e:
+            logger.warning("file delete failed: %s", e, extra={"key": file_key})
+
+    db.refresh(project)
+    PROJECT_ARCHIVE_OPERATIONS.labels("archive", "ok").inc()
+    PROJECT_ARCHIVE_BYTES.labels("files").inc(files_bytes)
+    PROJECT_ARCHIVE_BYTES.labels("bundle").inc(bundle_size)
+    logger.info("project archived", extra={
+        "project_id": project.id, "archive_key": key, "files": len(manifest["files"]),
+        "bytes": files_bytes, "bundle_bytes": bundle_size,
+    })
+    return True
+
+
+def _download(storage: Storage, key: str) -> IO[bytes]:
+    f = tempfile.SpooledTemporaryFile(max_size=SPOOL_SIZE)
+    try:
+        for chunk in storage.iter_read(key):
+            f.write(chunk)
+    except BaseException:
+        f.close()
+        raise
+    f.seek(0)
+    return f
+
+
+def _read_member(tar: tarfile.TarFile, name: str) -> bytes:
+    member = tar.extractfile(name)
+    if member is None:
+        raise ValueError(f"Archive member is not a file: {name}")
+    return member.read()
+
+
+def _parse_time(value: Optional[str]) -> Optional[datetime]:
+    return datetime.fromisoformat(value) if value else None
+
+
+def restore_project(db: Session, project: Project) -> bool:
+    """Возвращает файлы проекта из архива. False — проект не в архиве (или его уже восстановили)"""
+    key = project.archive_key
+    if key is None:
+        return False
+    storage = get_storage()
+
+    try:
+        bundle = _download(storage, key)
+    except FileNotFoundError:
+        # Архив уже удалило параллельное восстановление
+        db.refresh(project)
+        if project.archive_key == key:
+            raise
+        return False
+
+    with bundle, span("archive.restore", project_id=project.id), \
+            tarfile.open(fileobj=bundle, mode="r:gz") as tar:
+        manifest = json.loads(_read_member(tar, MANIFEST))
+        if manifest.get("format") != FORMAT or manifest.get("project_id") != project.id:
+            raise ValueError(f"Unexpected archive manifest: {key}")
+
+        try:
+            claimed = db.execute(
+                update(Project)
+                .where(Project.id == project.id, Project.archive_key == key)
+                .values(archive_key=None, archived_at=None, image_paths=manifest["image_paths"],
+                        image_descriptions=manifest["image_descriptions"], updated_at=Project.updated_at)
+                .execution_options(synchronize_session=False)
+            ).rowcount
+            if not claimed:
+                db.rollback()
+                db.refresh(project)
+                return False
+
+            element_images = manifest["element_images"]
+            refs = _references(manifest["image_paths"], element_images)
+            # Ссылки без файла в архиве (архивы, собранные до проверки отсутствующих
+            # файлов) возвращаются как есть, но битыми — о них нужно знать
+            missing = sorted(set(refs) - {entry["key"] for entry in manifest["files"]})
+            if missing:
+                logger.warning("archived project references missing files",
+                               extra={"project_id": project.id, "archive_key": key, "missing": missing})
+            for entry in manifest["files"]:
+                raw = _read_member(tar, entry["name"])
+                if hashlib.sha256(raw).hexdigest() != entry["sha256"]:
+                    raise ValueError(f"Archive file is damaged: {entry['key']}")
+                if blob_hash(entry["key"]) is None:
+                    storage.write(entry["key"], raw)
+                    continue
+                # Одна ссылка на каждое упоминание ключа, как при записи put_image
+                for _ in range(refs[entry["key"]]):
+                    put_image(db, raw)
+
+            if manifest["scenario"] is not None:
+                storage.write(manifest["scenario"]["key"], _read_member(tar, manifest["scenario"]["name"]),
+                              content_type="application/json")
+
+            for img in element_images:
+                db.add(ScenarioElementImage(
+                    id=img["id"],
+                    project_id=project.id,
+                    element_index=img["element_index"],
+                    image_path=img["image_path"],
+                    image_description=img["image_description"],
+                    status=ProjectStatus(img["status"]),
+                    created_at=_parse_time(img["created_at"]),
+                    updated_at=_parse_time(img["updated_at"]),
+                ))
+            db.commit()
+        except Exception:
+            db.rollback()
+            PROJECT_ARCHIVE_OPERATIONS.labels("restore", "failed").inc()
+            raise
+
+    try:
+        storage.delete(key)
+    except Exception as e:
+        logger.warning("archive delete failed: %s", e, extra={"key": key})
+    db.refresh(project)
+    PROJECT_ARCHIVE_OPERATIONS.labels("restore", "ok").inc()
+    logger.info("project restored", extra={"project_id": project.id, "archive_key": key,
+                                           "files": len(manifest["files"])})
+    return True
+
+
+def ensure_restored(project: Project):
+    """
+    Возвращает проект из архива перед чтением его сценария / картинок (ленивое восстановление).
+    Вызывать только после проверки владельца (Project.user_id == current_user.id):
+    восстановление отменяет архивацию, чужой запрос не должен её запускать.
+    """
+    if project.archive_key is None:
+        return
+    try:
+        restore_project(object_session(project), project)
+    except Exception:
+        logger.exception("project restore failed", extra={"project_id": project.id})
+        raise HTTPException(status_code=500, detail="Error restoring project from archive")
+
+
+def _folder_archived(db: Session, folder_id: int) -> Optional[bool]:
+    return db.query(Folder.archived).filter(Folder.id == folder_id).scalar()
+
+
+def archive_folder(db: Session, folder_id: int) -> int:
+    """Архивирует проекты папки, пока она архивная; возвращает число заархивированных"""
+    project_ids = [pid for (pid,) in db.query(Project.id).filter(
+        Project.folder_id == folder_id, Project.archive_key.is_(None)
+    ).order_by(Project.id)]
+    archived = 0
+    for project_id in project_ids:
+        # С папки могли снять архивность, пока шла задача
+        if not _folder_archived(db, folder_id):
+            break
+        project = db.get(Project, project_id)
+        if project is None:
+            continue
+        try:
+            archived += archive_project(db, project)
+        except Exception:
+            logger.exception("project archive failed", extra={"project_id": project_id, "folder_id": folder_id})
+    return archived
+
+
+def restore_folder(db: Session, folder_id: int) -> int:
+    """Восстанавливает проекты папки, пока она не архивная; возвращает число восстановленных"""
+    project_ids = [pid for (pid,) in db.query(Project.id).filter(
+        Project.folder_id == folder_id, Project.archive_key.isnot(None)
+    ).order_by(Project.id)]
+    restored = 0
+    for project_id in project_ids:
+        if _folder_archived(db, folder_id):
+            break
+        project = db.get(Project, project_id)
+        if project is None:
+            continue
+        try:
+            restored += restore_project(db, project)
+        except Exception:
+            logger.exception("project restore failed", extra={"project_id": project_id, "folder_id": folder_id})
+    return restored
+
+
+def archive_idle_projects(db: Session, idle: float = ARCHIVE_IDLE) -> int:
+    """
+    Снова архивирует проекты архивных папок, восстановленные при обращении,
+    если их не меняли idle секунд. Возвращает число заархивированных.
+    """
+    cutoff = datetime.now(timezone.utc) - timedelta(seconds=idle)
+    project_ids = [pid for (pid,) in (
+        db.query(Project.id)
+        .join(Folder, Folder.id == Project.folder_id)
+        .filter(Folder.archived.is_(True), Project.archive_key.is_(None),
+                func.coalesce(Project.updated_at, Project.created_at) < cutoff)
+        .order_by(Project.id)
+    )]
+    archived = 0
+    for project_id in project_ids:
+        project = db.get(Project, project_id)
+        if project is None:
+            continue
+        try:
+            archived += archive_project(db, project)
+        except Exception:
+            logger.exception("project archive failed", extra={"project_id": project_id})
+    return archived
+
+
+def schedule_folder(background_tasks: BackgroundTasks, db: Session, folder: Folder):
+    """Ставит задачу архивации (или восстановления) проектов папки по её флагу archived"""
+    job_queue.dispatch(background_tasks, db, "folder.archive",
+                       {"folder_id": folder.id, "archived": bool(folder.archived)})
+
+
+def _run_folder_job(db: Session, payload: Dict[str, Any], jobs):
+    if payload["archived"]:
+        archive_folder(db, payload["folder_id"])
+    else:
+        restore_folder(db, payload["folder_id"])
+
+
+job_queue.register("folder.archive", _run_folder_job)
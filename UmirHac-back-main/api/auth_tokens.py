@@ -0,0 +1,108 @@
+"""
+Проверка JWT для auth-middleware.
+Токены живут ~7 дней, и один и тот же токен проверяется на каждом запросе,
+поэтому проверенные claims кэшируются (LRU по sha256 токена) до их exp.
+Декодер выбирается JWT_BACKEND: auto (PyJWT, если установлен, иначе python-jose;
+оба есть в requirements.txt), pyjwt или jose. Размер кэша — JWT_CACHE_SIZE (0 — без кэша).
+"""
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+
+class InvalidToken(Exception):
+    """Токен не прошёл проверку; detail уходит клиенту в 401"""
+
+    def __init__(self, detail: str):
+        super().__init__(detail)
+        self.detail = detail
+
+
+def _pyjwt_decoder():
+    import jwt as pyjwt
+
+    def decode(token: str, secret: str, algorithm: str) -> Dict[str, Any]:
+        try:
+            return pyjwt.decode(token, secret, algorithms=[algorithm])
+        except pyjwt.ExpiredSignatureError:
+            raise InvalidToken("Token expired")
+        except pyjwt.InvalidTokenError:
+            raise InvalidToken("Token is invalid or expired")
+    return decode
+
+
+def _jose_decoder():
+    from jose import jwt as jose_jwt, JWTError, ExpiredSignatureError
+
+    def decode(token: str, secret: str, algorithm: str) -> Dict[str, Any]:
+        try:
+            return jose_jwt.decode(token, secret, algorithms=[algorithm])
+        except ExpiredSignatureError:
+            raise InvalidToken("Token expired")
+        except JWTError:
+            raise InvalidToken("Token is invalid or expired")
+    return decode
+
+
+def _make_decoder(backend: str):
+    if backend == "jose":
+        return _jose_decoder()
+    if backend == "pyjwt":
+        return _pyjwt_decoder()
+    if backend == "auto":
+        try:
+            return _pyjwt_decoder()
+        except ImportError:
+            return _jose_decoder()
+    raise ValueError(f"Unknown JWT_BACKEND: {backend}")
+
+
+class TokenVerifier:
+    """Проверяет подпись и exp токена; повторные проверки того же токена берутся из кэша"""
+
+    def __init__(self, secret: str, algorithm: str = "HS256", cache_size: int = 10000,
+                 backend: str = "auto"):
+        self.secret = secret
+        self.algorithm = algorithm
+        self.cache_size = cache_size
+        self._decode = _make_decoder(backend)
+        self._cache: "OrderedDict[bytes, Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def verify(self, token: str) -> Dict[str, Any]:
+        key = hashlib.sha256(token.encode("utf-8")).digest()
+        if self.cache_size > 0:
+            with self._lock:
+                claims = self._cache.get(key)
+                if claims is not None:
+                    exp = claims.get("exp")
+                    if exp is not None and exp < time.time():
+                        del self._cache[key]
+                        raise InvalidToken("Token expired")
+                    self._cache.move_to_end(key)
+                    return claims
+
+        claims = self._decode(token, self.secret, self.algorithm)
+        if claims.get("sub") is None:
+            raise InvalidToken("Token is invalid or expired")
+
+        if self.cache_size > 0:
+            with self._lock:
+                self._cache[key] = claims
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+        return claims
+
+
+token_verifier = TokenVerifier(
+    os.getenv("SECRET_KEY", "your-secret-key-here"),
+    cache_size=int(os.getenv("JWT_CACHE_SIZE", "10000")),
+    backend=os.getenv("JWT_BACKEND", "auto").lower(),
+)
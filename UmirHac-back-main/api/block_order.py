@@ -0,0 +1,179 @@
+"""
+Порядок блоков сценария.
+index блока — его постоянный идентификатор: выдаётся при создании и больше не
+меняется, на него ссылаются image_paths / image_descriptions / image_generation_status,
+ScenarioElementImage.element_index и задачи изображений. Порядок задаёт rank —
+строка дробного ранжирования (сравнивается лексикографически): новый блок получает
+rank между соседями, перемещённый — между новыми соседями. Вставка, удаление и
+перемещение меняют только сам блок, а не индексы всех блоков после него.
+В JSON сценария блоки хранятся отсортированными по rank.
+"""
+from typing import Any, Dict, List, Optional
+
+# Алфавит рангов в порядке возрастания ASCII, чтобы сравнение строк совпадало с числовым
+DIGITS = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz"
+BASE = len(DIGITS)
+# Вставки подряд в одно место удлиняют rank (~1 символ на 5-6 вставок);
+# когда он длиннее, ранги сценария перераспределяются заново
+MAX_RANK_LENGTH = 24
+
+
+def _midpoint(a: str, b: Optional[str]) -> str:
+    """Строка строго между a и b (b=None — без верхней границы); a < b, без хвостовых нулей"""
+    if b is not None:
+        # Общий префикс переносим как есть
+        n = 0
+        while n < len(b) and (a[n] if n < len(a) else DIGITS[0]) == b[n]:
+            n += 1
+        if n > 0:
+            return b[:n] + _midpoint(a[n:], b[n:])
+
+    digit_a = DIGITS.index(a[0]) if a else 0
+    digit_b = DIGITS.index(b[0]) if b else BASE
+    if digit_b - digit_a > 1:
+        return DIGITS[(digit_a + digit_b + 1) // 2]
+    # Соседние цифры: берём первую цифру b, если после неё что-то есть, иначе уходим на разряд глубже
+    if b is not None and len(b) > 1:
+        return b[:1]
+    return DIGITS[digit_a] + _midpoint(a[1:], None)
+
+
+def rank_between(before: Optional[str], after: Optional[str]) -> str:
+    """
+    rank для блока между соседями с рангами before и after
+    (None — начало / конец сценария).
+    """
+    if before is not None and after is not None and before >= after:
+        raise ValueError(f"rank {before!r} is not less than {after!r}")
+    return _midpoint(before or "", after)
+
+
+def spread_ranks(count: int) -> List[str]:
+    """count рангов, равномерно распределённых по пространству (для начальной расстановки)"""
+    width = 1
+    while BASE ** width <= count:
+        width += 1
+    step = BASE ** width // (count + 1)
+    ranks = []
+    for i in range(1, count + 1):
+        value = step * i
+        digits = []
+        for _ in range(width):
+            value, digit = divmod(value, BASE)
+            digits.append(DIGITS[digit])
+        ranks.append("".join(reversed(digits)).rstrip(DIGITS[0]))
+    return ranks
+
+
+def ensure_block_order(scenario_data: Dict[str, Any]) -> bool:
+    """
+    Дополняет сценарий полями порядка: rank у блоков (в текущем порядке массива)
+    и next_block_index — следующий свободный index. Сценарии, сохранённые до
+    появления rank, переходят на него без смены index. Возвращает True, если
+    что-то пришлось дописать.
+    """
+    blocks = scenario_data.get("blocks") or []
+    changed = False
+
+    ranks = [b.get("rank") for b in blocks]
+    if not all(isinstance(r, str) and r for r in ranks) or any(a >= b for a, b in zip(ranks, ranks[1:])):
+        if all(b.get("rank") is None for b in blocks):
+            for block, rank in zip(blocks, spread_ranks(len(blocks))):
+                block["rank"] = rank
+        else:
+            rerank(blocks)
+        changed = bool(blocks)
+
+    indices = [b["index"] for b in blocks if isinstance(b.get("index"), int)]
+    next_index = max(indices) + 1 if indices else 1
+    if not isinstance(scenario_data.get("next_block_index"), int) or scenario_data["next_block_index"] < next_index:
+        scenario_data["next_block_index"] = next_index
+        changed = True
+    return changed
+
+
+def allocate_block_index(scenario_data: Dict[str, Any]) -> int:
+    """Выдаёт новый index блока; индексы удалённых блоков повторно не используются"""
+    ensure_block_order(scenario_data)
+    index = scenario_data["next_block_index"]
+    scenario_data["next_block_index"] = index + 1
+    return index
+
+
+def place_block(blocks: List[Dict[str, Any]], block: Dict[str, Any], position: int) -> bool:
+    """
+    Ставит block в позицию position (0-based) списка blocks, отсортированного по rank,
+    и выдаёт ему rank между соседями (блок уже из списка — перемещается).
+    Остальные блоки не меняются, кроме редкого перераспределения рангов, когда
+    rank становится слишком длинным; тогда возвращает True.
+    """
+    blocks[:] = [b for b in blocks if b is not block]
+    position = max(0, min(position, len(blocks)))
+    before = blocks[position - 1]["rank"] if position > 0 else None
+    after = blocks[position]["rank"] if position < len(blocks) else None
+    block["rank"] = rank_between(before, after)
+    blocks.insert(position, block)
+
+    if len(block["rank"]) <= MAX_RANK_LENGTH:
+        return False
+    for b, rank in zip(blocks, spread_ranks(len(blocks))):
+        b["rank"] = rank
+    return True
+
+
+def rerank(blocks: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Выдаёт ранги блокам, переставленным в новый порядок blocks. Ранг сохраняют
+    блоки наибольшей подпоследовательности, уже идущей по возрастанию rank,
+    новые ранги получают только остальные (при перемещении одного блока — один).
+    Возвращает блоки, у которых rank изменился.
+    """
+    ranks = [b.get("rank") if isinstance(b.get("rank"), str) and b.get("rank") else None for b in blocks]
+
+    # Наибольшая возрастающая подпоследовательность рангов, O(n log n)
+    tails: List[int] = []  # позиции последних элементов цепочек каждой длины
+    prev: List[Optional[int]] = [None] * len(blocks)
+    for i, rank in enumerate(ranks):
+        if rank is None:
+            continue
+        lo, hi = 0, len(tails)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if ranks[tails[mid]] < rank:
+                lo = mid + 1
+            else:
+                hi = mid
+        prev[i] = tails[lo - 1] if lo > 0 else None
+        if lo == len(tails):
+            tails.append(i)
+        else:
+            tails[lo] = i
+    keep = set()
+    i = tails[-1] if tails else None
+    while i is not None:
+        keep.add(i)
+        i = prev[i]
+
+    # Ранг ближайшего сохраняемого блока справа от каждой позиции
+    next_kept: List[Optional[str]] = [None] * len(blocks)
+    after: Optional[str] = None
+    for i in range(len(blocks) - 1, -1, -1):
+        next_kept[i] = after
+        if i in keep:
+            after = ranks[i]
+
+    changed = []
+    before: Optional[str] = None
+    for i, block in enumerate(blocks):
+        if i in keep:
+            before = block["rank"]
+            continue
+        block["rank"] = rank_between(before, next_kept[i])
+        before = block["rank"]
+        changed.append(block)
+
+    if any(len(b["rank"]) > MAX_RANK_LENGTH for b in changed):
+        for block, rank in zip(blocks, spread_ranks(len(blocks))):
+            block["rank"] = rank
+        return list(blocks)
+    return changed
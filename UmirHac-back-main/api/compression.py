@@ -0,0 +1,187 @@
+"""
+Сжатие ответов (Content-Encoding: br / gzip).
+Сжимаются текстовые ответы — JSON сценариев и списков проектов, base64-картинки
+из /images/blocks, NDJSON — размером от COMPRESSION_MIN_SIZE байт. Картинки
+(PNG/WebP/JPEG из /files) уже сжаты и отдаются как есть, как и ответы, у которых
+Content-Encoding уже выставлен.
+Brotli используется, если установлен пакет brotli и клиент его принимает, иначе gzip.
+Ответы с известной длиной сжимаются целиком, потоковые (без Content-Length) — по
+частям: каждая часть сбрасывается (flush) сразу, чтобы клиент получал данные без
+ожидания конца потока.
+
+COMPRESSION=0 — выключить, COMPRESSION_MIN_SIZE (1024), COMPRESSION_GZIP_LEVEL (6),
+COMPRESSION_BROTLI_QUALITY (5).
+"""
+import os
+import zlib
+from typing import List, Optional
+
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from .metrics import RESPONSE_COMPRESSION_BYTES
+
+try:
+    import brotli
+except ImportError:  # brotli — необязательная зависимость, без неё только gzip
+    brotli = None
+
+COMPRESSION_ENABLED = os.getenv("COMPRESSION", "1") != "0"
+COMPRESSION_MIN_SIZE = int(os.getenv("COMPRESSION_MIN_SIZE", "1024"))
+COMPRESSION_GZIP_LEVEL = int(os.getenv("COMPRESSION_GZIP_LEVEL", "6"))
+COMPRESSION_BROTLI_QUALITY = int(os.getenv("COMPRESSION_BROTLI_QUALITY", "5"))
+
+# Типы, которые имеет смысл сжимать; всё остальное (image/*, application/octet-stream, ...) — нет
+COMPRESSIBLE_TYPES = (
+    "application/json",
+    "application/x-ndjson",
+    "application/javascript",
+    "application/xml",
+    "image/svg+xml",
+)
+
+
+def _compressible(content_type: str) -> bool:
+    media_type = content_type.split(";", 1)[0].strip().lower()
+    return media_type.startswith("text/") or media_type.endswith("+json") or media_type in COMPRESSIBLE_TYPES
+
+
+def choose_encoding(accept_encoding: str) -> Optional[str]:
+    """Кодировка по заголовку Accept-Encoding: br (если есть brotli), gzip или None"""
+    accepted = {}
+    for part in accept_encoding.lower().split(","):
+        name, _, params = part.strip().partition(";")
+        q = 1.0
+        for param in params.split(";"):
+            key, _, value = param.strip().partition("=")
+            if key == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        accepted[name.strip()] = q
+
+    wildcard = accepted.get("*", 0.0)
+    for encoding in (("br", "gzip") if brotli is not None else ("gzip",)):
+        if accepted.get(encoding, wildcard) > 0:
+            return encoding
+    return None
+
+
+class _Compressor:
+    """Потоковый компрессор выбранной кодировки"""
+
+    def __init__(self, encoding: str):
+        self.encoding = encoding
+        if encoding == "br":
+            self._brotli = brotli.Compressor(quality=COMPRESSION_BROTLI_QUALITY)
+        else:
+            self._zlib = zlib.compressobj(COMPRESSION_GZIP_LEVEL, zlib.DEFLATED, zlib.MAX_WBITS | 16)
+
+    def compress(self, data: bytes, final: bool) -> bytes:
+        if self.encoding == "br":
+            out = self._brotli.process(data)
+            return out + (self._brotli.finish() if final else self._brotli.flush())
+        out = self._zlib.compress(data)
+        return out + self._zlib.flush(zlib.Z_FINISH if final else zlib.Z_SYNC_FLUSH)
+
+
+class CompressionMiddleware:
+    """ASGI-middleware сжатия ответов (см. описание модуля)"""
+
+    def __init__(self, app: ASGIApp, minimum_size: int = COMPRESSION_MIN_SIZE):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or not COMPRESSION_ENABLED:
+            await self.app(scope, receive, send)
+            return
+        encoding = choose_encoding(Headers(scope=scope).get("accept-encoding", ""))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+        await _CompressedResponder(self.app, encoding, self.minimum_size)(scope, receive, send)
+
+
+class _CompressedResponder:
+    def __init__(self, app: ASGIApp, encoding: str, minimum_size: int):
+        self.app = app
+        self.encoding = encoding
+        self.minimum_size = minimum_size
+        self.send: Send
+        self.start_message: Optional[Message] = None
+        self.passthrough = False
+        # Ответ с известной длиной (в т.ч. переразбитый на части function-middleware)
+        # копится и сжимается целиком — с Content-Length и без лишних flush
+        self.buffered: Optional[List[bytes]] = None
+        self.compressor: Optional[_Compressor] = None
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        self.send = send
+        await self.app(scope, receive, self._send)
+
+    def _start_compressed(self) -> MutableHeaders:
+        headers = MutableHeaders(raw=self.start_message["headers"])
+        headers["Content-Encoding"] = self.encoding
+        headers.add_vary_header("Accept-Encoding")
+        return headers
+
+    async def _send_body(self, body: bytes, compressed: bytes, more_body: bool) -> None:
+        RESPONSE_COMPRESSION_BYTES.labels(self.encoding, "in").inc(len(body))
+        RESPONSE_COMPRESSION_BYTES.labels(self.encoding, "out").inc(len(compressed))
+        await self.send({"type": "http.response.body", "body": compressed, "more_body": more_body})
+
+    async def _send(self, message: Message) -> None:
+        if message["type"] == "http.response.start":
+            self.start_message = message
+            headers = Headers(raw=message["headers"])
+            content_length = headers.get("content-length", "")
+            self.passthrough = (
+                message["status"] < 200 or message["status"] in (204, 206, 304)
+                or "content-encoding" in headers
+                or not _compressible(headers.get("content-type", ""))
+                or (content_length.isdigit() and int(content_length) < self.minimum_size)
+            )
+            if self.passthrough:
+                await self.send(message)
+            elif content_length.isdigit():
+                self.buffered = []
+            return
+
+        if message["type"] != "http.response.body" or self.passthrough:
+            await self.send(message)
+            return
+
+        body = message.get("body", b"")
+        more_body = message.get("more_body", False)
+
+        if self.buffered is not None:
+            self.buffered.append(body)
+            if more_body:
+                return
+            body = b"".join(self.buffered)
+            compressed = _Compressor(self.encoding).compress(body, final=True)
+            self._start_compressed()["Content-Length"] = str(len(compressed))
+            await self.send(self.start_message)
+            await self._send_body(body, compressed, more_body=False)
+            return
+
+        if self.compressor is None:
+            # Поток без Content-Length: короткий ответ одной частью отдаём без сжатия
+            if not more_body and len(body) < self.minimum_size:
+                self.passthrough = True
+                await self.send(self.start_message)
+                await self.send(message)
+                return
+            self.compressor = _Compressor(self.encoding)
+            headers = self._start_compressed()
+            if not more_body:
+                compressed = self.compressor.compress(body, final=True)
+                headers["Content-Length"] = str(len(compressed))
+                await self.send(self.start_message)
+                await self._send_body(body, compressed, more_body=False)
+                return
+            await self.send(self.start_message)
+
+        await self._send_body(body, self.compressor.compress(body, final=not more_body), more_body)
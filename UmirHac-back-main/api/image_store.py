@@ -0,0 +1,116 @@
+"""
+Изображения блоков в хранилище, адресованные содержимым.
+Ключ файла — sha256 PNG ("blobs/ab/abcdef....png"), поэтому одинаковые картинки
+(повторная генерация с тем же seed, копии блоков) хранятся один раз.
+Число ссылок на файл ведётся в ImageBlob.refcount: put_image — +1 при записи ключа
+в image_paths, release_image — -1, когда ключ оттуда убирают. Файлы без ссылок
+удаляет сборщик мусора (api/scripts/image_gc.py), а не release_image: так запись,
+параллельно сославшаяся на тот же файл, не останется без него.
+"""
+import hashlib
+import logging
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterable, Optional
+
+from sqlalchemy.orm import Session
+
+from .schemas.schemas import ImageBlob
+from .storage import get_storage, storage_key
+from .tracing import span
+
+logger = logging.getLogger("api.images")
+
+BLOB_PREFIX = "blobs/"
+
+# Поля записи блока в Project.image_paths, в которых лежат ключи изображений
+# (original_path — исходная картинка отредактированного блока, источник следующих правок)
+IMAGE_FIELDS = ("image_path", "preview_path", "original_path")
+
+
+def blob_key(digest: str) -> str:
+    return f"{BLOB_PREFIX}{digest[:2]}/{digest}.png"
+
+
+def blob_hash(key: Optional[str]) -> Optional[str]:
+    """sha256 из ключа блоба (None — ключ не блоба, например старый файл блока)"""
+    if not key or not key.startswith(BLOB_PREFIX):
+        return None
+    return key.rsplit("/", 1)[-1].split(".", 1)[0]
+
+
+def _acquire(db: Session, digest: str, size: int):
+    """refcount + 1 одним запросом (INSERT ... ON CONFLICT там, где он есть)"""
+    now = datetime.now(timezone.utc)
+    dialect = db.get_bind().dialect.name
+    if dialect in ("sqlite", "postgresql"):
+        if dialect == "sqlite":
+            from sqlalchemy.dialects.sqlite import insert
+        else:
+            from sqlalchemy.dialects.postgresql import insert
+        stmt = insert(ImageBlob).values(hash=digest, size=size, refcount=1, created_at=now, updated_at=now)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[ImageBlob.hash],
+            set_={"refcount": ImageBlob.refcount + 1, "updated_at": now},
+        )
+        db.execute(stmt)
+        return
+
+    updated = db.query(ImageBlob).filter(ImageBlob.hash == digest).update(
+        {ImageBlob.refcount: ImageBlob.refcount + 1, ImageBlob.updated_at: now}, synchronize_session=False
+    )
+    if not updated:
+        db.add(ImageBlob(hash=digest, size=size, refcount=1, created_at=now, updated_at=now))
+        db.flush()
+
+
+def put_image(db: Session, image_bytes: bytes) -> str:
+    """
+    Сохраняет изображение и учитывает одну новую ссылку на него.
+    Возвращает ключ, который нужно записать в image_paths (в той же транзакции).
+    """
+    digest = hashlib.sha256(image_bytes).hexdigest()
+    key = blob_key(digest)
+    storage = get_storage()
+    # Сначала ссылка, потом файл: сборщик мусора удаляет файл, только забрав
+    # строку блоба, поэтому после _acquire он этот файл уже не тронет.
+    _acquire(db, digest, len(image_bytes))
+    refcount = db.query(ImageBlob.refcount).filter(ImageBlob.hash == digest).scalar()
+    with span("file.write", key=key, bytes=len(image_bytes)) as current:
+        # refcount 1 — блоб новый (или его строку только что удалил сборщик)
+        dedup = refcount > 1 and storage.exists(key)
+        if not dedup:
+            storage.write(key, image_bytes, content_type="image/png")
+        if current is not None:
+            current.set_attribute("dedup", dedup)
+    if dedup:
+        logger.debug("image deduplicated", extra={"key": key, "refcount": refcount})
+    return key
+
+
+def release_image(db: Session, value: Optional[str]):
+    """
+    Убирает одну ссылку на изображение (значение из БД: ключ или старый путь).
+    Старые файлы блоков (до хранения по содержимому) ни с чем не делятся
+    и удаляются сразу.
+    """
+    key = storage_key(value)
+    if not key:
+        return
+    digest = blob_hash(key)
+    if digest is not None:
+        db.query(ImageBlob).filter(ImageBlob.hash == digest, ImageBlob.refcount > 0).update(
+            {ImageBlob.refcount: ImageBlob.refcount - 1, ImageBlob.updated_at: datetime.now(timezone.utc)},
+            synchronize_session=False,
+        )
+        return
+    try:
+        get_storage().delete(key)
+    except Exception as e:
+        # Не критично: файл подберёт сборщик мусора
+        logger.warning("file delete failed: %s", e, extra={"key": key})
+
+
+def release_block_entry(db: Session, entry: Dict[str, Any], fields: Iterable[str] = IMAGE_FIELDS):
+    """Убирает ссылки из записи блока в image_paths (по умолчанию — все IMAGE_FIELDS)"""
+    for field in fields:
+        release_image(db, entry.get(field))
@@ -0,0 +1,127 @@
+"""
+Фильтры, сортировка и курсорная пагинация списков (проекты, папки).
+
+Страница — строки строго после курсора в порядке (ключ сортировки, id): запрос
+идёт по индексу (user_id, ключ, id), стоимость не зависит от глубины страницы,
+а вставки новых строк не сдвигают следующие страницы (в отличие от offset).
+Курсор — непрозрачная строка: base64 JSON [сортировка, порядок, значение ключа, id].
+
+Полнотекстовый поиск проектов по name и product_description:
+SQLite — таблица FTS5 projects_fts, PostgreSQL — GIN-индекс по to_tsvector
+(миграция 0004); в остальных БД и без FTS5 — LIKE по каждому слову.
+Слова запроса ищутся по префиксу: «молок» находит «молоко».
+"""
+import base64
+import json
+import re
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from fastapi import HTTPException
+from sqlalchemy import DateTime, String, and_, func, inspect, or_, text, tuple_, type_coerce
+
+from .schemas.schemas import Project
+
+# То же выражение, что в GIN-индексе PostgreSQL (migrations/versions/0004_*), иначе индекс не используется
+PROJECT_TSVECTOR = "to_tsvector('simple', coalesce(projects.name, '') || ' ' || coalesce(projects.product_description, ''))"
+
+_fts_available: Dict[str, bool] = {}
+
+
+def sort_key(db, expr):
+    """
+    Ключ сортировки для курсора. В SQLite даты хранятся строками, причём с разной
+    точностью (server_default без микросекунд), поэтому там ключ сравнивается
+    как сохранённая строка — иначе строка на границе страницы повторится.
+    """
+    if db.get_bind().dialect.name == "sqlite" and isinstance(expr.type, DateTime):
+        return type_coerce(expr, String)
+    return expr
+
+
+def encode_cursor(sort: str, order: str, value: Any, row_id: int) -> str:
+    if isinstance(value, datetime):
+        value = value.isoformat()
+    raw = json.dumps([sort, order, value, row_id], ensure_ascii=False, separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str, sort: str, order: str, expr) -> Tuple[Any, int]:
+    """(значение ключа, id) из курсора; 400 — битый курсор или курсор другой сортировки"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        cursor_sort, cursor_order, value, row_id = json.loads(raw)
+        if not isinstance(row_id, int):
+            raise ValueError(row_id)
+        if isinstance(expr.type, DateTime) and value is not None:
+            value = datetime.fromisoformat(value)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if (cursor_sort, cursor_order) != (sort, order):
+        raise HTTPException(status_code=400, detail="Cursor does not match sort/order")
+    return value, row_id
+
+
+def paginate(query, key, id_column, sort: str, order: str, cursor: Optional[str], limit: Optional[int]):
+    """Сортирует query по (key, id) и отрезает страницу после cursor (limit + 1 строка — для next_cursor)"""
+    descending = order == "desc"
+    if cursor:
+        value, row_id = decode_cursor(cursor, sort, order, key)
+        after = tuple_(key, id_column) < tuple_(value, row_id) if descending \
+            else tuple_(key, id_column) > tuple_(value, row_id)
+        query = query.filter(after)
+    if descending:
+        query = query.order_by(key.desc(), id_column.desc())
+    else:
+        query = query.order_by(key.asc(), id_column.asc())
+    if limit:
+        query = query.limit(limit + 1)
+    return query
+
+
+def page(rows: List[Any], limit: Optional[int], sort: str, order: str, key_of, id_of) -> Tuple[List[Any], Optional[str]]:
+    """Строки страницы и курсор следующей (None — это последняя)"""
+    if not limit or len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    return rows, encode_cursor(sort, order, key_of(rows[-1]), id_of(rows[-1]))
+
+
+def unicode_lower(db, expr):
+    """lower() с Unicode: в SQLite встроенный lower() знает только ASCII, там — py_lower (schemas.py)"""
+    if db.get_bind().dialect.name == "sqlite":
+        return func.py_lower(expr)
+    return func.lower(expr)
+
+
+def _words(q: str) -> List[str]:
+    return re.findall(r"\w+", q.lower())[:16]
+
+
+def _has_fts(db) -> bool:
+    bind = db.get_bind()
+    key = str(bind.url)
+    if key not in _fts_available:
+        _fts_available[key] = inspect(bind).has_table("projects_fts")
+    return _fts_available[key]
+
+
+def project_search_filter(db, q: str):
+    """Условие полнотекстового поиска проектов по q (None — в запросе нет слов)"""
+    words = _words(q)
+    if not words:
+        return None
+    dialect = db.get_bind().dialect.name
+    if dialect == "sqlite" and _has_fts(db):
+        match = " ".join(f'"{w}"*' for w in words)
+        return Project.id.in_(
+            text("SELECT rowid FROM projects_fts WHERE projects_fts MATCH :match").bindparams(match=match)
+        )
+    if dialect == "postgresql":
+        tsquery = " & ".join(f"{w}:*" for w in words)
+        return text(f"{PROJECT_TSVECTOR} @@ to_tsquery('simple', :tsquery)").bindparams(tsquery=tsquery)
+    return and_(*[
+        or_(unicode_lower(db, Project.name).contains(w, autoescape=True),
+            unicode_lower(db, Project.product_description).contains(w, autoescape=True))
+        for w in words
+    ])
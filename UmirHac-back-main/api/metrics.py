@@ -0,0 +1,141 @@
+"""
+Метрики Prometheus для API (GET /metrics):
+- длительность запросов по маршрутам и число SQL-запросов на запрос
+- очередь и время выполнения задач генерации изображений
+- латентность и расход токенов LLM
+- работа сборщика мусора изображений
+- объём ответов до и после сжатия
+
+Метрики раскрывают маршруты и нагрузку, поэтому публично не отдаются:
+METRICS_TOKEN — GET /metrics на порту API только с заголовком
+    Authorization: Bearer <METRICS_TOKEN> (без токена маршрута нет);
+METRICS_PORT — отдельный HTTP-сервер метрик на METRICS_ADDR (по умолчанию
+    127.0.0.1), недоступный снаружи без явной настройки.
+"""
+import hmac
+import logging
+import os
+import time
+from contextvars import ContextVar
+from typing import Any, List, Optional
+
+from fastapi import HTTPException, Request, Response
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Gauge, Histogram, generate_latest, start_http_server
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from .scripts.image_jobs import image_jobs
+
+logger = logging.getLogger("api.metrics")
+
+METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+METRICS_ADDR = os.getenv("METRICS_ADDR", "127.0.0.1")
+
+HTTP_REQUEST_DURATION = Histogram(
+    "http_request_duration_seconds", "Длительность HTTP-запросов",
+    ["method", "route", "status"],
+)
+DB_QUERIES_PER_REQUEST = Histogram(
+    "db_queries_per_request", "Число SQL-запросов на HTTP-запрос",
+    ["method", "route"],
+    buckets=(0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 89, 144),
+)
+DB_QUERY_DURATION = Histogram(
+    "db_query_duration_seconds", "Длительность SQL-запросов",
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1),
+)
+IMAGE_JOBS_PENDING = Gauge("image_jobs_pending", "Блоков с незавершённой задачей генерации изображения")
+IMAGE_JOBS_PENDING.set_function(image_jobs.pending)
+IMAGE_JOB_WAIT = Histogram(
+    "image_job_wait_seconds", "Время от постановки задачи до запроса к сервису изображений", ["kind"],
+    buckets=(0.01, 0.05, 0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120),
+)
+IMAGE_JOB_RUN = Histogram(
+    "image_job_run_seconds", "Время запроса к сервису изображений", ["kind", "outcome"],
+    buckets=(0.1, 0.5, 1, 2, 4, 8, 15, 30, 60, 120, 300, 600),
+)
+LLM_REQUEST_DURATION = Histogram(
+    "llm_request_duration_seconds", "Длительность запросов к LLM", ["stage", "model", "outcome"],
+    buckets=(0.25, 0.5, 1, 2, 4, 8, 15, 30, 60, 120),
+)
+LLM_TOKENS = Counter("llm_tokens_total", "Токены LLM", ["stage", "model", "kind"])
+GC_DELETED_FILES = Counter("image_gc_deleted_files_total", "Файлов изображений удалено сборщиком мусора")
+GC_RECLAIMED_BYTES = Counter("image_gc_reclaimed_bytes_total", "Байт освобождено сборщиком мусора изображений")
+RESPONSE_COMPRESSION_BYTES = Counter(
+    "http_response_compression_bytes_total", "Байт ответов до (in) и после (out) сжатия", ["encoding", "kind"],
+)
+PROJECT_ARCHIVE_OPERATIONS = Counter(
+    "project_archive_operations_total", "Архивация и восстановление проектов", ["operation", "outcome"],
+)
+PROJECT_ARCHIVE_BYTES = Counter(
+    "project_archive_bytes_total", "Байт файлов проектов, перенесённых в архив (files), и размер архивов (bundle)",
+    ["kind"],
+)
+
+# Счётчик SQL-запросов текущего HTTP-запроса. Храним изменяемый список, а не число:
+# синхронные эндпоинты выполняются в threadpool с копией контекста,
+# и присваивание в копии не было бы видно middleware.
+_db_queries: ContextVar[Optional[List[int]]] = ContextVar("db_queries", default=None)
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start", []).append(time.perf_counter())
+    counter = _db_queries.get()
+    if counter is not None:
+        counter[0] += 1
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    starts = conn.info.get("query_start")
+    if starts:
+        DB_QUERY_DURATION.observe(time.perf_counter() - starts.pop())
+
+
+async def metrics_middleware(request: Request, call_next):
+    counter = [0]
+    token = _db_queries.set(counter)
+    t0 = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        _db_queries.reset(token)
+        # шаблон маршрута, а не сырой путь — иначе id проектов раздувают число рядов
+        route = request.scope.get("route")
+        route_path = route.path if route else "unmatched"
+        HTTP_REQUEST_DURATION.labels(request.method, route_path, str(status)).observe(time.perf_counter() - t0)
+        DB_QUERIES_PER_REQUEST.labels(request.method, route_path).observe(counter[0])
+
+
+def metrics_endpoint(request: Request):
+    """GET /metrics на порту API (подключается, только если задан METRICS_TOKEN)"""
+    auth = request.headers.get("authorization", "")
+    if not hmac.compare_digest(auth.encode("utf-8"), f"Bearer {METRICS_TOKEN}".encode("utf-8")):
+        raise HTTPException(status_code=401, detail="Invalid metrics token")
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+
+def start_metrics_server():
+    """Отдельный сервер метрик на METRICS_ADDR:METRICS_PORT (если METRICS_PORT задан)"""
+    if not METRICS_PORT:
+        return
+    try:
+        start_http_server(METRICS_PORT, addr=METRICS_ADDR)
+    except OSError as e:
+        # При WEB_CONCURRENCY > 1 порт занимает первый процесс
+        logger.warning("metrics server not started: %s", e)
+        return
+    logger.info("metrics server started", extra={"addr": METRICS_ADDR, "port": METRICS_PORT})
+
+
+def observe_llm_call(stage: str, model: str, seconds: float, usage: Any = None, ok: bool = True):
+    """Записать вызов LLM: stage — этап генерации (plan/blocks), usage — completion.usage"""
+    LLM_REQUEST_DURATION.labels(stage, model, "ok" if ok else "error").observe(seconds)
+    if usage is not None:
+        LLM_TOKENS.labels(stage, model, "prompt").inc(getattr(usage, "prompt_tokens", 0) or 0)
+        LLM_TOKENS.labels(stage, model, "completion").inc(getattr(usage, "completion_tokens", 0) or 0)
@@ -0,0 +1,118 @@
+"""
+Сводка проекта (таблица project_summary) для списка проектов: число блоков и
+action-блоков сценария, картинок по статусам, время последней активности.
+Список проектов читает её одним запросом вместо разбора JSON-полей, COUNT по
+scenario_element_images и проверки файла сценария в хранилище на каждый проект.
+
+Поддерживается при записи:
+- счётчики картинок — обработчиком after_flush сессии: любой flush, меняющий
+  Project или ScenarioElementImage, в той же транзакции пересчитывает сводку,
+  так что ни один путь генерации / правки её не пропустит;
+- счётчики сценария — record_scenario там, где JSON сценария сохраняется
+  (генерация и правки сценария), сам JSON лежит в хранилище, а не в БД.
+Сводки проектов, созданных до таблицы, строит rebuild_summary при первом запросе списка.
+"""
+import json
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import event, func, insert, select, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+
+from .schemas.schemas import Project, ProjectStatus, ProjectSummary, ScenarioElementImage
+from .storage import get_storage, storage_key
+
+_table = ProjectSummary.__table__
+
+
+def _upsert(conn, project_id: int, values: Dict[str, Any], insert_values: Optional[Dict[str, Any]] = None):
+    """Обновляет поля values строки сводки; если строки нет — создаёт её (с insert_values)"""
+    values = {**values, "last_activity_at": datetime.utcnow()}
+    row = {"project_id": project_id, **(insert_values or {}), **values}
+    dialect = {"sqlite": sqlite, "postgresql": postgresql}.get(conn.dialect.name)
+    if dialect is not None:
+        conn.execute(dialect.insert(_table).values(**row).on_conflict_do_update(
+            index_elements=[_table.c.project_id], set_=values
+        ))
+        return
+    if conn.execute(update(_table).where(_table.c.project_id == project_id).values(**values)).rowcount == 0:
+        conn.execute(insert(_table).values(**row))
+
+
+def _scenario_counts(blocks: Optional[List[Dict[str, Any]]]) -> Dict[str, Any]:
+    blocks = blocks if isinstance(blocks, list) else []
+    return {
+        "blocks_count": len(blocks),
+        "action_blocks_count": sum(1 for b in blocks if isinstance(b, dict) and b.get("type") == "action"),
+    }
+
+
+def _image_counts(conn, project_id: int, image_generation_status: Optional[str]) -> Dict[str, int]:
+    counts = {"images_done": 0, "images_in_progress": 0, "images_failed": 0}
+    try:
+        entries = json.loads(image_generation_status or "{}").get("blocks") or []
+    except (json.JSONDecodeError, TypeError, AttributeError):
+        entries = []
+    for entry in entries:
+        status = entry.get("status") if isinstance(entry, dict) else None
+        if status == ProjectStatus.completed.value:
+            counts["images_done"] += 1
+        elif status == ProjectStatus.in_progress.value:
+            counts["images_in_progress"] += 1
+        elif status == ProjectStatus.failed.value:
+            counts["images_failed"] += 1
+
+    counts["images_count"] = conn.execute(
+        select(func.count()).select_from(ScenarioElementImage.__table__)
+        .where(ScenarioElementImage.project_id == project_id)
+    ).scalar_one()
+    return counts
+
+
+def record_scenario(db: Session, project_id: int, blocks: Optional[List[Dict[str, Any]]]):
+    """Счётчики сценария после сохранения его JSON (blocks — блоки сохранённого сценария)"""
+    _upsert(db.connection(), project_id, {"has_scenario": True, **_scenario_counts(blocks)})
+
+
+def rebuild_summary(db: Session, project: Project) -> ProjectSummary:
+    """Сводка проекта целиком, со сценарием из хранилища (для проектов без неё)"""
+    conn = db.connection()
+    scenario = {"has_scenario": False, **_scenario_counts(None)}
+    if project.result_path:
+        try:
+            data = get_storage().read_json(storage_key(project.result_path))
+            scenario = {"has_scenario": True, **_scenario_counts(data.get("blocks"))}
+        except (OSError, ValueError, AttributeError):
+            pass
+    _upsert(conn, project.id, {**scenario, **_image_counts(conn, project.id, project.image_generation_status)})
+    return db.get(ProjectSummary, project.id, populate_existing=True)
+
+
+@event.listens_for(Session, "after_flush")
+def _after_flush(session: Session, flush_context):
+    # Коллекции new / dirty / deleted здесь ещё в состоянии до flush, а строки уже в БД
+    projects: Dict[int, Optional[Project]] = {}
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(obj, Project) and obj not in session.deleted and obj.id is not None:
+            projects[obj.id] = obj
+        elif isinstance(obj, ScenarioElementImage) and obj.project_id is not None:
+            projects.setdefault(obj.project_id, None)
+    if not projects:
+        return
+
+    conn = session.connection()
+    for project_id, project in projects.items():
+        if project is not None:
+            status_json, has_result = project.image_generation_status, project.result_path is not None
+        else:
+            found = conn.execute(
+                select(Project.image_generation_status, Project.result_path).where(Project.id == project_id)
+            ).first()
+            if found is None:
+                continue
+            status_json, has_result = found[0], found[1] is not None
+        # Новая строка без сценария — считать нечего; с result_path — досчитает rebuild_summary
+        _upsert(conn, project_id, _image_counts(conn, project_id, status_json),
+                insert_values={"has_scenario": None if has_result else False})
+
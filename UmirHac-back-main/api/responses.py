@@ -0,0 +1,41 @@
+"""
+Быстрая сериализация JSON-ответов.
+Эндпоинты с response_model FastAPI уже сериализует через Pydantic (dump_json), а
+ответы-dict проходят jsonable_encoder (рекурсивный обход на Python) и json.dumps.
+Большие ответы-dict (список проектов, сценарий, картинки блоков) возвращают
+ORJSONResponse напрямую: orjson сам сериализует dict/list/datetime/Enum и
+Pydantic-модели, jsonable_encoder не вызывается.
+Без orjson (pip install orjson) ответ собирается как обычный JSONResponse.
+json_line — строка NDJSON для потоковых ответов.
+"""
+import json
+from typing import Any
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel
+
+try:
+    import orjson
+except ImportError:  # orjson — необязательная зависимость
+    orjson = None
+
+
+def _default(obj: Any) -> Any:
+    if isinstance(obj, BaseModel):
+        return obj.model_dump()
+    raise TypeError(f"Type is not JSON serializable: {type(obj).__name__}")
+
+
+class ORJSONResponse(JSONResponse):
+    def render(self, content: Any) -> bytes:
+        if orjson is None:
+            return super().render(jsonable_encoder(content))
+        return orjson.dumps(content, default=_default, option=orjson.OPT_NON_STR_KEYS)
+
+
+def json_line(content: Any) -> bytes:
+    """Одна строка NDJSON (application/x-ndjson) с переводом строки в конце"""
+    if orjson is None:
+        return json.dumps(jsonable_encoder(content), ensure_ascii=False, separators=(",", ":")).encode("utf-8") + b"\n"
+    return orjson.dumps(content, default=_default, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_APPEND_NEWLINE)
@@ -11,9 +11,11 @@ from ..schemas.schemas import get_db
 from ..schemas.schemas import User
 
 import os
+import logging
 from dotenv import load_dotenv
 
 load_dotenv()
+logger = logging.getLogger("api.auth")
 
 ACCESS_TOKEN_EXPIRE_MINUTES = 9999
 SALT = os.getenv("SALT", "m2-boards")
@@ -98,7 +100,7 @@ def register(user_data: RegisterRequest, db: Session = Depends(get_db)):
     # Create access token for the new user
     access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token = create_access_token(
-        data={"sub": user_data.login}, expires_delta=access_token_expires
+        data={"sub": new_user.login, "uid": new_user.id}, expires_delta=access_token_expires
     )
 
     return {
@@ -116,7 +118,7 @@ def login(user_data: LoginRequest, db: Session = Depends(get_db)):
     user = db.query(User).filter((User.login == user_data.login) | (User.email == user_data.login)).first()
 
     if not user:
-        print('this login')
+        logger.info("login failed: unknown user", extra={"user": user_data.login})
         raise HTTPException(
             status_code=400, detail="Invalid login or password")
 
@@ -125,15 +127,15 @@ def login(user_data: LoginRequest, db: Session = Depends(get_db)):
 
     # Check if passwords match
     if hashed_password != user.hashed_password:
-        print('this pass')
+        logger.info("login failed: wrong password", extra={"user": user.login})
         raise HTTPException(
             status_code=400, detail="Invalid login or password")
 
-    print(f"Creating token for user login: {user.login}")
+    logger.debug("creating token", extra={"user": user.login})
     # Create access token for the user (always use login in token)
     access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token = create_access_token(
-        data={"sub": user.login}, expires_delta=access_token_expires
+        data={"sub": user.login, "uid": user.id}, expires_delta=access_token_expires
     )
 
     return {
@@ -1,41 +1,51 @@
-from fastapi import HTTPException, Request, Depends
+import logging
+from dataclasses import dataclass
+from typing import Optional
+
+from fastapi import HTTPException, Request, Response, Depends, Query
 from sqlalchemy.orm import Session
-from sqlalchemy import or_
 from ..schemas.schemas import User, Folder, get_db
 
+logger = logging.getLogger("api.auth")
+
+
+@dataclass(frozen=True)
+class CurrentUser:
+    """Пользователь запроса: id и login из проверенного токена (не ORM-объект, других полей у него нет)"""
+    id: int
+    login: str
 
-def get_current_user(request: Request):
+
+def get_current_user(request: Request, db: Session = Depends(get_db)) -> CurrentUser:
     """
-    Извлекает информацию о текущем пользователе из JWT-токена
+    Текущий пользователь по JWT (подпись и срок проверил middleware и положил
+    claims в request.state). Токенам с uid БД не нужна: id и login берутся из
+    claims, повторного поиска пользователя на каждом запросе нет.
+    Отзыва токенов нет: удалённый или переименованный пользователь сохраняет
+    доступ со старым токеном до его exp (в API нет ни удаления, ни смены логина;
+    когда появятся — нужен claim с версией токена, проверяемый в TokenVerifier).
+    Для старых токенов без uid пользователь один раз ищется по логину / email,
+    найденный id дописывается в закэшированные TokenVerifier claims.
     """
     if not hasattr(request.state, 'user') or request.state.user is None:
         raise HTTPException(status_code=401, detail="Not authenticated")
 
-    # Получаем пользователя из базы данных по логину или email
-    db_gen = get_db()
-    db = next(db_gen)
-    try:
-        # Печатаем отладочную информацию
-        print(f"Looking for user with identifier: {request.state.user}")
-
-        # Сначала ищем по логину
-        user = db.query(User).filter(User.login == request.state.user).first()
-        if user:
-            print(f"Found user by login: {user.login} (id: {user.id})")
-            return user
-
-        # Если по логину не нашли, ищем по email
-        user = db.query(User).filter(User.email == request.state.user).first()
-        if user:
-            print(f"Found user by email: {user.login} (email: {user.email}, id: {user.id})")
-            return user
-
-        # Печатаем всех пользователей для отладки
-        all_users = db.query(User).all()
-        print(f"All users in DB: {[{'id': u.id, 'login': u.login, 'email': u.email} for u in all_users]}")
+    user_id = getattr(request.state, "user_id", None)
+    if user_id is not None:
+        return CurrentUser(id=user_id, login=request.state.user)
+
+    # Сначала ищем по логину, затем по email
+    columns = db.query(User.id, User.login)
+    user = (columns.filter(User.login == request.state.user).first()
+            or columns.filter(User.email == request.state.user).first())
+    if user is None:
+        logger.warning("user from token not found", extra={"user": request.state.user})
         raise HTTPException(status_code=401, detail="User not found")
-    finally:
-        db.close()
+
+    claims = getattr(request.state, "claims", None)
+    if claims is not None and claims.get("sub") == user.login:
+        claims["uid"] = user.id
+    return CurrentUser(id=user.id, login=user.login)
 
 
 def get_folder_by_id(folder_id: int, user_id: int, db: Session):
@@ -45,4 +55,31 @@ def get_folder_by_id(folder_id: int, user_id: int, db: Session):
     folder = db.query(Folder).filter(Folder.id == folder_id, Folder.user_id == user_id).first()
     if not folder:
         raise HTTPException(status_code=404, detail="Folder not found")
-    return folder
\ No newline at end of file
+    return folder
+
+
+def prefer_minimal(
+    request: Request,
+    response: Response,
+    return_: Optional[str] = Query(
+        None,
+        alias="return",
+        description="minimal — в ответе только изменённые блоки и версия сценария, без полного сценария",
+    ),
+) -> bool:
+    """
+    Клиент просит короткий ответ на изменение: ?return=minimal или заголовок
+    Prefer: return=minimal (RFC 7240). Параметр запроса важнее заголовка.
+    """
+    preference = return_
+    if preference is None:
+        for token in request.headers.get("prefer", "").split(","):
+            name, _, value = token.split(";", 1)[0].strip().partition("=")
+            if name.strip().lower() == "return":
+                preference = value.strip().strip('"')
+    minimal = (preference or "").lower() == "minimal"
+
+    response.headers["Vary"] = "Prefer"
+    if minimal:
+        response.headers["Preference-Applied"] = "return=minimal"
+    return minimal
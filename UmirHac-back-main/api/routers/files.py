@@ -0,0 +1,36 @@
+import mimetypes
+
+from fastapi import APIRouter, HTTPException, Query
+from fastapi.responses import StreamingResponse
+
+from ..storage import get_storage, LocalStorage
+
+router = APIRouter(
+    prefix="/files",
+    tags=["files"]
+)
+
+
+@router.get("/{key:path}")
+def download_file(key: str, expires: int = Query(...), sig: str = Query(...)):
+    """
+    Скачивание файла по подписанной ссылке (Storage.url) для локального хранилища.
+    Доступ без JWT: право на файл даёт подпись, ссылка живёт до expires.
+    При S3 ссылки ведут прямо в хранилище, этот эндпоинт не нужен.
+    """
+    storage = get_storage()
+    if not isinstance(storage, LocalStorage):
+        raise HTTPException(status_code=404, detail="Not found")
+    if not storage.verify(key, expires, sig):
+        raise HTTPException(status_code=403, detail="Invalid or expired link")
+
+    try:
+        chunks = storage.iter_read(key)
+    except (FileNotFoundError, ValueError):
+        raise HTTPException(status_code=404, detail="File not found")
+
+    media_type = mimetypes.guess_type(key)[0] or "application/octet-stream"
+    return StreamingResponse(chunks, media_type=media_type, headers={
+        "Content-Length": str(storage.size(key)),
+        "Cache-Control": "private, max-age=3600",
+    })
@@ -1,12 +1,16 @@
-from fastapi import APIRouter, HTTPException, Depends
+from fastapi import APIRouter, HTTPException, Depends, Query, BackgroundTasks
 from fastapi.security import HTTPBearer
+from sqlalchemy import func
 from sqlalchemy.orm import Session
 from pydantic import BaseModel
-from typing import List, Optional
+from typing import Dict, List, Literal, Optional
 from datetime import datetime
 
-from ..schemas.schemas import get_db, User, Folder, Project
-from .dependencies import get_current_user
+from ..schemas.schemas import get_db, Folder, Project
+from .dependencies import CurrentUser, get_current_user
+from ..listing import sort_key, paginate, page, unicode_lower
+from ..archive import schedule_folder
+from ..responses import ORJSONResponse
 
 security = HTTPBearer()
 
@@ -28,6 +32,7 @@ class ProjectInfo(BaseModel):
     created_at: datetime
     updated_at: Optional[datetime] = None
     product_description: Optional[str] = None
+    archived: bool = False  # файлы проекта в архиве (api/archive.py)
 
 
 class FolderResponse(BaseModel):
@@ -40,16 +45,42 @@ class FolderResponse(BaseModel):
     projects: List[ProjectInfo]
 
 
+def _project_info(proj: Project) -> dict:
+    """ProjectInfo в виде dict — для ответов через ORJSONResponse"""
+    return {
+        "id": proj.id,
+        "name": proj.name,
+        "status": proj.status.value,
+        "created_at": proj.created_at,
+        "updated_at": proj.updated_at,
+        "product_description": proj.product_description,
+        "archived": proj.archive_key is not None,
+    }
+
+
+def _folder_info(folder: Folder, projects: List[Project]) -> dict:
+    """FolderResponse в виде dict — для ответов через ORJSONResponse"""
+    return {
+        "id": folder.id,
+        "name": folder.name,
+        "user_id": folder.user_id,
+        "archived": bool(folder.archived),
+        "created_at": folder.created_at,
+        "updated_at": folder.updated_at,
+        "projects": [_project_info(proj) for proj in projects],
+    }
+
+
 class UpdateFolderRequest(BaseModel):
     name: Optional[str] = None
     archived: Optional[bool] = None
 
 
 @router.post("/", response_model=FolderResponse)
-async def create_folder(
+def create_folder(
     request: FolderRequest,
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    current_user: CurrentUser = Depends(get_current_user)
 ):
     """
     Создать новую папку
@@ -72,7 +103,8 @@ async def create_folder(
             status=proj.status.value,
             created_at=proj.created_at,
             updated_at=proj.updated_at,
-            product_description=proj.product_description
+            product_description=proj.product_description,
+            archived=proj.archive_key is not None
         )
         for proj in projects
     ]
@@ -88,52 +120,55 @@ async def create_folder(
     )
 
 
-@router.get("/", response_model=List[FolderResponse])
-async def get_user_folders(
+@router.get("/", response_model=List[FolderResponse], response_class=ORJSONResponse)
+def get_user_folders(
+    archived: Optional[bool] = Query(None),
+    q: Optional[str] = Query(None, max_length=200, description="подстрока названия папки"),
+    sort: Literal["created_at", "name"] = Query("created_at"),
+    order: Literal["asc", "desc"] = Query("asc"),
+    limit: Optional[int] = Query(None, ge=1, le=500, description="размер страницы; без него — все папки"),
+    cursor: Optional[str] = Query(None, description="значение X-Next-Cursor предыдущей страницы"),
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    current_user: CurrentUser = Depends(get_current_user)
 ):
     """
-    Получить все папки пользователя с информацией о проектах
+    Получить папки пользователя с информацией о проектах.
+    Фильтры archived и q, сортировка sort/order; постранично — limit и cursor,
+    курсор следующей страницы — в заголовке X-Next-Cursor (нет — страница последняя).
+    Ответ собирается из dict и сериализуется orjson (response_model — для схемы в /docs).
     """
-    folders = db.query(Folder).filter(Folder.user_id == current_user.id).all()
-
-    folders_response = []
-    for folder in folders:
-        # Получаем проекты, связанные с этой папкой
-        projects = db.query(Project).filter(Project.folder_id == folder.id).all()
-        project_infos = [
-            ProjectInfo(
-                id=proj.id,
-                name=proj.name,
-                status=proj.status.value,
-                created_at=proj.created_at,
-                updated_at=proj.updated_at,
-                product_description=proj.product_description
-            )
-            for proj in projects
-        ]
-
-        folders_response.append(
-            FolderResponse(
-                id=folder.id,
-                name=folder.name,
-                user_id=folder.user_id,
-                archived=folder.archived,
-                created_at=folder.created_at,
-                updated_at=folder.updated_at,
-                projects=project_infos
-            )
-        )
+    # created_at совпадает с порядком id
+    key = sort_key(db, Folder.id if sort == "created_at" else Folder.name)
+    query = db.query(Folder, key).filter(Folder.user_id == current_user.id)
+    if archived is not None:
+        in_archive = func.coalesce(Folder.archived, False).is_(True)
+        query = query.filter(in_archive if archived else ~in_archive)
+    if q:
+        query = query.filter(unicode_lower(db, Folder.name).contains(q.lower(), autoescape=True))
+
+    rows, next_cursor = page(
+        paginate(query, key, Folder.id, sort, order, cursor, limit).all(),
+        limit, sort, order, key_of=lambda row: row[1], id_of=lambda row: row[0].id,
+    )
+    folders = [folder for folder, _ in rows]
 
-    return folders_response
+    # Проекты всех папок страницы — одним запросом
+    projects_by_folder: Dict[int, List[Project]] = {folder.id: [] for folder in folders}
+    if folders:
+        for proj in db.query(Project).filter(Project.folder_id.in_(list(projects_by_folder))).order_by(Project.id):
+            projects_by_folder[proj.folder_id].append(proj)
 
+    response = ORJSONResponse([_folder_info(folder, projects_by_folder[folder.id]) for folder in folders])
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return response
 
-@router.get("/{folder_id}", response_model=FolderResponse)
-async def get_folder(
+
+@router.get("/{folder_id}", response_model=FolderResponse, response_class=ORJSONResponse)
+def get_folder(
     folder_id: int,
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    current_user: CurrentUser = Depends(get_current_user)
 ):
     """
     Получить информацию о папке и проектах в ней
@@ -144,38 +179,21 @@ async def get_folder(
 
     # Получаем проекты, связанные с этой папкой
     projects = db.query(Project).filter(Project.folder_id == folder.id).all()
-    project_infos = [
-        ProjectInfo(
-            id=proj.id,
-            name=proj.name,
-            status=proj.status.value,
-            created_at=proj.created_at,
-            updated_at=proj.updated_at,
-            product_description=proj.product_description
-        )
-        for proj in projects
-    ]
-
-    return FolderResponse(
-        id=folder.id,
-        name=folder.name,
-        user_id=folder.user_id,
-        archived=folder.archived,
-        created_at=folder.created_at,
-        updated_at=folder.updated_at,
-        projects=project_infos
-    )
+    return ORJSONResponse(_folder_info(folder, projects))
 
 
 @router.put("/{folder_id}", response_model=FolderResponse)
-async def update_folder(
+def update_folder(
     folder_id: int,
     request: UpdateFolderRequest,
+    background_tasks: BackgroundTasks,
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    current_user: CurrentUser = Depends(get_current_user)
 ):
     """
-    Обновить папку
+    Обновить папку.
+    Архивация папки переносит файлы её проектов в архив фоновой задачей
+    (api/archive.py), снятие архивности — возвращает их.
     """
     folder = db.query(Folder).filter(Folder.id == folder_id, Folder.user_id == current_user.id).first()
     if not folder:
@@ -184,11 +202,14 @@ async def update_folder(
     # Обновляем поля, если они предоставлены
     if request.name is not None:
         folder.name = request.name
+    archived_changed = request.archived is not None and bool(folder.archived) != request.archived
     if request.archived is not None:
         folder.archived = request.archived
 
     db.commit()
     db.refresh(folder)
+    if archived_changed:
+        schedule_folder(background_tasks, db, folder)
 
     # Получаем проекты, связанные с этой папкой
     projects = db.query(Project).filter(Project.folder_id == folder.id).all()
@@ -199,7 +220,8 @@ async def update_folder(
             status=proj.status.value,
             created_at=proj.created_at,
             updated_at=proj.updated_at,
-            product_description=proj.product_description
+            product_description=proj.product_description,
+            archived=proj.archive_key is not None
         )
         for proj in projects
     ]
@@ -216,10 +238,10 @@ async def update_folder(
 
 
 @router.delete("/{folder_id}")
-async def delete_folder(
+def delete_folder(
     folder_id: int,
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    current_user: CurrentUser = Depends(get_current_user)
 ):
     """
     Удалить папку
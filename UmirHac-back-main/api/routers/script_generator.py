@@ -1,13 +1,13 @@
 from fastapi import APIRouter, HTTPException, Depends, BackgroundTasks, Request, Query
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, StreamingResponse
 from fastapi.security import HTTPBearer
+from sqlalchemy import func
 from sqlalchemy.orm import Session
-from pydantic import BaseModel
-from typing import Optional, List, Dict, Any, Set
+from pydantic import BaseModel, Field
+from typing import Optional, List, Dict, Any, Set, Tuple, Iterable, Literal
 import os
 import json
 import base64
-from pathlib import Path
 from datetime import datetime
 import requests
 from PIL import Image
@@ -15,17 +15,35 @@ import io
 import threading
 import time
 import mimetypes
-import base64
-from pathlib import Path
+import uuid
+import asyncio
+import logging
 
 from deep_translator import GoogleTranslator
 
-from ..schemas.schemas import get_db, User, Folder, Project, ProjectStatus, ScenarioElementImage
+from ..schemas.schemas import get_db, Folder, Project, ProjectStatus, ProjectSummary, ScenarioElementImage
 from ..scripts.script_generator import generate_ad_script
-from .dependencies import get_current_user, get_folder_by_id
+from ..scripts.image_jobs import image_jobs, ImageJob
+from ..scripts import job_queue
+from ..scripts.image_backends import get_image_backend, ImageBackend, ImageBackendError
+from .dependencies import CurrentUser, get_current_user, get_folder_by_id, prefer_minimal
+from ..metrics import IMAGE_JOB_WAIT, IMAGE_JOB_RUN
+from ..tracing import span
+from ..storage import Storage, get_storage, storage_key, project_key
+from ..image_store import put_image, release_image, release_block_entry
+from ..block_order import ensure_block_order, allocate_block_index, place_block, rerank
+from ..responses import ORJSONResponse, json_line
+from ..project_summary import record_scenario, rebuild_summary
+from ..listing import sort_key, paginate, page, project_search_filter
+from ..archive import ensure_restored
+
+logger = logging.getLogger("api.script_generator")
 
 security = HTTPBearer()
 
+# google — перевод промптов через Google Translate, none — без перевода (бенчмарки, офлайн)
+TRANSLATOR = os.getenv("TRANSLATOR", "google").lower()
+
 router = APIRouter(
     prefix="/script-generator",
     tags=["script-generator"],
@@ -90,6 +108,7 @@ class GenerateImageResponse(BaseModel):
     project_id: int
     status: str
     message: str
+    job_id: Optional[str] = None
 
 class GenerateElementImageRequest(BaseModel):
     project_id: int
@@ -109,15 +128,21 @@ class EditImageForBlockRequest(BaseModel):
 
 class ImagePathData(BaseModel):
     index: int
-    image_path: Optional[str] = None
+    image_path: Optional[str] = None  # ключ файла в хранилище
+    preview_path: Optional[str] = None
+    image_url: Optional[str] = None  # прямая ссылка на скачивание (действует час)
+    preview_url: Optional[str] = None
 
 class ImageDescriptionData(BaseModel):
     index: int
     image_description: Optional[str] = None
+    seed: Optional[int] = None
 
 class ImageGenerationStatus(BaseModel):
     index: int
     status: str
+    stage: Optional[str] = None  # "preview" — готов черновик, "final" — полноразмерное изображение
+    job_id: Optional[str] = None  # идентификатор пакетной задачи (generate_images)
 
 class ProjectStatusResponse(BaseModel):
     project_id: int
@@ -134,9 +159,26 @@ class ProjectStatusResponse(BaseModel):
     image_generation_status: Optional[List[ImageGenerationStatus]] = None
     image_paths: Optional[List[ImagePathData]] = None
     image_descriptions: Optional[List[ImageDescriptionData]] = None
+    image_seed: Optional[int] = None
     
 class ScenarioReorderRequest(BaseModel):
     new_order: List[int]
+
+class ScenarioBlockOperation(BaseModel):
+    """
+    Операция пакетного изменения блоков:
+    add — type/content/formatting и position (None — в конец),
+    update — index и изменяемые поля, delete — index, move — index и position.
+    """
+    op: Literal["add", "update", "delete", "move"]
+    index: Optional[int] = None
+    position: Optional[int] = Field(None, ge=0)  # 0-based позиция в массиве blocks
+    type: Optional[str] = None
+    content: Optional[Dict[str, Any]] = None
+    formatting: Optional[Dict[str, Any]] = None
+
+class ScenarioBatchRequest(BaseModel):
+    operations: List[ScenarioBlockOperation] = Field(..., min_length=1, max_length=500)
     
 class EditImageRequest(BaseModel):
     project_id: int
@@ -145,28 +187,50 @@ class EditImageRequest(BaseModel):
 class GenerateImageForBlockRequest(BaseModel):
     project_id: int
     block_index: int
+    progressive: bool = False  # сначала быстрый черновик, затем полноразмерное изображение
+    seed: Optional[int] = None  # задаёт seed проекта; по умолчанию используется Project.image_seed
+
+class GenerateImagesRequest(BaseModel):
+    block_indices: Optional[List[int]] = None  # None — все action-блоки сценария
+    seed: Optional[int] = None  # задаёт seed проекта; по умолчанию используется Project.image_seed
+
+class GenerateImagesResponse(BaseModel):
+    project_id: int
+    job_id: str
+    status: str
+    block_indices: List[int]
+    coalesced_block_indices: List[int] = []  # блоки, для которых такая же задача уже идёт
+    message: str
+
+class CancelImageJobResponse(BaseModel):
+    job_id: str
+    project_id: int
+    cancelled_block_indices: List[int]
 
-def _remap_indices_for_images(project: Project, index_map: Dict[int, int], db: Session):
+def _clear_images_for_block(project: Project, block_index: int, db: Session):
     """
-    Перекидывает индексы картинок и статусов по произвольному отображению:
-    old_index -> new_index.
-    Используется при полном reorder блоков.
+    Удаляет все данные по изображениям для блока с данным index:
+    - записи в ScenarioElementImage
+    - записи в JSON-полях Project.image_paths / image_descriptions / image_generation_status
+    и отменяет идущую генерацию для блока, чтобы она не записала устаревший результат.
     """
-    if not index_map:
-        return
+    image_jobs.cancel_for_blocks(project.id, block_indices=[block_index])
 
-    # 1. ScenarioElementImage
-    images = db.query(ScenarioElementImage).filter(
-        ScenarioElementImage.project_id == project.id
+    # 1. Удаляем записи ScenarioElementImage и ссылки на их файлы
+    element_images = db.query(ScenarioElementImage).filter(
+        ScenarioElementImage.project_id == project.id,
+        ScenarioElementImage.element_index == block_index
     ).all()
 
-    for img in images:
-        old_idx = img.element_index
-        if old_idx in index_map:
-            img.element_index = index_map[old_idx]
+    for img in element_images:
+        release_image(db, img.image_path)
+        db.delete(img)
 
-    # 2. JSON-поля проекта
-    def _remap_json(field_value: Optional[str]) -> Optional[str]:
+    # и ссылки из image_paths (итоговое изображение и черновик)
+    release_block_entry(db, _get_block_entry(project.image_paths, block_index))
+
+    # 2. Удаляем блок из JSON-полей по index
+    def _remove_from_json(field_value: Optional[str]) -> Optional[str]:
         if not field_value:
             return field_value
         try:
@@ -178,120 +242,338 @@ def _remap_indices_for_images(project: Project, index_map: Dict[int, int], db: S
         if not isinstance(blocks, list):
             return field_value
 
-        for b in blocks:
-            idx = b.get("index")
-            if isinstance(idx, int) and idx in index_map:
-                b["index"] = index_map[idx]
-
+        data["blocks"] = [b for b in blocks if b.get("index") != block_index]
         return json.dumps(data, ensure_ascii=False)
 
-    project.image_paths = _remap_json(project.image_paths)
-    project.image_descriptions = _remap_json(project.image_descriptions)
-    project.image_generation_status = _remap_json(project.image_generation_status)
+    project.image_paths = _remove_from_json(project.image_paths)
+    project.image_descriptions = _remove_from_json(project.image_descriptions)
+    project.image_generation_status = _remove_from_json(project.image_generation_status)
+
 
-def _shift_indices_for_images(project: Project, start_index: int, delta: int, db: Session):
+def _upsert_block_entry(field_value: Optional[str], block_index: int, values: Dict[str, Any]) -> str:
     """
-    Смещает индексы для всех блоков >= start_index на delta
-    и в БД, и в JSON-полях проекта.
-    Используется при вставке/удалении блоков.
+    Обновляет (или добавляет) запись блока с данным index
+    в JSON-поле проекта вида {"blocks": [{"index": ..., ...}]}.
     """
-    if delta == 0:
-        return
+    data = json.loads(field_value) if field_value else {"blocks": []}
+    existing_blocks = data.get("blocks", [])
 
-    # 1. ScenarioElementImage
-    images = db.query(ScenarioElementImage).filter(
-        ScenarioElementImage.project_id == project.id,
-        ScenarioElementImage.element_index >= start_index,
-    ).all()
+    for block in existing_blocks:
+        if block.get("index") == block_index:
+            block.update(values)
+            break
+    else:
+        existing_blocks.append({"index": block_index, **values})
 
-    for img in images:
-        img.element_index = img.element_index + delta
+    return json.dumps({"blocks": existing_blocks}, ensure_ascii=False)
 
-    # 2. JSON-поля проекта
-    def _shift_json(field_value: Optional[str]) -> Optional[str]:
-        if not field_value:
-            return field_value
-        try:
-            data = json.loads(field_value)
-        except (json.JSONDecodeError, TypeError):
-            return field_value
 
-        blocks = data.get("blocks")
-        if not isinstance(blocks, list):
-            return field_value
+def _get_block_entry(field_value: Optional[str], block_index: int) -> Dict[str, Any]:
+    """Возвращает запись блока с данным index из JSON-поля проекта (или пустой dict)"""
+    if not field_value:
+        return {}
+    try:
+        data = json.loads(field_value)
+    except (json.JSONDecodeError, TypeError):
+        return {}
+    for block in data.get("blocks", []):
+        if block.get("index") == block_index:
+            return block
+    return {}
 
-        for b in blocks:
-            idx = b.get("index")
-            if isinstance(idx, int) and idx >= start_index:
-                b["index"] = idx + delta
 
-        return json.dumps(data, ensure_ascii=False)
+def _project_seed(project: Project, requested_seed: Optional[int]) -> Optional[int]:
+    """
+    Seed для генерации изображений проекта.
+    Явно переданный seed запоминается как seed проекта, иначе берётся сохранённый
+    Project.image_seed. None — seed выберет сервис, и он станет seed проекта.
+    """
+    if requested_seed is not None:
+        project.image_seed = requested_seed
+    return project.image_seed
 
-    project.image_paths = _shift_json(project.image_paths)
-    project.image_descriptions = _shift_json(project.image_descriptions)
-    project.image_generation_status = _shift_json(project.image_generation_status)
 
+async def _propagate_cancel(backend: ImageBackend, jobs: List[ImageJob]):
+    """
+    Ждёт, пока все переданные задачи будут отменены, и сообщает об этом
+    сервису изображений, чтобы он прервал инференс на GPU.
+    Запускается рядом с запросом к сервису и снимается после его завершения.
+    """
+    while not all(job.is_cancelled for job in jobs):
+        await asyncio.sleep(0.5)
+    await backend.cancel(jobs[0].job_id)
 
-def _clear_images_for_block(project: Project, block_index: int, db: Session):
+
+async def _call_image_backend(call, jobs: List[ImageJob], kind: str) -> Optional[Dict[str, Any]]:
     """
-    Удаляет все данные по изображениям для блока с данным index:
-    - записи в ScenarioElementImage
-    - записи в JSON-полях Project.image_paths / image_descriptions / image_generation_status
+    Выполняет вызов сервиса изображений (корутину call), прерывая его при отмене jobs.
+    Возвращает ответ сервиса или None, если он не смог выполнить запрос.
+    kind (generate/preview/batch/edit) — метка для метрик.
     """
-    # 1. Удаляем записи ScenarioElementImage и сами файлы (если есть)
-    element_images = db.query(ScenarioElementImage).filter(
-        ScenarioElementImage.project_id == project.id,
-        ScenarioElementImage.element_index == block_index
-    ).all()
+    if jobs:
+        IMAGE_JOB_WAIT.labels(kind).observe(time.monotonic() - min(job.created_at for job in jobs))
+    watcher = asyncio.create_task(_propagate_cancel(get_image_backend(), jobs)) if jobs else None
+    t0 = time.perf_counter()
+    outcome = "error"
+    try:
+        with span(f"image_backend.{kind}", job_id=jobs[0].job_id if jobs else None):
+            result = await call
+        outcome = "ok"
+        return result
+    except ImageBackendError as e:
+        logger.warning("image backend error: %s", e, extra={"job_id": jobs[0].job_id if jobs else None})
+        if jobs and all(job.is_cancelled for job in jobs):
+            outcome = "cancelled"
+        return None
+    finally:
+        IMAGE_JOB_RUN.labels(kind, outcome).observe(time.perf_counter() - t0)
+        if watcher is not None:
+            watcher.cancel()
+
+
+def _set_block_images(project: Project, block_index: int, keys: Dict[str, Optional[str]], db: Session):
+    """
+    Записывает ключи изображений блока (image_path / preview_path / original_path)
+    в image_paths. Ссылки на новые файлы уже учтены put_image, ссылки на прежние снимаются.
+    """
+    release_block_entry(db, _get_block_entry(project.image_paths, block_index), keys)
+    project.image_paths = _upsert_block_entry(project.image_paths, block_index, keys)
 
-    for img in element_images:
-        if img.image_path and os.path.exists(img.image_path):
-            try:
-                os.remove(img.image_path)
-            except OSError:
-                # Не критично, если файл не удалился
-                pass
-        db.delete(img)
 
-    # 2. Удаляем блок из JSON-полей по index
-    def _remove_from_json(field_value: Optional[str]) -> Optional[str]:
-        if not field_value:
-            return field_value
-        try:
-            data = json.loads(field_value)
-        except (json.JSONDecodeError, TypeError):
-            return field_value
+def _file_url(value: Optional[str]) -> Optional[str]:
+    """Ссылка для прямого скачивания файла (presigned URL / подписанная ссылка /files)"""
+    key = storage_key(value)
+    return get_storage().url(key) if key else None
 
-        blocks = data.get("blocks")
-        if not isinstance(blocks, list):
-            return field_value
 
-        data["blocks"] = [b for b in blocks if b.get("index") != block_index]
-        return json.dumps(data, ensure_ascii=False)
+def _image_path_data(block: Dict[str, Any]) -> ImagePathData:
+    """Запись image_paths блока + ссылки на скачивание"""
+    return ImagePathData(
+        index=block["index"],
+        image_path=block.get("image_path"),
+        preview_path=block.get("preview_path"),
+        image_url=_file_url(block.get("image_path")),
+        preview_url=_file_url(block.get("preview_path")),
+    )
 
-    project.image_paths = _remove_from_json(project.image_paths)
-    project.image_descriptions = _remove_from_json(project.image_descriptions)
-    project.image_generation_status = _remove_from_json(project.image_generation_status)
+
+def _json_blocks(field_value: Optional[str]) -> Optional[List[Dict[str, Any]]]:
+    """Список blocks из JSON-поля проекта (None — поля нет или оно битое)"""
+    if not field_value:
+        return None
+    try:
+        data = json.loads(field_value)
+    except (json.JSONDecodeError, TypeError):
+        return None
+    blocks = data.get("blocks") if isinstance(data, dict) else None
+    return blocks if isinstance(blocks, list) else None
+
+
+def _image_fields(project: Project) -> Tuple[
+    Optional[List[ImageGenerationStatus]], Optional[List[ImagePathData]], Optional[List[ImageDescriptionData]]
+]:
+    """
+    JSON-поля картинок проекта в виде моделей ответа: image_generation_status,
+    image_paths, image_descriptions.
+    """
+    statuses = _json_blocks(project.image_generation_status)
+    paths = _json_blocks(project.image_paths)
+    descriptions = _json_blocks(project.image_descriptions)
+    return (
+        [ImageGenerationStatus(**block) for block in statuses] if statuses is not None else None,
+        [_image_path_data(block) for block in paths] if paths is not None else None,
+        [
+            ImageDescriptionData(
+                index=block["index"], image_description=block.get("image_description"), seed=block.get("seed")
+            )
+            for block in descriptions
+        ] if descriptions is not None else None,
+    )
+
+
+def _load_scenario(project: Project, missing_detail: str = "Scenario file not found") -> dict:
+    """
+    Читает JSON сценария проекта из хранилища (404, если сценария нет).
+    Сценарию без rank / next_block_index они дописываются (см. block_order).
+    Проект из архива сначала восстанавливается, поэтому project — уже проверенный
+    на принадлежность пользователю.
+    """
+    ensure_restored(project)
+    key = storage_key(project.result_path)
+    if not key:
+        raise HTTPException(status_code=404, detail=missing_detail)
+    try:
+        scenario_data = get_storage().read_json(key)
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail=missing_detail)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error reading scenario file: {str(e)}")
+    ensure_block_order(scenario_data)
+    return scenario_data
+
+
+def _find_block(blocks: List[Dict[str, Any]], block_index: int) -> Optional[Dict[str, Any]]:
+    """Блок сценария с данным index (index — постоянный идентификатор блока, не позиция)"""
+    for block in blocks:
+        if block.get("index") == block_index:
+            return block
+    return None
+
+
+# Операции над блоками сценария в памяти: меняют только scenario_data и говорят,
+# картинки каких блоков сбросить. Сохранение и коммит — _commit_scenario_changes,
+# поэтому пакет операций (/blocks/batch) пишет сценарий и БД один раз.
+
+def _set_blocks(scenario_data: dict, blocks: List[Dict[str, Any]]):
+    scenario_data.setdefault("original_blocks_count", len(scenario_data.get("blocks") or []))
+    scenario_data["blocks"] = blocks
+    scenario_data["final_blocks_count"] = len(blocks)
+
+
+def _add_block(scenario_data: dict, block_data: Dict[str, Any], position: Optional[int]) -> Dict[str, Any]:
+    """Вставляет новый блок в позицию position (None или больше длины — в конец)"""
+    blocks = scenario_data.get("blocks") or []
+    new_block = {
+        "type": block_data["type"],
+        "content": block_data["content"],
+        "formatting": block_data["formatting"],
+        "index": allocate_block_index(scenario_data),
+    }
+    place_block(blocks, new_block, len(blocks) if position is None else position)
+    _set_blocks(scenario_data, blocks)
+    return new_block
+
+
+def _update_block(scenario_data: dict, block_index: int, update_data: Dict[str, Any]) -> Tuple[Dict[str, Any], bool]:
+    """
+    Частично обновляет блок. Возвращает блок и признак, что его картинки нужно сбросить:
+    у action-блока изменилось содержимое или тип.
+    """
+    blocks = scenario_data.get("blocks") or []
+    block = _find_block(blocks, block_index)
+    if block is None:
+        raise HTTPException(status_code=404, detail="Block with given index not found")
+
+    old_type = block.get("type")
+    old_content = block.get("content")
+    for field in ("type", "content", "formatting"):
+        if field in update_data:
+            block[field] = update_data[field]
+
+    clear_images = old_type == "action" and (block.get("type") != "action" or block.get("content") != old_content)
+    _set_blocks(scenario_data, blocks)
+    return block, clear_images
+
+
+def _delete_block(scenario_data: dict, block_index: int):
+    """Удаляет блок (его index повторно не выдаётся); картинки блока нужно сбросить"""
+    blocks = scenario_data.get("blocks") or []
+    block = _find_block(blocks, block_index)
+    if block is None:
+        raise HTTPException(status_code=404, detail="Block with given index not found")
+    _set_blocks(scenario_data, [b for b in blocks if b is not block])
+
+
+def _move_block(scenario_data: dict, block_index: int, position: int) -> Dict[str, Any]:
+    """Переносит блок в позицию position: меняется только его rank"""
+    blocks = scenario_data.get("blocks") or []
+    block = _find_block(blocks, block_index)
+    if block is None:
+        raise HTTPException(status_code=404, detail="Block with given index not found")
+    place_block(blocks, block, position)
+    scenario_data["blocks"] = blocks
+    return block
+
+
+def _commit_scenario_changes(project: Project, scenario_data: dict, cleared: Iterable[int], db: Session):
+    """
+    Сбрасывает картинки блоков cleared, сохраняет сценарий и коммитит проект.
+    Сценарий записывается один раз; если запись или коммит не удались,
+    БД откатывается и в хранилище возвращается прежнее содержимое файла.
+    """
+    storage = get_storage()
+    key = storage_key(project.result_path)
+    try:
+        previous = storage.read(key) if key else None
+    except FileNotFoundError:
+        previous = None
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error reading scenario file: {str(e)}")
+
+    written = False
+    try:
+        for block_index in sorted(set(cleared)):
+            _clear_images_for_block(project, block_index, db)
+        _save_scenario(project, scenario_data, db)
+        written = True
+        project.updated_at = datetime.utcnow()
+        db.add(project)
+        db.commit()
+    except Exception:
+        db.rollback()
+        if written:
+            try:
+                if previous is None:
+                    storage.delete(key)
+                else:
+                    storage.write(key, previous, content_type="application/json")
+            except Exception:
+                logger.exception("failed to restore scenario file %s of project %s", key, project.id)
+        raise
+
+
+def _save_scenario(project: Project, scenario_data: dict, db: Session):
+    """
+    Записывает JSON сценария проекта в хранилище, увеличивая его version,
+    и обновляет счётчики блоков в сводке проекта (фиксируются вместе с коммитом)
+    """
+    scenario_data["version"] = int(scenario_data.get("version") or 0) + 1
+    try:
+        get_storage().write_json(storage_key(project.result_path), scenario_data)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error writing scenario file: {str(e)}")
+    record_scenario(db, project.id, scenario_data.get("blocks"))
 
 
 def translate_ru_to_en(text: str) -> str:
     """
     Переводит текст с русского на английский.
-    Если перевод не удался — возвращает исходный текст.
+    Если перевод не удался (или отключён TRANSLATOR=none) — возвращает исходный текст.
     """
+    if TRANSLATOR == "none":
+        return text
     try:
-        return GoogleTranslator(source="ru", target="en").translate(text)
+        with span("translate_ru_to_en", chars=len(text)):
+            return GoogleTranslator(source="ru", target="en").translate(text)
     except Exception as e:
-        print(f"Translation error: {e}")
+        logger.warning("translation failed: %s", e)
         return text
 
 
+def translate_ru_to_en_batch(texts: List[str]) -> List[str]:
+    """
+    Переводит список текстов одним обращением к переводчику.
+    При ошибке пакетного перевода — переводит по одному (translate_ru_to_en).
+    """
+    if not texts:
+        return []
+    if TRANSLATOR == "none":
+        return list(texts)
+    try:
+        with span("translate_ru_to_en_batch", texts=len(texts)):
+            translated = GoogleTranslator(source="ru", target="en").translate_batch(texts)
+        return [t if t else src for t, src in zip(translated, texts)]
+    except Exception as e:
+        logger.warning("batch translation failed: %s", e)
+        return [translate_ru_to_en(t) for t in texts]
+
+
 @router.post("/generate", response_model=GenerateScriptResponse)
-async def generate_script_endpoint(
+def generate_script_endpoint(
     request: GenerateScriptRequest,
     background_tasks: BackgroundTasks,
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    current_user: CurrentUser = Depends(get_current_user)
 ):
     """
     Эндпоинт для генерации рекламного сценария
@@ -315,20 +597,15 @@ async def generate_script_endpoint(
     db.commit()
     db.refresh(project)
 
-    # Определяем путь для сохранения JSON файла
-    user_data_dir = Path("api/users_data") / str(current_user.id) / str(project.id)
-    user_data_dir.mkdir(parents=True, exist_ok=True)
-
-    output_file = user_data_dir / f"{current_user.id}_{project.id}_scenario.json"
+    # Ключ JSON файла сценария в хранилище
+    output_file = project_key(current_user.id, project.id, f"{current_user.id}_{project.id}_scenario.json")
 
     # Добавляем задачу в фон для генерации сценария
-    background_tasks.add_task(
-        process_script_generation,
-        project.id,
-        request.product_description,
-        str(output_file),
-        db
-    )
+    job_queue.dispatch(background_tasks, db, "script", {
+        "project_id": project.id,
+        "product_description": request.product_description,
+        "output_file": output_file,
+    })
 
     return GenerateScriptResponse(
         project_id=project.id,
@@ -349,7 +626,8 @@ def process_script_generation(
         # Вызываем функцию генерации сценария
         result = generate_ad_script(
             product_description=product_description,
-            output_file=output_file_path
+            output_file=output_file_path,
+            save=lambda script_data: get_storage().write_json(output_file_path, script_data)
         )
 
         if result:
@@ -358,6 +636,7 @@ def process_script_generation(
             if project:
                 project.status = ProjectStatus.completed
                 project.result_path = output_file_path
+                record_scenario(db, project.id, result)
                 db.commit()
         else:
             # Если произошла ошибка при генерации, ставим статус "failed"
@@ -368,18 +647,24 @@ def process_script_generation(
 
     except Exception as e:
         # В случае ошибки обновляем статус на "failed"
+        logger.exception("script generation failed", extra={"project_id": project_id})
         project = db.query(Project).filter(Project.id == project_id).first()
         if project:
             project.status = ProjectStatus.failed
             db.commit()
 
 
+job_queue.register("script", lambda db, payload, jobs: process_script_generation(
+    payload["project_id"], payload["product_description"], payload["output_file"], db
+))
+
+
 @router.post("/generate_image_for_block", response_model=GenerateImageResponse)
-async def generate_image_for_block_endpoint(
+def generate_image_for_block_endpoint(
     request: GenerateImageForBlockRequest,
     background_tasks: BackgroundTasks,
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    current_user: CurrentUser = Depends(get_current_user)
 ):
     """
     Эндпоинт для генерации изображения для конкретного блока сценария
@@ -390,23 +675,16 @@ async def generate_image_for_block_endpoint(
     if not project:
         raise HTTPException(status_code=404, detail="Project not found")
 
-    # Проверяем, что проект имеет сценарий
-    if not project.result_path or not os.path.exists(project.result_path):
-        raise HTTPException(status_code=404, detail="Scenario JSON not found")
-
-    # Читаем сценарий из JSON файла
-    with open(project.result_path, 'r', encoding='utf-8') as f:
-        scenario_data = json.load(f)
+    # Читаем сценарий (404, если его нет)
+    scenario_data = _load_scenario(project, "Scenario JSON not found")
 
     blocks = scenario_data.get('blocks', [])
 
-    # Проверяем, что указанный индекс блока корректен
-    if request.block_index < 1 or request.block_index > len(blocks):
+    # Получаем нужный блок по его index
+    block = _find_block(blocks, request.block_index)
+    if block is None:
         raise HTTPException(status_code=400, detail="Invalid block index")
 
-    # Получаем нужный блок
-    block = blocks[request.block_index - 1]
-
     block_type = block.get('type')
     if block_type != 'action':
         raise HTTPException(
@@ -417,187 +695,158 @@ async def generate_image_for_block_endpoint(
     block_content = block.get('content', {})
     description = block_content.get('description', '')
     image_description = f"Действие: {description}"
+    seed = _project_seed(project, request.seed)
+
+    # Повторный клик по тому же блоку с тем же текстом — склеиваем с уже идущей задачей
+    job, created = image_jobs.submit(project.id, request.block_index, f"{image_description}|seed={seed}")
+    if not created:
+        return GenerateImageResponse(
+            project_id=project.id,
+            status="in_progress",
+            message=f"Image generation for block {request.block_index} of project {project.id} is already in progress",
+            job_id=job.job_id
+        )
 
     # Do not change the overall project status, only track image generation status
     # Create or update the image generation status separately
     
-    current_status = json.loads(project.image_generation_status) if project.image_generation_status else {"blocks": []}
-    existing_blocks = current_status.get("blocks", [])
-
-    # Check if this block already exists in the status list
-    block_exists = False
-    for block in existing_blocks:
-        if block.get("index") == request.block_index:
-            block["status"] = ProjectStatus.in_progress.value
-            block_exists = True
-            break
-
-    if not block_exists:
-        existing_blocks.append({
-            "index": request.block_index,
-            "status": ProjectStatus.in_progress.value
-        })
-
-    project.image_generation_status = json.dumps({"blocks": existing_blocks})
+    # stage сбрасываем: черновика/финала для нового запуска ещё нет
+    project.image_generation_status = _upsert_block_entry(
+        project.image_generation_status, request.block_index,
+        {"status": ProjectStatus.in_progress.value, "stage": None, "job_id": job.job_id}
+    )
     db.commit()
 
-    # Определяем путь для сохранения PNG файла
-    user_data_dir = Path("api/users_data") / str(current_user.id) / str(project.id)
-    user_data_dir.mkdir(parents=True, exist_ok=True)
-
-    image_file = user_data_dir / f"{current_user.id}_{project.id}_block_{request.block_index}_image.png"
-
     # Добавляем задачу в фон для генерации изображения
-    background_tasks.add_task(
-        process_image_generation,
-        project.id,
-        image_description,  # Используем промт, извлеченный из JSON-блока
-        str(image_file),
-        db
-    )
+    # (в прогрессивном режиме сначала сохраняется черновик низкого разрешения)
+    job_queue.dispatch(background_tasks, db, "image.generate", {
+        "project_id": project.id,
+        "image_description": image_description,  # Используем промт, извлеченный из JSON-блока
+        "block_index": request.block_index,
+        "progressive": request.progressive,
+        "seed": seed,
+    }, [job])
 
     return GenerateImageResponse(
         project_id=project.id,
         status="in_progress",
-        message=f"Image generation started for block {request.block_index} of project {project.id}"
+        message=f"Image generation started for block {request.block_index} of project {project.id}",
+        job_id=job.job_id
     )
 
 def process_image_generation(
     project_id: int,
     image_description: str,
-    output_file_path: str,
-    db: Session
+    block_index: Optional[int],
+    db: Session,
+    progressive: bool = False,
+    job: Optional[ImageJob] = None,
+    seed: Optional[int] = None
 ):
     """
-    Фоновая задача для генерации изображения
+    Фоновая задача для генерации изображения.
+    progressive — сначала быстрый черновик (1 шаг, низкое разрешение),
+    затем полноразмерное изображение с тем же seed. Обе версии записываются
+    в image_paths блока (preview_path / image_path).
+    Фактический seed сохраняется в image_descriptions блока и, если у проекта
+    его ещё нет, становится seed проекта.
+    Если задача отменена (блок изменили/удалили) — результат не записывается.
     """
+    def cancelled() -> bool:
+        return job is not None and job.is_cancelled
+
     try:
-        # Подключаемся к серверу заглушке для генерации изображения
-        import httpx
-        import asyncio
-        
+        backend = get_image_backend()
+
+        async def request_image_async(prompt: str, preview: bool, seed: Optional[int]):
+            result = await _call_image_backend(
+                backend.generate(prompt, preview=preview, seed=seed, job_id=job.job_id if job else None),
+                [job] if job else [],
+                "preview" if preview else "generate"
+            )
+            if result is None:
+                return None, seed
+            # Декодируем base64 изображение
+            return base64.b64decode(result["image"]), result.get("seed", seed)
 
         # Асинхронная функция для генерации изображения
         async def generate_image_async():
+            used_seed = seed
             translated_prompt = translate_ru_to_en(image_description)
-            print(f"Translated prompt: {translated_prompt}")
-            async with httpx.AsyncClient() as client:
-                response = await client.post(
-                    "http://127.0.0.1:3339/generate_image",
-                    json={"prompt": translated_prompt},
-                    timeout=6000.0  # таймаут 60 секунд
-                )
-
-                if response.status_code == 200:
-                    result = response.json()
-                    image_data = result["image"]
+            logger.debug("translated prompt: %s", translated_prompt)
 
-                    # Декодируем base64 изображение и сохраняем в файл
-                    image_bytes = base64.b64decode(image_data)
-                    with open(output_file_path, "wb") as f:
-                        f.write(image_bytes)
-
-                    # Обновляем статус проекта на "completed" и сохраняем путь к файлу
+            # 1. Черновик: отдаём его фронту как можно раньше
+            if progressive and block_index is not None:
+                preview_bytes, used_seed = await request_image_async(
+                    translated_prompt, preview=True, seed=used_seed
+                )
+                if preview_bytes is not None and not cancelled():
                     project = db.query(Project).filter(Project.id == project_id).first()
                     if project:
-                        project.status = ProjectStatus.completed
-                        project.image_path = output_file_path
-                        # For single image generation, also update the JSON fields with a single block
-                        # Extract block index from the filename if it's for a specific block
-                        import re
-                        match = re.search(r'block_(\d+)_', output_file_path)
-                        if match:
-                            block_index = int(match.group(1))
-                            # Update JSON fields for block-specific image
-                            image_paths = json.loads(project.image_paths) if project.image_paths else {"blocks": []}
-                            existing_blocks = image_paths.get("blocks", [])
-                            # Check if this block already exists in the list
-                            block_exists = any(block.get("index") == block_index for block in existing_blocks)
-                            if not block_exists:
-                                existing_blocks.append({
-                                    "index": block_index,
-                                    "image_path": output_file_path
-                                })
-                            else:
-                                # Update existing entry
-                                for block in existing_blocks:
-                                    if block.get("index") == block_index:
-                                        block["image_path"] = output_file_path
-                                        break
-                            project.image_paths = json.dumps({"blocks": existing_blocks})
-
-                            image_descriptions = json.loads(project.image_descriptions) if project.image_descriptions else {"blocks": []}
-                            existing_descriptions = image_descriptions.get("blocks", [])
-                            desc_exists = any(block.get("index") == block_index for block in existing_descriptions)
-                            if not desc_exists:
-                                existing_descriptions.append({
-                                    "index": block_index,
-                                    "image_description": image_description
-                                })
-                            else:
-                                # Update existing entry
-                                for block in existing_descriptions:
-                                    if block.get("index") == block_index:
-                                        block["image_description"] = image_description
-                                        break
-                            project.image_descriptions = json.dumps({"blocks": existing_descriptions})
-
-                            image_status = json.loads(project.image_generation_status) if project.image_generation_status else {"blocks": []}
-                            existing_status = image_status.get("blocks", [])
-                            status_exists = any(block.get("index") == block_index for block in existing_status)
-                            if not status_exists:
-                                existing_status.append({
-                                    "index": block_index,
-                                    "status": ProjectStatus.completed.value
-                                })
-                            else:
-                                # Update existing entry
-                                for block in existing_status:
-                                    if block.get("index") == block_index:
-                                        block["status"] = ProjectStatus.completed.value
-                                        break
-                            project.image_generation_status = json.dumps({"blocks": existing_status})
-                        else:
-                            # For non-block specific images, just update the old field
-                            project.image_path = output_file_path
+                        preview_key = put_image(db, preview_bytes)
+                        _set_block_images(project, block_index, {"preview_path": preview_key}, db)
+                        project.image_generation_status = _upsert_block_entry(
+                            project.image_generation_status, block_index,
+                            {"status": ProjectStatus.in_progress.value, "stage": "preview"}
+                        )
                         db.commit()
 
-                    return True
-                else:
-                    # Если произошла ошибка при генерации, ставим статус "failed"
-                    project = db.query(Project).filter(Project.id == project_id).first()
-                    if project:
-                        # Don't change the main project status, only update image generation status
-                        import re
-                        match = re.search(r'block_(\d+)_', output_file_path)
-                        if match:
-                            block_index = int(match.group(1))
-                            image_status = json.loads(project.image_generation_status) if project.image_generation_status else {"blocks": []}
-                            existing_status = image_status.get("blocks", [])
-                            status_exists = any(block.get("index") == block_index for block in existing_status)
-                            if not status_exists:
-                                existing_status.append({
-                                    "index": block_index,
-                                    "status": ProjectStatus.failed.value
-                                })
-                            else:
-                                # Update existing entry
-                                for block in existing_status:
-                                    if block.get("index") == block_index:
-                                        block["status"] = ProjectStatus.failed.value
-                                        break
-                            project.image_generation_status = json.dumps({"blocks": existing_status})
-                        db.commit()
-                    return False
+            # 2. Полноразмерное изображение
+            if cancelled():
+                return False
+            image_bytes, used_seed = await request_image_async(
+                translated_prompt, preview=False, seed=used_seed
+            )
+
+            if cancelled():
+                # Блок изменили или удалили, пока шла генерация — результат устарел
+                logger.info("image job cancelled, result discarded", extra={"job_id": job.job_id})
+                return False
+
+            if image_bytes is not None:
+                # Обновляем статус проекта на "completed" и сохраняем ключ файла
+                project = db.query(Project).filter(Project.id == project_id).first()
+                if project:
+                    project.status = ProjectStatus.completed
+                    if project.image_seed is None:
+                        project.image_seed = used_seed
+                    if block_index is not None:
+                        # Update JSON fields for block-specific image
+                        _set_block_images(
+                            project, block_index, {"image_path": put_image(db, image_bytes), "original_path": None}, db
+                        )
+                        project.image_descriptions = _upsert_block_entry(
+                            project.image_descriptions, block_index,
+                            {"image_description": image_description, "seed": used_seed}
+                        )
+                        project.image_generation_status = _upsert_block_entry(
+                            project.image_generation_status, block_index,
+                            {"status": ProjectStatus.completed.value, "stage": "final"}
+                        )
+                    db.commit()
+
+                return True
+            else:
+                # Если произошла ошибка при генерации, ставим статус "failed"
+                project = db.query(Project).filter(Project.id == project_id).first()
+                if project:
+                    # Don't change the main project status, only update image generation status
+                    if block_index is not None:
+                        project.image_generation_status = _upsert_block_entry(
+                            project.image_generation_status, block_index,
+                            {"status": ProjectStatus.failed.value}
+                        )
+                    db.commit()
+                return False
 
         # Запускаем асинхронную функцию
         asyncio.run(generate_image_async())
 
     except Exception as e:
         # В случае ошибки обновляем статус на "failed"
-        print(f"Error during image generation: {e}")
+        logger.exception("image generation failed", extra={"project_id": project_id})
         project = db.query(Project).filter(Project.id == project_id).first()
-        if project:
+        if project and not cancelled():
             # Don't change the main project status, only update image generation status
             # For general image generation (not block-specific), we still use JSON fields
             
@@ -612,193 +861,333 @@ def process_image_generation(
 
             project.image_generation_status = json.dumps({"blocks": existing_blocks})
             db.commit()
+    finally:
+        if job is not None:
+            image_jobs.finish(job)
 
-def process_image_editing(
-    project_id: int,
-    image_description: str,
-    original_image_path: str,
-    output_file_path: str,
-    db: Session
-):
-    """
-    Фоновая задача для редактирования изображения
-    """
-    try:
-        import httpx
-        import asyncio
-        import base64
-        
-        import re
-
-        # Асинхронная функция для редактирования изображения
-        async def edit_image_async():
-            # Читаем оригинальное изображение и кодируем в base64
-            with open(original_image_path, "rb") as f:
-                original_image_bytes = f.read()
-            original_image_base64 = base64.b64encode(original_image_bytes).decode('utf-8')
-
-            translated_prompt = translate_ru_to_en(image_description)
-            print(f"Translated prompt: {translated_prompt}")
-            async with httpx.AsyncClient() as client:
-                response = await client.post(
-                    "http://127.0.0.1:3339/edit_image",
-                    json={
-                        "prompt": translated_prompt,
-                        "image_base64": original_image_base64
-                    },
-                    timeout=6000.0  # больший таймаут для редактирования
-                )
-
-                if response.status_code == 200:
-                    result = response.json()
-                    image_data = result["image"]
-
-                    # Декодируем base64 изображение и сохраняем в файл
-                    image_bytes = base64.b64decode(image_data)
-                    with open(output_file_path, "wb") as f:
-                        f.write(image_bytes)
-
-                    # Обновляем статус проекта на "completed" и сохраняем путь к файлу
-                    project = db.query(Project).filter(Project.id == project_id).first()
-                    if project:
-                        project.status = ProjectStatus.completed
-                        project.image_path = output_file_path
-                        # For edited block-specific images, update the JSON fields
-                        match = re.search(r'block_(\d+)_', output_file_path)
-                        if match:
-                            block_index = int(match.group(1))
-                            # Update JSON fields for block-specific image
-                            image_paths = json.loads(project.image_paths) if project.image_paths else {"blocks": []}
-                            existing_blocks = image_paths.get("blocks", [])
-                            # Check if this block already exists in the list
-                            block_exists = any(block.get("index") == block_index for block in existing_blocks)
-                            if not block_exists:
-                                existing_blocks.append({
-                                    "index": block_index,
-                                    "image_path": output_file_path
-                                })
-                            else:
-                                # Update existing entry
-                                for block in existing_blocks:
-                                    if block.get("index") == block_index:
-                                        block["image_path"] = output_file_path
-                                        break
-                            project.image_paths = json.dumps({"blocks": existing_blocks})
-
-                            image_descriptions = json.loads(project.image_descriptions) if project.image_descriptions else {"blocks": []}
-                            existing_descriptions = image_descriptions.get("blocks", [])
-                            desc_exists = any(block.get("index") == block_index for block in existing_descriptions)
-                            if not desc_exists:
-                                existing_descriptions.append({
-                                    "index": block_index,
-                                    "image_description": image_description
-                                })
-                            else:
-                                # Update existing entry
-                                for block in existing_descriptions:
-                                    if block.get("index") == block_index:
-                                        block["image_description"] = image_description
-                                        break
-                            project.image_descriptions = json.dumps({"blocks": existing_descriptions})
-
-                            image_status = json.loads(project.image_generation_status) if project.image_generation_status else {"blocks": []}
-                            existing_status = image_status.get("blocks", [])
-                            status_exists = any(block.get("index") == block_index for block in existing_status)
-                            if not status_exists:
-                                existing_status.append({
-                                    "index": block_index,
-                                    "status": ProjectStatus.completed.value
-                                })
-                            else:
-                                # Update existing entry
-                                for block in existing_status:
-                                    if block.get("index") == block_index:
-                                        block["status"] = ProjectStatus.completed.value
-                                        break
-                            project.image_generation_status = json.dumps({"blocks": existing_status})
-                        db.commit()
-
-                    return True
-                else:
-                    # Если произошла ошибка при редактировании, ставим статус "failed"
-                    project = db.query(Project).filter(Project.id == project_id).first()
-                    if project:
-                        # Don't change the main project status, only update image generation status
-                        match = re.search(r'block_(\d+)_', output_file_path)
-                        if match:
-                            block_index = int(match.group(1))
-                            image_status = json.loads(project.image_generation_status) if project.image_generation_status else {"blocks": []}
-                            existing_status = image_status.get("blocks", [])
-                            status_exists = any(block.get("index") == block_index for block in existing_status)
-                            if not status_exists:
-                                existing_status.append({
-                                    "index": block_index,
-                                    "status": ProjectStatus.failed.value
-                                })
-                            else:
-                                # Update existing entry
-                                for block in existing_status:
-                                    if block.get("index") == block_index:
-                                        block["status"] = ProjectStatus.failed.value
-                                        break
-                            project.image_generation_status = json.dumps({"blocks": existing_status})
-                        db.commit()
-                    return False
-
-        # Запускаем асинхронную функцию
-        asyncio.run(edit_image_async())
-
-    except Exception as e:
-        # В случае ошибки обновляем статус на "failed"
-        print(f"Error during image editing: {e}")
-        project = db.query(Project).filter(Project.id == project_id).first()
-        if project:
-            # Don't change the main project status, only update image generation status
-            # For general image editing (not block-specific), we still use JSON fields
-            
-            current_status = json.loads(project.image_generation_status) if project.image_generation_status else {"blocks": []}
-            existing_blocks = current_status.get("blocks", [])
-
-            # Mark any in-progress blocks as failed
-            for block in existing_blocks:
-                if block.get("status") == ProjectStatus.in_progress.value:
-                    block["status"] = ProjectStatus.failed.value
 
-            project.image_generation_status = json.dumps({"blocks": existing_blocks})
-            db.commit()
+job_queue.register("image.generate", lambda db, payload, jobs: process_image_generation(
+    payload["project_id"], payload["image_description"], payload["block_index"], db,
+    payload.get("progressive", False), jobs[0] if jobs else None, payload.get("seed")
+))
 
-@router.post("/edit_image_for_block", response_model=GenerateImageResponse)
-async def edit_image_for_block_endpoint(
-    request: EditImageForBlockRequest,
+@router.post("/generate_images/{project_id}", response_model=GenerateImagesResponse)
+def generate_images_endpoint(
+    project_id: int,
+    request: GenerateImagesRequest,
     background_tasks: BackgroundTasks,
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    current_user: CurrentUser = Depends(get_current_user)
 ):
     """
-    Эндпоинт для редактирования изображения для конкретного блока сценария
-    Можно использовать промт из блока или указать свой
+    Эндпоинт для генерации изображений сразу для всей раскадровки.
+    - сценарий читается один раз, статусы всех блоков пишутся одним коммитом
+    - промпты переводятся пакетно и уходят в сервис изображений одним батчем
+    - возвращается один job_id на всю задачу (он же виден в image_generation_status блоков)
     """
     # Проверяем, что проект существует и принадлежит пользователю
-    project = db.query(Project).filter(Project.id == request.project_id, Project.user_id == current_user.id).first()
+    project = db.query(Project).filter(Project.id == project_id, Project.user_id == current_user.id).first()
     if not project:
         raise HTTPException(status_code=404, detail="Project not found")
 
     # Проверяем, что проект имеет сценарий
-    if not project.result_path or not os.path.exists(project.result_path):
-        raise HTTPException(status_code=404, detail="Scenario JSON not found")
-
-    # Читаем сценарий из JSON файла
-    with open(project.result_path, 'r', encoding='utf-8') as f:
-        scenario_data = json.load(f)
+    scenario_data = _load_scenario(project, "Scenario JSON not found")
 
     blocks = scenario_data.get('blocks', [])
 
-    # Проверяем, что указанный индекс блока корректен
-    if request.block_index < 1 or request.block_index > len(blocks):
-        raise HTTPException(status_code=400, detail="Invalid block index")
+    by_index = {b.get('index'): b for b in blocks}
 
-    # Получаем нужный блок
-    block = blocks[request.block_index - 1]
+    # Выбираем блоки: переданные индексы или все action-блоки (в порядке сценария)
+    if request.block_indices is None:
+        block_indices = [b['index'] for b in blocks if b.get('type') == 'action']
+    else:
+        block_indices = sorted(set(request.block_indices))
+        for idx in block_indices:
+            if idx not in by_index:
+                raise HTTPException(status_code=400, detail=f"Invalid block index {idx}")
+            if by_index[idx].get('type') != 'action':
+                raise HTTPException(
+                    status_code=400,
+                    detail=f"Image generation is allowed only for 'action' blocks (block {idx})"
+                )
+
+    if not block_indices:
+        raise HTTPException(status_code=400, detail="Scenario has no action blocks")
+
+    job_id = uuid.uuid4().hex
+    seed = _project_seed(project, request.seed)
+
+    # (index, описание, задача) для каждого блока задачи
+    items = []
+    coalesced = []
+    for idx in block_indices:
+        description = by_index[idx].get('content', {}).get('description', '')
+        image_description = f"Действие: {description}"
+
+        job, created = image_jobs.submit(project.id, idx, f"{image_description}|seed={seed}", job_id=job_id)
+        if not created:
+            # Для блока уже идёт генерация с тем же текстом
+            coalesced.append(idx)
+            continue
+
+        items.append((idx, image_description, job))
+
+        project.image_generation_status = _upsert_block_entry(
+            project.image_generation_status, idx,
+            {"status": ProjectStatus.in_progress.value, "stage": None, "job_id": job_id}
+        )
+
+    db.commit()
+
+    if items:
+        job_queue.dispatch(background_tasks, db, "image.batch", {
+            "project_id": project.id,
+            "job_id": job_id,
+            "items": [[idx, image_description] for idx, image_description, _ in items],
+            "seed": seed,
+        }, [job for _, _, job in items])
+
+    return GenerateImagesResponse(
+        project_id=project.id,
+        job_id=job_id,
+        status="in_progress",
+        block_indices=[idx for idx, _, _ in items],
+        coalesced_block_indices=coalesced,
+        message=f"Image generation started for {len(items)} blocks of project {project.id}"
+    )
+
+def process_batch_image_generation(
+    project_id: int,
+    job_id: str,
+    items: List[tuple],
+    db: Session,
+    seed: Optional[int] = None
+):
+    """
+    Фоновая задача для пакетной генерации изображений.
+    items — список (block_index, image_description, job).
+    Все блоки генерируются с одним seed (seed проекта).
+    Результаты отменённых блоков не записываются; если отменены все —
+    сервис изображений прерывает инференс.
+    """
+    jobs = [job for _, _, job in items]
+    try:
+        async def generate_images_async():
+            translated_prompts = translate_ru_to_en_batch([desc for _, desc, _ in items])
+            result = await _call_image_backend(
+                get_image_backend().generate_batch(translated_prompts, seed=seed, job_id=job_id),
+                jobs,
+                "batch"
+            )
+            if result is None:
+                return None, seed
+            return result["images"], result.get("seed", seed)
+
+        images, used_seed = asyncio.run(generate_images_async())
+
+        project = db.query(Project).filter(Project.id == project_id).first()
+        if not project:
+            return
+
+        if images is None or len(images) != len(items):
+            for idx, _, job in items:
+                if not job.is_cancelled:
+                    project.image_generation_status = _upsert_block_entry(
+                        project.image_generation_status, idx, {"status": ProjectStatus.failed.value}
+                    )
+            db.commit()
+            return
+
+        for (idx, image_description, job), image_data in zip(items, images):
+            if job.is_cancelled:
+                # Блок изменили или удалили, пока шла генерация
+                continue
+
+            image_key = put_image(db, base64.b64decode(image_data))
+            _set_block_images(project, idx, {"image_path": image_key, "original_path": None}, db)
+            project.image_descriptions = _upsert_block_entry(
+                project.image_descriptions, idx,
+                {"image_description": image_description, "seed": used_seed}
+            )
+            project.image_generation_status = _upsert_block_entry(
+                project.image_generation_status, idx,
+                {"status": ProjectStatus.completed.value, "stage": "final", "job_id": job_id}
+            )
+
+        if project.image_seed is None:
+            project.image_seed = used_seed
+        db.commit()
+
+    except Exception as e:
+        logger.exception("batch image generation failed", extra={"project_id": project_id, "job_id": job_id})
+        db.rollback()
+        project = db.query(Project).filter(Project.id == project_id).first()
+        if project:
+            for idx, _, job in items:
+                if not job.is_cancelled:
+                    project.image_generation_status = _upsert_block_entry(
+                        project.image_generation_status, idx, {"status": ProjectStatus.failed.value}
+                    )
+            db.commit()
+    finally:
+        for job in jobs:
+            image_jobs.finish(job)
+
+
+def _run_batch_image_generation(db: Session, payload: Dict[str, Any], jobs: List[ImageJob]):
+    # Задачи блоков сопоставляются с items по индексу блока
+    by_index = {job.block_index: job for job in jobs}
+    items = [(idx, description, by_index[idx]) for idx, description in payload["items"] if idx in by_index]
+    process_batch_image_generation(payload["project_id"], payload["job_id"], items, db, payload.get("seed"))
+
+
+job_queue.register("image.batch", _run_batch_image_generation)
+
+def process_image_editing(
+    project_id: int,
+    image_description: str,
+    original_image_path: str,
+    block_index: Optional[int],
+    db: Session,
+    job: Optional[ImageJob] = None,
+    seed: Optional[int] = None
+):
+    """
+    Фоновая задача для редактирования изображения.
+    seed — seed блока (с ним картинка была сгенерирована), чтобы правка
+    оставалась в том же стиле. VAE-латенты исходной картинки кэширует сервис,
+    поэтому повторные правки блока не кодируют её заново.
+    Если задача отменена (блок изменили/удалили) — результат не записывается.
+    """
+    def cancelled() -> bool:
+        return job is not None and job.is_cancelled
+
+    try:
+        # Асинхронная функция для редактирования изображения
+        async def edit_image_async():
+            # Читаем оригинальное изображение и кодируем в base64
+            original_image_bytes = get_storage().read(storage_key(original_image_path))
+            original_image_base64 = base64.b64encode(original_image_bytes).decode('utf-8')
+
+            translated_prompt = translate_ru_to_en(image_description)
+            logger.debug("translated prompt: %s", translated_prompt)
+            result = await _call_image_backend(
+                get_image_backend().edit(
+                    translated_prompt, original_image_base64, seed=seed,
+                    job_id=job.job_id if job else None
+                ),
+                [job] if job else [],
+                "edit"
+            )
+
+            if cancelled():
+                # Блок изменили или удалили, пока шло редактирование — результат устарел
+                logger.info("image job cancelled, result discarded", extra={"job_id": job.job_id})
+                return False
+
+            if result is not None:
+                image_data = result["image"]
+
+                # Декодируем base64 изображение
+                image_bytes = base64.b64decode(image_data)
+
+                # Обновляем статус проекта на "completed" и сохраняем ключ файла
+                project = db.query(Project).filter(Project.id == project_id).first()
+                if project:
+                    project.status = ProjectStatus.completed
+                    # For edited block-specific images, update the JSON fields
+                    if block_index is not None:
+                        edited_key = put_image(db, image_bytes)
+                        entry = _get_block_entry(project.image_paths, block_index)
+                        if entry.get("original_path"):
+                            # Прошлая правка больше не нужна, исходник остаётся
+                            _set_block_images(project, block_index, {"image_path": edited_key}, db)
+                        else:
+                            # Первая правка: ссылка на исходник переходит в original_path
+                            project.image_paths = _upsert_block_entry(
+                                project.image_paths, block_index,
+                                {"image_path": edited_key, "original_path": entry.get("image_path")}
+                            )
+                        project.image_descriptions = _upsert_block_entry(
+                            project.image_descriptions, block_index,
+                            {"image_description": image_description, "seed": result.get("seed", seed)}
+                        )
+                        project.image_generation_status = _upsert_block_entry(
+                            project.image_generation_status, block_index,
+                            {"status": ProjectStatus.completed.value, "stage": "final"}
+                        )
+                    db.commit()
+
+                return True
+            else:
+                # Если произошла ошибка при редактировании, ставим статус "failed"
+                project = db.query(Project).filter(Project.id == project_id).first()
+                if project:
+                    # Don't change the main project status, only update image generation status
+                    if block_index is not None:
+                        project.image_generation_status = _upsert_block_entry(
+                            project.image_generation_status, block_index,
+                            {"status": ProjectStatus.failed.value}
+                        )
+                    db.commit()
+                return False
+
+        # Запускаем асинхронную функцию
+        asyncio.run(edit_image_async())
+
+    except Exception as e:
+        # В случае ошибки обновляем статус на "failed"
+        logger.exception("image editing failed", extra={"project_id": project_id})
+        project = db.query(Project).filter(Project.id == project_id).first()
+        if project and not cancelled():
+            # Don't change the main project status, only update image generation status
+            # For general image editing (not block-specific), we still use JSON fields
+            
+            current_status = json.loads(project.image_generation_status) if project.image_generation_status else {"blocks": []}
+            existing_blocks = current_status.get("blocks", [])
+
+            # Mark any in-progress blocks as failed
+            for block in existing_blocks:
+                if block.get("status") == ProjectStatus.in_progress.value:
+                    block["status"] = ProjectStatus.failed.value
+
+            project.image_generation_status = json.dumps({"blocks": existing_blocks})
+            db.commit()
+    finally:
+        if job is not None:
+            image_jobs.finish(job)
+
+
+job_queue.register("image.edit", lambda db, payload, jobs: process_image_editing(
+    payload["project_id"], payload["image_description"], payload["original_image_path"],
+    payload["block_index"], db, jobs[0] if jobs else None, payload.get("seed")
+))
+
+@router.post("/edit_image_for_block", response_model=GenerateImageResponse)
+def edit_image_for_block_endpoint(
+    request: EditImageForBlockRequest,
+    background_tasks: BackgroundTasks,
+    db: Session = Depends(get_db),
+    current_user: CurrentUser = Depends(get_current_user)
+):
+    """
+    Эндпоинт для редактирования изображения для конкретного блока сценария
+    Можно использовать промт из блока или указать свой
+    """
+    # Проверяем, что проект существует и принадлежит пользователю
+    project = db.query(Project).filter(Project.id == request.project_id, Project.user_id == current_user.id).first()
+    if not project:
+        raise HTTPException(status_code=404, detail="Project not found")
+
+    # Читаем сценарий (404, если его нет)
+    scenario_data = _load_scenario(project, "Scenario JSON not found")
+
+    blocks = scenario_data.get('blocks', [])
+
+    # Получаем нужный блок по его index
+    block = _find_block(blocks, request.block_index)
+    if block is None:
+        raise HTTPException(status_code=400, detail="Invalid block index")
 
     block_type = block.get('type')
     if block_type != 'action':
@@ -821,103 +1210,106 @@ async def edit_image_for_block_endpoint(
             )
         image_description = request.custom_prompt
 
-    # Устанавливаем путь к оригинальному изображению
-    user_data_dir = Path("api/users_data") / str(current_user.id) / str(project.id)
-    original_image_path = user_data_dir / f"{current_user.id}_{project.id}_block_{request.block_index}_image.png"
+    # Правки всегда применяются к исходному изображению блока
+    entry = _get_block_entry(project.image_paths, request.block_index)
+    original_image_path = entry.get("original_path") or entry.get("image_path")
 
     # Проверяем, что изображение существует
-    if not os.path.exists(original_image_path):
+    if not original_image_path or not get_storage().exists(storage_key(original_image_path)):
         raise HTTPException(status_code=404, detail="Original image not found. Generate the image first.")
 
+    # Правим с тем же seed, с которым блок был сгенерирован
+    seed = _get_block_entry(project.image_descriptions, request.block_index).get("seed", project.image_seed)
+
+    # Повторный запуск того же редактирования склеиваем с уже идущей задачей
+    job, created = image_jobs.submit(project.id, request.block_index, f"edit:{image_description}|seed={seed}")
+    if not created:
+        return GenerateImageResponse(
+            project_id=project.id,
+            status="in_progress",
+            message=f"Image editing for block {request.block_index} of project {project.id} is already in progress",
+            job_id=job.job_id
+        )
+
     # Do not change the overall project status, only track image generation status
     # Create or update the image generation status separately
-    
-    current_status = json.loads(project.image_generation_status) if project.image_generation_status else {"blocks": []}
-    existing_blocks = current_status.get("blocks", [])
-
-    # Check if this block already exists in the status list
-    block_exists = False
-    for block in existing_blocks:
-        if block.get("index") == request.block_index:
-            block["status"] = ProjectStatus.in_progress.value
-            block_exists = True
-            break
-
-    if not block_exists:
-        existing_blocks.append({
-            "index": request.block_index,
-            "status": ProjectStatus.in_progress.value
-        })
-
-    project.image_generation_status = json.dumps({"blocks": existing_blocks})
+    project.image_generation_status = _upsert_block_entry(
+        project.image_generation_status, request.block_index,
+        {"status": ProjectStatus.in_progress.value, "stage": None, "job_id": job.job_id}
+    )
     db.commit()
 
-    # Определяем путь для сохранения отредактированного PNG файла
-    edited_image_path = user_data_dir / f"{current_user.id}_{project.id}_block_{request.block_index}_edited_image.png"
-
     # Добавляем задачу в фон для редактирования изображения
-    background_tasks.add_task(
-        process_image_editing,
-        project.id,
-        image_description,
-        str(original_image_path),
-        str(edited_image_path),
-        db
-    )
+    job_queue.dispatch(background_tasks, db, "image.edit", {
+        "project_id": project.id,
+        "image_description": image_description,
+        "original_image_path": original_image_path,
+        "block_index": request.block_index,
+        "seed": seed,
+    }, [job])
 
     return GenerateImageResponse(
         project_id=project.id,
         status="in_progress",
-        message=f"Image editing started for block {request.block_index} of project {project.id}"
+        message=f"Image editing started for block {request.block_index} of project {project.id}",
+        job_id=job.job_id
+    )
+
+
+@router.post("/image_jobs/{job_id}/cancel", response_model=CancelImageJobResponse)
+def cancel_image_job(
+    job_id: str,
+    db: Session = Depends(get_db),
+    current_user: CurrentUser = Depends(get_current_user)
+):
+    """
+    Отменить идущую задачу генерации/редактирования изображений.
+    Результат задачи не будет записан, а сервис изображений прервёт инференс.
+    """
+    jobs = image_jobs.get(job_id)
+    if not jobs:
+        raise HTTPException(status_code=404, detail="Image job not found or already finished")
+
+    # Проверяем, что проект задачи принадлежит пользователю
+    project = db.query(Project).filter(
+        Project.id == jobs[0].project_id,
+        Project.user_id == current_user.id
+    ).first()
+    if not project:
+        raise HTTPException(status_code=404, detail="Image job not found or already finished")
+
+    cancelled_jobs = image_jobs.cancel(job_id)
+
+    for job in cancelled_jobs:
+        project.image_generation_status = _upsert_block_entry(
+            project.image_generation_status, job.block_index,
+            {"status": ProjectStatus.failed.value, "stage": "cancelled"}
+        )
+    db.commit()
+
+    return CancelImageJobResponse(
+        job_id=job_id,
+        project_id=project.id,
+        cancelled_block_indices=sorted(job.block_index for job in cancelled_jobs)
     )
 
 @router.get("/status/{project_id}", response_model=ProjectStatusResponse)
 def get_project_status(
     project_id: int,
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_db),
+    current_user: CurrentUser = Depends(get_current_user)
 ):
     """
     Получить статус проекта по ID (включая информацию о сценарии и изображении)
+    Проверяет, что проект принадлежит пользователю: в ответе подписанные ссылки на картинки
     """
-    
-    project = db.query(Project).filter(Project.id == project_id).first()
+    # Проверяем, что проект существует и принадлежит пользователю
+    project = db.query(Project).filter(Project.id == project_id, Project.user_id == current_user.id).first()
     if not project:
         raise HTTPException(status_code=404, detail="Project not found")
+    ensure_restored(project)
 
-    # Parse JSON fields if they exist
-    image_generation_status = None
-    image_paths = None
-    image_descriptions = None
-
-    if project.image_generation_status:
-        try:
-            status_data = json.loads(project.image_generation_status)
-            if "blocks" in status_data:
-                image_generation_status = [ImageGenerationStatus(**block) for block in status_data["blocks"]]
-        except (json.JSONDecodeError, TypeError):
-            pass
-
-    if project.image_paths:
-        try:
-            paths_data = json.loads(project.image_paths)
-            if "blocks" in paths_data:
-                # Create ImagePathData objects only with index and image_path
-                image_paths = []
-                for block in paths_data["blocks"]:
-                    image_paths.append(ImagePathData(index=block["index"], image_path=block.get("image_path")))
-        except (json.JSONDecodeError, TypeError):
-            pass
-
-    if project.image_descriptions:
-        try:
-            descriptions_data = json.loads(project.image_descriptions)
-            if "blocks" in descriptions_data:
-                # Create ImageDescriptionData objects only with index and image_description
-                image_descriptions = []
-                for block in descriptions_data["blocks"]:
-                    image_descriptions.append(ImageDescriptionData(index=block["index"], image_description=block.get("image_description")))
-        except (json.JSONDecodeError, TypeError):
-            pass
+    image_generation_status, image_paths, image_descriptions = _image_fields(project)
 
     return ProjectStatusResponse(
         project_id=project.id,
@@ -931,14 +1323,15 @@ def get_project_status(
         product_description=project.product_description,
         image_generation_status=image_generation_status,
         image_paths=image_paths,
-        image_descriptions=image_descriptions
+        image_descriptions=image_descriptions,
+        image_seed=project.image_seed
     )
 
-@router.get("/scenario/{project_id}")
-async def get_scenario(
+@router.get("/scenario/{project_id}", response_class=ORJSONResponse)
+def get_scenario(
     project_id: int,
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    current_user: CurrentUser = Depends(get_current_user)
 ):
     """
     Получить сценарий для проекта по ID
@@ -949,23 +1342,14 @@ async def get_scenario(
     if not project:
         raise HTTPException(status_code=404, detail="Project not found or access denied")
 
-    # Проверяем, что файл сценария существует
-    if not project.result_path or not os.path.exists(project.result_path):
-        raise HTTPException(status_code=404, detail="Scenario file not found")
-
     # Читаем и возвращаем содержимое сценария
-    try:
-        with open(project.result_path, 'r', encoding='utf-8') as f:
-            scenario_data = json.load(f)
-        return scenario_data
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error reading scenario file: {str(e)}")
+    return ORJSONResponse(_load_scenario(project))
 
-@router.get("/images/{project_id}")
-async def get_project_images(
+@router.get("/images/{project_id}", response_class=ORJSONResponse)
+def get_project_images(
     project_id: int,
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    current_user: CurrentUser = Depends(get_current_user)
 ):
     """
     Получить все изображения проекта
@@ -975,30 +1359,23 @@ async def get_project_images(
     project = db.query(Project).filter(Project.id == project_id, Project.user_id == current_user.id).first()
     if not project:
         raise HTTPException(status_code=404, detail="Project not found or access denied")
+    ensure_restored(project)
 
     # Собираем информацию о всех изображениях проекта
     images_info = []
 
-    # Добавляем основное изображение проекта, если оно существует
-    if project.image_path and os.path.exists(project.image_path):
-        images_info.append({
-            "type": "project_main",
-            "path": project.image_path,
-            "description": project.image_description,
-            "created_at": project.created_at
-        })
-
     # Добавляем изображения элементов сценария
     scenario_images = db.query(ScenarioElementImage).filter(
         ScenarioElementImage.project_id == project.id
     ).all()
 
     for img in scenario_images:
-        if img.image_path and os.path.exists(img.image_path):
+        if img.image_path and get_storage().exists(storage_key(img.image_path)):
             images_info.append({
                 "type": "element_image",
                 "element_index": img.element_index,
                 "path": img.image_path,
+                "url": _file_url(img.image_path),
                 "description": img.image_description,
                 "status": img.status.value,
                 "created_at": img.created_at,
@@ -1007,43 +1384,10 @@ async def get_project_images(
 
     
 
-    # Parse JSON fields if they exist for structured format
-    parsed_image_generation_status = None
-    parsed_image_paths = None
-    parsed_image_descriptions = None
-
-    if project.image_generation_status:
-        try:
-            status_data = json.loads(project.image_generation_status)
-            if "blocks" in status_data:
-                parsed_image_generation_status = [ImageGenerationStatus(**block) for block in status_data["blocks"]]
-        except (json.JSONDecodeError, TypeError):
-            pass
-
-    if project.image_paths:
-        try:
-            paths_data = json.loads(project.image_paths)
-            if "blocks" in paths_data:
-                # Create ImagePathData objects only with index and image_path
-                parsed_image_paths = []
-                for block in paths_data["blocks"]:
-                    parsed_image_paths.append(ImagePathData(index=block["index"], image_path=block.get("image_path")))
-        except (json.JSONDecodeError, TypeError):
-            pass
-
-    if project.image_descriptions:
-        try:
-            descriptions_data = json.loads(project.image_descriptions)
-            if "blocks" in descriptions_data:
-                # Create ImageDescriptionData objects only with index and image_description
-                parsed_image_descriptions = []
-                for block in descriptions_data["blocks"]:
-                    parsed_image_descriptions.append(ImageDescriptionData(index=block["index"], image_description=block.get("image_description")))
-        except (json.JSONDecodeError, TypeError):
-            pass
+    parsed_image_generation_status, parsed_image_paths, parsed_image_descriptions = _image_fields(project)
 
     # Return image information in both old format and new structured format
-    return {
+    return ORJSONResponse({
         "project_id": project.id,
         "project_name": project.name,
         "images_count": len(images_info),
@@ -1051,66 +1395,85 @@ async def get_project_images(
         "image_generation_status": parsed_image_generation_status,  # Structured format
         "image_paths": parsed_image_paths,  # Structured format
         "image_descriptions": parsed_image_descriptions  # Structured format
-    }
-
-@router.get("/projects")
-async def get_user_projects(
+    })
+
+@router.get("/projects", response_class=ORJSONResponse)
+def get_user_projects(
+    status: Optional[ProjectStatus] = Query(None),
+    folder_id: Optional[int] = Query(None),
+    archived: Optional[bool] = Query(None, description="true — проекты архивных папок (по умолчанию их нет, "
+                                                       "кроме запроса по folder_id)"),
+    q: Optional[str] = Query(None, max_length=200, description="поиск по названию и описанию продукта"),
+    created_from: Optional[datetime] = Query(None),
+    created_to: Optional[datetime] = Query(None),
+    updated_from: Optional[datetime] = Query(None),
+    updated_to: Optional[datetime] = Query(None),
+    sort: Literal["created_at", "updated_at", "name"] = Query("created_at"),
+    order: Literal["asc", "desc"] = Query("asc"),
+    limit: Optional[int] = Query(None, ge=1, le=500, description="размер страницы; без него — все проекты"),
+    cursor: Optional[str] = Query(None, description="next_cursor предыдущей страницы"),
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    current_user: CurrentUser = Depends(get_current_user)
 ):
     """
-    Получить все проекты пользователя
+    Получить проекты пользователя.
+    Фильтры: статус, папка, архивность папки (без archived проекты архивных папок
+    не выдаются, если не запрошена сама папка), даты создания / изменения
+    (updated — время последнего изменения, у неизменявшихся — создания),
+    полнотекстовый поиск q. Сортировка sort/order; постранично — limit и cursor
+    (в ответе next_cursor, null на последней странице).
     """
-    
-    # Получаем все проекты пользователя
-    projects = db.query(Project).filter(Project.user_id == current_user.id).all()
+    # Ключ сортировки; created_at совпадает с порядком id
+    keys = {
+        "created_at": Project.id,
+        "updated_at": func.coalesce(Project.updated_at, Project.created_at),
+        "name": func.coalesce(Project.name, ""),
+    }
+    key = sort_key(db, keys[sort])
+
+    # Проекты пользователя вместе со сводками (api/project_summary.py) — один запрос
+    query = (
+        db.query(Project, ProjectSummary, key)
+        .outerjoin(ProjectSummary, ProjectSummary.project_id == Project.id)
+        .filter(Project.user_id == current_user.id)
+    )
+    if status is not None:
+        query = query.filter(Project.status == status)
+    if folder_id is not None:
+        query = query.filter(Project.folder_id == folder_id)
+    if archived is None and folder_id is None:
+        archived = False
+    if archived is not None:
+        query = query.outerjoin(Folder, Folder.id == Project.folder_id)
+        in_archive = func.coalesce(Folder.archived, False).is_(True)
+        query = query.filter(in_archive if archived else ~in_archive)
+    if created_from is not None:
+        query = query.filter(Project.created_at >= created_from)
+    if created_to is not None:
+        query = query.filter(Project.created_at <= created_to)
+    if updated_from is not None:
+        query = query.filter(keys["updated_at"] >= updated_from)
+    if updated_to is not None:
+        query = query.filter(keys["updated_at"] <= updated_to)
+    if q:
+        search = project_search_filter(db, q)
+        if search is not None:
+            query = query.filter(search)
+
+    rows, next_cursor = page(
+        paginate(query, key, Project.id, sort, order, cursor, limit).all(),
+        limit, sort, order, key_of=lambda row: row[2], id_of=lambda row: row[0].id,
+    )
 
     projects_info = []
-    for project in projects:
-        # Подсчитываем количество изображений у проекта
-        images_count = 0
-        if project.image_path and os.path.exists(project.image_path):
-            images_count += 1
-
-        element_images_count = db.query(ScenarioElementImage).filter(
-            ScenarioElementImage.project_id == project.id
-        ).count()
-        images_count += element_images_count
-
-        # Parse JSON fields if they exist for structured format
-        parsed_image_generation_status = None
-        parsed_image_paths = None
-        parsed_image_descriptions = None
-
-        if project.image_generation_status:
-            try:
-                status_data = json.loads(project.image_generation_status)
-                if "blocks" in status_data:
-                    parsed_image_generation_status = [ImageGenerationStatus(**block) for block in status_data["blocks"]]
-            except (json.JSONDecodeError, TypeError):
-                pass
+    rebuilt = False
+    for project, summary, _ in rows:
+        # Проекты, созданные до таблицы сводок, — считаем один раз
+        if summary is None or summary.has_scenario is None:
+            summary = rebuild_summary(db, project)
+            rebuilt = True
 
-        if project.image_paths:
-            try:
-                paths_data = json.loads(project.image_paths)
-                if "blocks" in paths_data:
-                    # Create ImagePathData objects only with index and image_path
-                    parsed_image_paths = []
-                    for block in paths_data["blocks"]:
-                        parsed_image_paths.append(ImagePathData(index=block["index"], image_path=block.get("image_path")))
-            except (json.JSONDecodeError, TypeError):
-                pass
-
-        if project.image_descriptions:
-            try:
-                descriptions_data = json.loads(project.image_descriptions)
-                if "blocks" in descriptions_data:
-                    # Create ImageDescriptionData objects only with index and image_description
-                    parsed_image_descriptions = []
-                    for block in descriptions_data["blocks"]:
-                        parsed_image_descriptions.append(ImageDescriptionData(index=block["index"], image_description=block.get("image_description")))
-            except (json.JSONDecodeError, TypeError):
-                pass
+        parsed_image_generation_status, parsed_image_paths, parsed_image_descriptions = _image_fields(project)
 
         projects_info.append({
             "id": project.id,
@@ -1119,35 +1482,51 @@ async def get_user_projects(
             "status": project.status.value,
             "created_at": project.created_at,
             "updated_at": project.updated_at,
-            "has_scenario": project.result_path is not None and os.path.exists(project.result_path),
-            "has_images": images_count > 0,
-            "images_count": images_count,
+            # Файлы проекта в архиве (api/archive.py): image_paths / image_descriptions
+            # вернутся после первого обращения к сценарию или картинкам
+            "archived": project.archive_key is not None,
+            "has_scenario": bool(summary.has_scenario),
+            "has_images": summary.images_count > 0,
+            "images_count": summary.images_count,
+            "blocks_count": summary.blocks_count,
+            "action_blocks_count": summary.action_blocks_count,
+            "images_done": summary.images_done,
+            "images_in_progress": summary.images_in_progress,
+            "images_failed": summary.images_failed,
+            "last_activity_at": summary.last_activity_at,
             "result_path": project.result_path,
-            "image_path": project.image_path,
             "product_description": project.product_description,
             "image_generation_status": parsed_image_generation_status,  # Structured format
             "image_paths": parsed_image_paths,  # Structured format
             "image_descriptions": parsed_image_descriptions  # Structured format
         })
 
-    return {
+    if rebuilt:
+        db.commit()
+
+    return ORJSONResponse({
         "user_id": current_user.id,
         "username": current_user.login,
         "projects_count": len(projects_info),
-        "projects": projects_info
-    }
+        "projects": projects_info,
+        "next_cursor": next_cursor
+    })
     
 @router.put("/scenario/{project_id}")
-async def update_scenario(
+def update_scenario(
     project_id: int,
     request: ScenarioUpdateRequest,
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    current_user: CurrentUser = Depends(get_current_user),
+    minimal: bool = Depends(prefer_minimal)
 ):
     """
     Обновить сценарий проекта:
     - редактирование / добавление блоков
     - синхронизация ScenarioElementImage и JSON-полей для картинок
+    С Prefer: return=minimal вместо сценария возвращаются только новые,
+    изменённые и переставленные блоки, index удалённых блоков и блоков
+    со сброшенными картинками, version.
     """
     # 1. Проверяем проект и файл сценария
     project = (
@@ -1158,15 +1537,8 @@ async def update_scenario(
     if not project:
         raise HTTPException(status_code=404, detail="Project not found or access denied")
 
-    if not project.result_path or not os.path.exists(project.result_path):
-        raise HTTPException(status_code=404, detail="Scenario file not found")
-
     # 2. Читаем текущий JSON сценария
-    try:
-        with open(project.result_path, "r", encoding="utf-8") as f:
-            current_data = json.load(f)
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error reading scenario file: {str(e)}")
+    current_data = _load_scenario(project)
 
     old_blocks = current_data.get("blocks") or []
 
@@ -1182,17 +1554,13 @@ async def update_scenario(
     new_blocks: List[Dict[str, Any]] = []
     new_by_index: Dict[int, Dict[str, Any]] = {}
 
-    # стартовый max_index для генерации индексов новым блокам
-    max_index = max(old_indices) if old_indices else 0
-
     for block_model in request.blocks:
         block_dict = block_model.dict()
         idx = block_dict.get("index")
 
-        # Новый блок — index не передан
+        # Новый блок — index не передан, выдаём следующий свободный
         if idx is None:
-            max_index += 1
-            idx = max_index
+            idx = allocate_block_index(current_data)
             block_dict["index"] = idx
         elif not isinstance(idx, int):
             raise HTTPException(status_code=400, detail="Block index must be integer")
@@ -1200,9 +1568,15 @@ async def update_scenario(
         if idx in new_by_index:
             raise HTTPException(status_code=400, detail=f"Duplicate block index {idx} in request")
 
+        # Порядок задаёт массив запроса: прежний rank блока сохраняется, если он не нарушает порядок
+        if idx in old_by_index:
+            block_dict["rank"] = old_by_index[idx].get("rank")
+
         new_by_index[idx] = block_dict
         new_blocks.append(block_dict)
 
+    rerank(new_blocks)
+
     new_indices: Set[int] = set(new_by_index.keys())
 
     # 4. Находим удалённые и изменённые блоки
@@ -1230,6 +1604,9 @@ async def update_scenario(
     # Индексы, для которых картинки валидны и их можно оставить
     valid_indices_for_images: Set[int] = new_indices - modified_indices
 
+    # Идущие генерации для этих блоков записали бы устаревший результат
+    image_jobs.cancel_for_blocks(project.id, block_indices=list(indices_to_drop_from_images))
+
     # 5. Синхронизация таблицы ScenarioElementImage
     element_images = (
         db.query(ScenarioElementImage)
@@ -1241,14 +1618,19 @@ async def update_scenario(
         # Если блока больше нет в сценарии или его содержание изменилось —
         # удаляем запись и при желании сам файл
         if img.element_index not in valid_indices_for_images:
-            if img.image_path and os.path.exists(img.image_path):
-                try:
-                    os.remove(img.image_path)
-                except OSError:
-                    pass
+            release_image(db, img.image_path)
             db.delete(img)
 
     # 6. Синхронизация JSON-полей с картинками/статусами в Project
+    # (ссылки на картинки отбрасываемых блоков снимаются)
+    try:
+        path_entries = (json.loads(project.image_paths) or {}).get("blocks") or [] if project.image_paths else []
+    except (json.JSONDecodeError, TypeError, AttributeError):
+        path_entries = []
+    for entry in path_entries:
+        if isinstance(entry, dict) and entry.get("index") not in valid_indices_for_images:
+            release_block_entry(db, entry)
+
     def sync_json_field(field_value: Optional[str]) -> Optional[str]:
         """
         Оставляем в JSON только те блоки, чьи index есть в новом сценарии
@@ -1277,8 +1659,6 @@ async def update_scenario(
     project.image_descriptions = sync_json_field(project.image_descriptions)
     project.image_generation_status = sync_json_field(project.image_generation_status)
 
-    db.commit()
-
     # 7. Обновляем сам JSON сценария
     incoming = request.dict(exclude_unset=True)
 
@@ -1302,17 +1682,28 @@ async def update_scenario(
     new_data["original_blocks_count"] = original_blocks_count
     new_data["final_blocks_count"] = final_blocks_count
     new_data["blocks"] = new_blocks
+    ensure_block_order(new_data)
 
-    try:
-        with open(project.result_path, "w", encoding="utf-8") as f:
-            json.dump(new_data, f, ensure_ascii=False, indent=2)
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error writing scenario file: {str(e)}")
+    # Сценарий, сводка и картинки фиксируются одним коммитом
+    _commit_scenario_changes(project, new_data, [], db)
 
+    if minimal:
+        return {
+            "version": new_data["version"],
+            "final_blocks_count": final_blocks_count,
+            "changed_blocks": [
+                b for b in new_blocks
+                if b["index"] not in old_by_index
+                or b["index"] in modified_indices
+                or b.get("rank") != old_by_index[b["index"]].get("rank")
+            ],
+            "deleted_indices": sorted(deleted_indices),
+            "images_cleared": sorted(indices_to_drop_from_images),
+        }
     return new_data
 
 @router.post("/scenario/{project_id}/blocks")
-async def add_scenario_block(
+def add_scenario_block(
     project_id: int,
     block_data: ScenarioBlockCreate,
     position: Optional[int] = Query(
@@ -1324,12 +1715,14 @@ async def add_scenario_block(
         ),
     ),
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    current_user: CurrentUser = Depends(get_current_user),
+    minimal: bool = Depends(prefer_minimal)
 ):
     """
     Добавить новый блок в сценарий.
-    - index для блока определяется по позиции: всегда последовательные 1..N
-    - все блоки ПОСЛЕ точки вставки сдвигаются (и их index, и индексы картинок).
+    - index нового блока — следующий свободный идентификатор (индексы остальных
+      блоков не меняются, картинки и идущие генерации соседей не трогаются)
+    - место в сценарии задаёт rank между соседями по позиции вставки.
     """
     # 1. Проверяем проект
     project = db.query(Project).filter(
@@ -1339,66 +1732,21 @@ async def add_scenario_block(
     if not project:
         raise HTTPException(status_code=404, detail="Project not found or access denied")
 
-    # 2. Проверяем наличие сценария
-    if not project.result_path or not os.path.exists(project.result_path):
-        raise HTTPException(status_code=404, detail="Scenario file not found")
-
-    # 3. Читаем сценарий
-    try:
-        with open(project.result_path, "r", encoding="utf-8") as f:
-            scenario_data = json.load(f)
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error reading scenario file: {str(e)}")
-
-    blocks = scenario_data.get("blocks") or []
-    n_before = len(blocks)
-
-    # 4. Определяем позицию вставки (0-based)
-    if position is None or position > n_before:
-        insert_pos = n_before
-    else:
-        insert_pos = position
-
-    # Будущий index нового блока: insert_pos (0-based) -> index = insert_pos + 1
-    new_index = insert_pos + 1
+    # 2-3. Проверяем наличие сценария и читаем его
+    scenario_data = _load_scenario(project)
 
-    # 5. Сдвигаем индексы картинок/статусов для блоков с index >= new_index
-    _shift_indices_for_images(project, start_index=new_index, delta=1, db=db)
+    # 4. Создаём новый блок и ставим его между соседями
+    new_block = _add_block(scenario_data, block_data.dict(), position)
 
-    # 6. Сдвигаем индексы существующих блоков в сценарии
-    for b in blocks:
-        idx = b.get("index")
-        if isinstance(idx, int) and idx >= new_index:
-            b["index"] = idx + 1
-
-    # 7. Создаём новый блок
-    new_block = {
-        "type": block_data.type,
-        "content": block_data.content,
-        "formatting": block_data.formatting,
-        "index": new_index,
-    }
-
-    blocks.insert(insert_pos, new_block)
-    scenario_data["blocks"] = blocks
-
-    # 8. Обновляем счётчики
-    scenario_data["final_blocks_count"] = len(blocks)
-    if "original_blocks_count" not in scenario_data:
-        scenario_data["original_blocks_count"] = len(blocks)
-
-    # 9. Сохраняем сценарий
-    try:
-        with open(project.result_path, "w", encoding="utf-8") as f:
-            json.dump(scenario_data, f, ensure_ascii=False, indent=2)
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error writing scenario file: {str(e)}")
-
-    # 10. Обновим updated_at и закоммитим изменения проекта (JSON-поля уже изменены)
-    project.updated_at = datetime.utcnow()
-    db.add(project)
-    db.commit()
+    # 5. Сохраняем сценарий, обновляем updated_at проекта
+    _commit_scenario_changes(project, scenario_data, [], db)
 
+    if minimal:
+        return {
+            "added_block": new_block,
+            "version": scenario_data["version"],
+            "final_blocks_count": scenario_data["final_blocks_count"],
+        }
     return {
         "added_block": new_block,
         "scenario": scenario_data
@@ -1406,12 +1754,13 @@ async def add_scenario_block(
 
 
 @router.patch("/scenario/{project_id}/blocks/{block_index}")
-async def update_scenario_block(
+def update_scenario_block(
     project_id: int,
     block_index: int,
     block_update: ScenarioBlockUpdate,
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    current_user: CurrentUser = Depends(get_current_user),
+    minimal: bool = Depends(prefer_minimal)
 ):
     """
     Частично обновить блок сценария по его index.
@@ -1427,97 +1776,50 @@ async def update_scenario_block(
     if not project:
         raise HTTPException(status_code=404, detail="Project not found or access denied")
 
-    if not project.result_path or not os.path.exists(project.result_path):
-        raise HTTPException(status_code=404, detail="Scenario file not found")
-
     # 2. Читаем сценарий
-    try:
-        with open(project.result_path, "r", encoding="utf-8") as f:
-            scenario_data = json.load(f)
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error reading scenario file: {str(e)}")
-
-    blocks = scenario_data.get("blocks") or []
-
-    # 3. Ищем блок
-    target_block = None
-    for b in blocks:
-        if b.get("index") == block_index:
-            target_block = b
-            break
-
-    if not target_block:
-        raise HTTPException(status_code=404, detail="Block with given index not found")
-
-    old_type = target_block.get("type")
-    old_content = target_block.get("content")
-
-    # 4. Применяем изменения (partial update)
-    update_data = block_update.dict(exclude_unset=True)
-
-    if "type" in update_data:
-        target_block["type"] = update_data["type"]
-    if "content" in update_data:
-        target_block["content"] = update_data["content"]
-    if "formatting" in update_data:
-        target_block["formatting"] = update_data["formatting"]
-
-    new_type = target_block.get("type")
-    new_content = target_block.get("content")
+    scenario_data = _load_scenario(project)
 
-    # 5. Решаем, нужно ли сбрасывать картинки
-    should_clear_images = False
-
-    if old_type == "action":
-        # Если сменился тип (action -> что-то ещё) или изменился контент блока
-        if new_type != "action" or old_content != new_content:
-            should_clear_images = True
-
-    if should_clear_images:
-        _clear_images_for_block(project, block_index, db)
-        # После этого фронт должен вызвать новый generate для этого блока.
-
-    scenario_data["blocks"] = blocks
-    scenario_data["final_blocks_count"] = len(blocks)
-    if "original_blocks_count" not in scenario_data:
-        scenario_data["original_blocks_count"] = len(blocks)
-
-    # 6. Сохраняем сценарий
-    try:
-        with open(project.result_path, "w", encoding="utf-8") as f:
-            json.dump(scenario_data, f, ensure_ascii=False, indent=2)
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error writing scenario file: {str(e)}")
+    # 3. Применяем изменения (partial update); при смене содержимого action-блока
+    # картинки сбрасываются — после этого фронт вызывает новый generate для блока
+    target_block, should_clear_images = _update_block(
+        scenario_data, block_index, block_update.dict(exclude_unset=True)
+    )
 
-    project.updated_at = datetime.utcnow()
-    db.add(project)
-    db.commit()
+    # 4. Сохраняем сценарий
+    _commit_scenario_changes(project, scenario_data, [block_index] if should_clear_images else [], db)
 
+    if minimal:
+        return {
+            "updated_block": target_block,
+            "version": scenario_data["version"],
+            "images_cleared": [block_index] if should_clear_images else [],
+        }
     return {
         "updated_block": target_block,
         "scenario": scenario_data
     }
     
 @router.post("/scenario/{project_id}/blocks/reorder")
-async def reorder_scenario_blocks(
+def reorder_scenario_blocks(
     project_id: int,
     reorder_request: ScenarioReorderRequest,
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    current_user: CurrentUser = Depends(get_current_user),
+    minimal: bool = Depends(prefer_minimal)
 ):
     """
     Полностью переупорядочить блоки сценария.
 
     Тело запроса:
     {
-      "new_order": [3, 1, 2, 4, ...]  # старые index блоков в новом порядке
+      "new_order": [3, 1, 2, 4, ...]  # index блоков в новом порядке
     }
 
     Логика:
     - блоки в JSON переставляются согласно new_order
-    - индексы блоков перенумеровываются 1..N в новом порядке
-    - индексы картинок/статусов ремапятся по той же схеме (old_index -> new_index)
-    - сами изображения НЕ удаляются и НЕ регенерируются
+    - index блоков не меняются, новый rank получают только блоки, сменившие
+      относительный порядок (при перемещении одного блока — он один)
+    - картинки/статусы и идущие генерации блоков не трогаются
     """
     # 1. Проверяем проект
     project = db.query(Project).filter(
@@ -1527,15 +1829,8 @@ async def reorder_scenario_blocks(
     if not project:
         raise HTTPException(status_code=404, detail="Project not found or access denied")
 
-    if not project.result_path or not os.path.exists(project.result_path):
-        raise HTTPException(status_code=404, detail="Scenario file not found")
-
     # 2. Читаем сценарий
-    try:
-        with open(project.result_path, "r", encoding="utf-8") as f:
-            scenario_data = json.load(f)
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error reading scenario file: {str(e)}")
+    scenario_data = _load_scenario(project)
 
     blocks = scenario_data.get("blocks") or []
     if not blocks:
@@ -1561,59 +1856,167 @@ async def reorder_scenario_blocks(
             detail="new_order must be a permutation of existing block indices"
         )
 
-    # 4. Строим мапу old_index -> block
+    # 4. Собираем блоки в новом порядке и выдаём ранги переставленным
     old_by_index: Dict[int, Dict[str, Any]] = {b["index"]: b for b in blocks}
+    new_blocks = [old_by_index[idx] for idx in new_order]
+    moved = rerank(new_blocks)
 
-    # 5. Собираем блоки в новом порядке
-    new_blocks: List[Dict[str, Any]] = []
-    index_map: Dict[int, int] = {}  # old_index -> new_index
+    # 5. Обновляем сценарий
+    scenario_data["blocks"] = new_blocks
+    scenario_data["final_blocks_count"] = len(new_blocks)
+    # original_blocks_count не трогаем — reorder не меняет количество блоков
 
-    for i, old_idx in enumerate(new_order):
-        block = old_by_index[old_idx]
-        new_index = i + 1  # индексы снова подряд 1..N
-        index_map[old_idx] = new_index
+    # 6. Сохраняем сценарий
+    _commit_scenario_changes(project, scenario_data, [], db)
 
-        # создаём новый dict, чтобы не запутаться со старыми ссылками
-        new_block = dict(block)
-        new_block["index"] = new_index
-        new_blocks.append(new_block)
+    if minimal:
+        return {
+            "moved_blocks": [{"index": b["index"], "rank": b["rank"]} for b in moved],
+            "version": scenario_data["version"],
+        }
+    return {
+        # index блоков стабильны — отображение тождественное, оставлено для совместимости
+        "index_map": {idx: idx for idx in new_order},
+        "moved_indices": [b["index"] for b in moved],
+        "scenario": scenario_data
+    }
 
-    # 6. Обновляем индексы картинок/статусов по той же мапе
-    _remap_indices_for_images(project, index_map, db)
 
-    # 7. Обновляем сценарий
-    scenario_data["blocks"] = new_blocks
-    scenario_data["final_blocks_count"] = len(new_blocks)
-    # original_blocks_count не трогаем — reorder не меняет количество блоков
+@router.post("/scenario/{project_id}/blocks/{block_index}/move")
+def move_scenario_block(
+    project_id: int,
+    block_index: int,
+    position: int = Query(
+        ...,
+        ge=0,
+        description=(
+            "Новая позиция блока в массиве blocks (0-based). "
+            "Если больше длины массива — блок переместится в конец."
+        ),
+    ),
+    db: Session = Depends(get_db),
+    current_user: CurrentUser = Depends(get_current_user),
+    minimal: bool = Depends(prefer_minimal)
+):
+    """
+    Переместить один блок сценария: блок получает rank между новыми соседями,
+    остальные блоки, их картинки и статусы не меняются.
+    """
+    project = db.query(Project).filter(
+        Project.id == project_id,
+        Project.user_id == current_user.id
+    ).first()
+    if not project:
+        raise HTTPException(status_code=404, detail="Project not found or access denied")
 
-    # 8. Сохраняем сценарий
-    try:
-        with open(project.result_path, "w", encoding="utf-8") as f:
-            json.dump(scenario_data, f, ensure_ascii=False, indent=2)
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error writing scenario file: {str(e)}")
+    scenario_data = _load_scenario(project)
 
-    project.updated_at = datetime.utcnow()
-    db.add(project)
-    db.commit()
+    block = _move_block(scenario_data, block_index, position)
 
+    _commit_scenario_changes(project, scenario_data, [], db)
+
+    if minimal:
+        return {"moved_block": block, "version": scenario_data["version"]}
     return {
-        "index_map": index_map,   # на всякий случай фронту может пригодиться
+        "moved_block": block,
         "scenario": scenario_data
     }
 
+@router.post("/scenario/{project_id}/blocks/batch")
+def batch_scenario_blocks(
+    project_id: int,
+    batch: ScenarioBatchRequest,
+    db: Session = Depends(get_db),
+    current_user: CurrentUser = Depends(get_current_user),
+    minimal: bool = Depends(prefer_minimal)
+):
+    """
+    Применить несколько операций над блоками (add / update / delete / move) за один запрос.
+    Операции выполняются по порядку над одним прочитанным сценарием; сценарий
+    записывается и БД коммитится один раз. Если хоть одна операция невалидна,
+    не применяется ни одна (ошибка: "Operation N: ...", N с нуля).
+    В results для каждой операции — index и блок в итоговом состоянии.
+
+    Тело запроса:
+    {
+      "operations": [
+        {"op": "add", "position": 0, "type": "action", "content": {...}, "formatting": {...}},
+        {"op": "update", "index": 3, "content": {...}},
+        {"op": "move", "index": 5, "position": 1},
+        {"op": "delete", "index": 2}
+      ]
+    }
+    """
+    project = db.query(Project).filter(
+        Project.id == project_id,
+        Project.user_id == current_user.id
+    ).first()
+    if not project:
+        raise HTTPException(status_code=404, detail="Project not found or access denied")
+
+    scenario_data = _load_scenario(project)
+
+    results: List[Dict[str, Any]] = []
+    cleared: Set[int] = set()
+    for n, operation in enumerate(batch.operations):
+        try:
+            if operation.op == "add":
+                fields = operation.dict(include={"type", "content", "formatting"})
+                if any(value is None for value in fields.values()):
+                    raise HTTPException(status_code=400, detail="add requires type, content and formatting")
+                block = _add_block(scenario_data, fields, operation.position)
+                results.append({"op": "add", "index": block["index"], "block": block})
+                continue
+
+            if operation.index is None:
+                raise HTTPException(status_code=400, detail=f"{operation.op} requires index")
+
+            if operation.op == "update":
+                block, clear_images = _update_block(
+                    scenario_data, operation.index,
+                    operation.dict(include={"type", "content", "formatting"}, exclude_unset=True)
+                )
+                if clear_images:
+                    cleared.add(operation.index)
+                results.append({"op": "update", "index": operation.index, "block": block})
+            elif operation.op == "delete":
+                _delete_block(scenario_data, operation.index)
+                cleared.add(operation.index)
+                results.append({"op": "delete", "index": operation.index})
+            else:
+                if operation.position is None:
+                    raise HTTPException(status_code=400, detail="move requires position")
+                block = _move_block(scenario_data, operation.index, operation.position)
+                results.append({"op": "move", "index": operation.index, "block": block})
+        except HTTPException as e:
+            # Ничего ещё не записано: сценарий меняется только в памяти
+            raise HTTPException(status_code=e.status_code, detail=f"Operation {n}: {e.detail}")
+
+    # Картинки сбрасываются и идущие генерации отменяются только после проверки всех операций
+    _commit_scenario_changes(project, scenario_data, cleared, db)
+
+    response = {
+        "results": results,
+        "version": scenario_data["version"],
+        "final_blocks_count": scenario_data["final_blocks_count"],
+        "images_cleared": sorted(cleared),
+    }
+    if not minimal:
+        response["scenario"] = scenario_data
+    return response
+
 @router.delete("/scenario/{project_id}/blocks/{block_index}")
-async def delete_scenario_block(
+def delete_scenario_block(
     project_id: int,
     block_index: int,
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    current_user: CurrentUser = Depends(get_current_user),
+    minimal: bool = Depends(prefer_minimal)
 ):
     """
     Удалить блок сценария по его index.
     - для удалённого блока полностью чистятся данные по картинкам
-    - все блоки с index > block_index сдвигаются на -1
-      (и в сценарии, и в БД/JSON по картинкам).
+    - index остальных блоков не меняются, их картинки и статусы не трогаются.
     """
     # 1. Проверяем проект
     project = db.query(Project).filter(
@@ -1623,74 +2026,108 @@ async def delete_scenario_block(
     if not project:
         raise HTTPException(status_code=404, detail="Project not found or access denied")
 
-    if not project.result_path or not os.path.exists(project.result_path):
-        raise HTTPException(status_code=404, detail="Scenario file not found")
-
     # 2. Читаем сценарий
-    try:
-        with open(project.result_path, "r", encoding="utf-8") as f:
-            scenario_data = json.load(f)
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error reading scenario file: {str(e)}")
+    scenario_data = _load_scenario(project)
 
-    blocks = scenario_data.get("blocks") or []
-    original_len = len(blocks)
+    # 3. Удаляем блок и чистим данные по картинкам для него
+    _delete_block(scenario_data, block_index)
+    _commit_scenario_changes(project, scenario_data, [block_index], db)
 
-    # 3. Ищем позицию блока в массиве по его index
-    delete_pos = None
-    for i, b in enumerate(blocks):
-        if b.get("index") == block_index:
-            delete_pos = i
-            break
+    if minimal:
+        return {
+            "deleted_index": block_index,
+            "version": scenario_data["version"],
+            "final_blocks_count": scenario_data["final_blocks_count"],
+        }
+    return {
+        "deleted_index": block_index,
+        "scenario": scenario_data
+    }
 
-    if delete_pos is None:
-        raise HTTPException(status_code=404, detail="Block with given index not found")
+def _block_image_sources(project: Project, indices: List[int], db: Session) -> List[tuple]:
+    """
+    Картинки блоков indices к выдаче: (index, ключ, image_id, is_preview), по порядку блоков.
+    Источники:
+    1) scenario_element_images (новая схема)
+    2) project.image_paths (старая схема: JSON с путями до файлов)
+    """
+    ensure_restored(project)
+    order = {idx: pos for pos, idx in enumerate(indices)}
 
-    # Удаляем блок из массива
-    blocks.pop(delete_pos)
+    # Сначала пробуем взять картинки из ScenarioElementImage (новая схема)
+    images = (
+        db.query(ScenarioElementImage)
+        .filter(
+            ScenarioElementImage.project_id == project.id,
+            ScenarioElementImage.element_index.in_(indices),
+        )
+        .all()
+    )
 
-    # 4. Чистим данные по картинкам для удалённого блока
-    _clear_images_for_block(project, block_index, db)
+    # Картинки к выдаче: (index, ключ, image_id, is_preview). Пара (index, ключ) —
+    # чтобы не дублировать одну и ту же картинку блока; у разных блоков ключ может
+    # совпасть: одинаковые картинки хранятся один раз
+    wanted: List[tuple] = []
+    seen_keys: Set[tuple] = set()
 
-    # 5. Сдвигаем индексы картинок/статусов для всех блоков, которые были после
-    # (у них старый index > block_index)
-    _shift_indices_for_images(project, start_index=block_index + 1, delta=-1, db=db)
+    for img in images:
+        key = storage_key(img.image_path)
+        if not key or (img.element_index, key) in seen_keys:
+            continue
+        seen_keys.add((img.element_index, key))
+        wanted.append((img.element_index, key, img.id, False))
 
-    # 6. Сдвигаем индексы в самом сценарии
-    for b in blocks:
-        idx = b.get("index")
-        if isinstance(idx, int) and idx > block_index:
-            b["index"] = idx - 1
+    # Дополняем из project.image_paths (старая схема)
+    if project.image_paths:
+        try:
+            paths_data = json.loads(project.image_paths)
+            blocks_list = paths_data.get("blocks") or []
+        except (json.JSONDecodeError, TypeError):
+            blocks_list = []
 
-    scenario_data["blocks"] = blocks
-    scenario_data["final_blocks_count"] = len(blocks)
+        for entry in blocks_list:
+            idx = entry.get("index")
+            # Пока полноразмерное изображение не готово — отдаём черновик (прогрессивный режим)
+            rel_path = entry.get("image_path")
+            is_preview = False
+            if not rel_path and entry.get("preview_path"):
+                rel_path = entry.get("preview_path")
+                is_preview = True
+            if not isinstance(idx, int) or idx not in order:
+                continue
+            if not rel_path:
+                continue
 
-    if "original_blocks_count" not in scenario_data:
-        # если поля не было, считаем исходным количество до удаления
-        scenario_data["original_blocks_count"] = original_len
+            key = storage_key(rel_path)
+            # Если уже брали эту картинку из ScenarioElementImage — пропускаем
+            if (idx, key) in seen_keys:
+                continue
+            seen_keys.add((idx, key))
+            # image_id None — из JSON, без отдельной записи в таблице
+            wanted.append((idx, key, None, is_preview))
 
-    # 7. Сохраняем сценарий
-    try:
-        with open(project.result_path, "w", encoding="utf-8") as f:
-            json.dump(scenario_data, f, ensure_ascii=False, indent=2)
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error writing scenario file: {str(e)}")
+    wanted.sort(key=lambda item: order[item[0]])
+    return wanted
 
-    project.updated_at = datetime.utcnow()
-    db.add(project)
-    db.commit()
 
+def _block_image_item(storage: Storage, key: str, raw: bytes, image_id: Optional[int], is_preview: bool) -> dict:
+    """Картинка блока в ответе: base64 содержимого + прямая ссылка"""
+    mime_type, _ = mimetypes.guess_type(key)
     return {
-        "deleted_index": block_index,
-        "scenario": scenario_data
+        "image_id": image_id,
+        "mime_type": mime_type or "application/octet-stream",
+        "data_base64": base64.b64encode(raw).decode("ascii"),
+        "url": storage.url(key),
+        "is_preview": is_preview,
     }
 
-@router.post("/scenario/{project_id}/blocks/images")
-async def get_images_for_blocks(
+
+@router.post("/scenario/{project_id}/blocks/images", response_class=ORJSONResponse)
+def get_images_for_blocks(
     project_id: int,
     request: BlocksImagesRequest,
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user),
+    current_user: CurrentUser = Depends(get_current_user),
 ):
     """
     Вернуть КАРТИНКИ для нескольких блоков сразу.
@@ -1708,13 +2145,16 @@ async def get_images_for_blocks(
             {
               "image_id": 10,               # может быть None, если из JSON
               "mime_type": "image/png",
-              "data_base64": "iVBORw0KGgoAAA..."
+              "data_base64": "iVBORw0KGgoAAA...",
+              "url": "...",                 # прямая ссылка на файл (действует час)
+              "is_preview": false           # true — черновик прогрессивной генерации
             }
           ]
         },
         ...
       ]
     }
+    Потоковый вариант — POST /scenario/{project_id}/blocks/images/stream.
     """
     # 1. Проверяем проект
     project = db.query(Project).filter(
@@ -1726,109 +2166,20 @@ async def get_images_for_blocks(
 
     indices = sorted(set(request.block_indices or []))
     if not indices:
-        return {"project_id": project_id, "results": []}
-
-    # Подготовим структуру для результата
-    grouped: Dict[int, List[dict]] = {idx: [] for idx in indices}
-
-    # Базовая директория проекта (чтобы работать с относительными путями)
-    base_dir = Path(".")  # можно заменить на Path(__file__).resolve().parents[2] при желании
-
-    # --- 2. Сначала пробуем взять картинки из ScenarioElementImage (новая схема) ---
-    images = (
-        db.query(ScenarioElementImage)
-        .filter(
-            ScenarioElementImage.project_id == project.id,
-            ScenarioElementImage.element_index.in_(indices),
-        )
-        .all()
-    )
-
-    seen_paths: Set[str] = set()  # чтобы не дублировать одну и ту же картинку
-
-    for img in images:
-        if not img.image_path:
-            continue
-
-        img_path = Path(img.image_path)
-        if not img_path.is_absolute():
-            img_path = base_dir / img_path
-
-        if not img_path.exists():
-            continue
+        return ORJSONResponse({"project_id": project_id, "results": []})
 
-        try:
-            with open(img_path, "rb") as f:
-                raw = f.read()
-        except OSError:
-            continue
-
-        b64 = base64.b64encode(raw).decode("ascii")
-        mime_type, _ = mimetypes.guess_type(str(img_path))
-        if mime_type is None:
-            mime_type = "application/octet-stream"
-
-        norm_path = str(img_path.resolve())
-        seen_paths.add(norm_path)
-
-        grouped.setdefault(img.element_index, []).append(
-            {
-                "image_id": img.id,
-                "mime_type": mime_type,
-                "data_base64": b64,
-            }
-        )
-
-    # --- 3. Дополняем из project.image_paths (старая схема) ---
-    if project.image_paths:
-        try:
-            paths_data = json.loads(project.image_paths)
-            blocks_list = paths_data.get("blocks") or []
-        except (json.JSONDecodeError, TypeError):
-            blocks_list = []
-
-        for entry in blocks_list:
-            idx = entry.get("index")
-            rel_path = entry.get("image_path")
-            if not isinstance(idx, int) or idx not in grouped:
-                continue
-            if not rel_path:
-                continue
-
-            img_path = Path(rel_path)
-            if not img_path.is_absolute():
-                img_path = base_dir / img_path
-
-            if not img_path.exists():
-                continue
-
-            norm_path = str(img_path.resolve())
-            # Если уже брали эту картинку из ScenarioElementImage — пропускаем
-            if norm_path in seen_paths:
-                continue
+    # --- 2. Читаем картинки блоков: параллельно, нечитаемые пропускаются ---
+    storage = get_storage()
+    wanted = _block_image_sources(project, indices, db)
+    contents = storage.read_many(key for _, key, _, _ in wanted)
 
-            try:
-                with open(img_path, "rb") as f:
-                    raw = f.read()
-            except OSError:
-                continue
-
-            b64 = base64.b64encode(raw).decode("ascii")
-            mime_type, _ = mimetypes.guess_type(str(img_path))
-            if mime_type is None:
-                mime_type = "application/octet-stream"
-
-            seen_paths.add(norm_path)
-
-            grouped[idx].append(
-                {
-                    "image_id": None,  # из JSON, без отдельной записи в таблице
-                    "mime_type": mime_type,
-                    "data_base64": b64,
-                }
-            )
+    grouped: Dict[int, List[dict]] = {idx: [] for idx in indices}
+    for idx, key, image_id, is_preview in wanted:
+        raw = contents.get(key)
+        if raw is not None:
+            grouped[idx].append(_block_image_item(storage, key, raw, image_id, is_preview))
 
-    # --- 4. Формируем ответ ---
+    # --- 3. Формируем ответ ---
     results = []
     for idx in indices:
         results.append(
@@ -1838,7 +2189,49 @@ async def get_images_for_blocks(
             }
         )
 
-    return {
+    return ORJSONResponse({
         "project_id": project_id,
         "results": results,
-    }
+    })
+
+
+@router.post("/scenario/{project_id}/blocks/images/stream")
+def stream_images_for_blocks(
+    project_id: int,
+    request: BlocksImagesRequest,
+    db: Session = Depends(get_db),
+    current_user: CurrentUser = Depends(get_current_user),
+):
+    """
+    Картинки нескольких блоков потоком NDJSON (application/x-ndjson): строка на
+    картинку отправляется сразу после чтения файла, в памяти держится не больше
+    пары картинок, а редактор показывает первые блоки, не дожидаясь остальных.
+    Строки по порядку блоков:
+      {"block_index": 2, "image_id": 10, "mime_type": "image/png",
+       "data_base64": "...", "url": "...", "is_preview": false}
+    Последняя строка — {"done": true, "project_id": 1, "images_count": N};
+    без неё поток оборвался.
+    """
+    project = db.query(Project).filter(
+        Project.id == project_id,
+        Project.user_id == current_user.id,
+    ).first()
+    if not project:
+        raise HTTPException(status_code=404, detail="Project not found or access denied")
+
+    indices = sorted(set(request.block_indices or []))
+    # Всё, что нужно от БД, — до начала потока: генератор работает уже без сессии
+    wanted = _block_image_sources(project, indices, db) if indices else []
+    storage = get_storage()
+
+    def lines():
+        count = 0
+        contents = storage.iter_read_many(key for _, key, _, _ in wanted)
+        for (idx, key, image_id, is_preview), (_, raw) in zip(wanted, contents):
+            if raw is None:
+                continue
+            yield json_line({"block_index": idx, **_block_image_item(storage, key, raw, image_id, is_preview)})
+            count += 1
+        yield json_line({"done": True, "project_id": project_id, "images_count": count})
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
@@ -1,15 +1,33 @@
 # back/api/db_models.py
 # (Новый файл: SQLAlchemy модели для БД)
 
-from sqlalchemy import create_engine, Column, Integer, String, Boolean, ForeignKey, DateTime, Text, Enum
+from sqlalchemy import create_engine, event, Column, Integer, String, Boolean, ForeignKey, DateTime, Text, Enum, Index, text
+from sqlalchemy.exc import OperationalError, ProgrammingError, IntegrityError
 from sqlalchemy.orm import declarative_base, sessionmaker, relationship
 from sqlalchemy.sql import func
 from datetime import datetime
+from pathlib import Path
+from dotenv import load_dotenv
 import enum
+import logging
+import os
+import time
 
-# Настройка БД (SQLite для примера)
-DATABASE_URL = "sqlite:///./umir_db.sqlite"
+load_dotenv()
+
+# Настройка БД (SQLite по умолчанию)
+DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./umir_db.sqlite")
 engine = create_engine(DATABASE_URL)
+
+if engine.dialect.name == "sqlite":
+    @event.listens_for(engine, "connect")
+    def _sqlite_py_lower(dbapi_connection, connection_record):
+        # Встроенный lower() SQLite знает только ASCII. py_lower — отдельная функция для
+        # поиска без учёта регистра по кириллице (listing.unicode_lower); lower() не подменяется,
+        # чтобы не ставить Python-вызов во все запросы и не ломать индексы по lower(...)
+        dbapi_connection.create_function("py_lower", 1, lambda value: value.lower() if isinstance(value, str) else value,
+                                         deterministic=True)
+
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
 
@@ -50,6 +68,9 @@ class Folder(Base):
     # Связь с пользователем
     user = relationship("User", backref="folders")
 
+    # Папки пользователя (список и проверка владельца)
+    __table_args__ = (Index("ix_folders_user_id_id", "user_id", "id"),)
+
 
 class Project(Base):
     __tablename__ = "projects"
@@ -65,11 +86,24 @@ class Project(Base):
     image_generation_status = Column(Text, nullable=True)  # Статус генерации изображений в JSON формате
     image_paths = Column(Text, nullable=True)  # Все пути к изображениям в JSON формате
     image_descriptions = Column(Text, nullable=True)  # Все описания изображений в JSON формате
+    image_seed = Column(Integer, nullable=True)  # Общий seed раскадровки для единого визуального стиля
+    archive_key = Column(String, nullable=True)  # Ключ архива проекта в хранилище (api/archive.py); NULL — проект не в архиве
+    archived_at = Column(DateTime(timezone=True), nullable=True)
 
     # Связь с пользователем и папкой
     user = relationship("User", backref="projects")
     folder = relationship("Folder", backref="projects")
 
+    __table_args__ = (
+        Index("ix_projects_user_id_id", "user_id", "id"),  # проекты пользователя
+        Index("ix_projects_folder_id", "folder_id"),  # проекты папки
+    )
+
+
+# Ключи сортировки списка проектов (api/listing.py): по активности и по имени
+Index("ix_projects_user_activity", Project.user_id, func.coalesce(Project.updated_at, Project.created_at), Project.id)
+Index("ix_projects_user_name", Project.user_id, func.coalesce(Project.name, ""), Project.id)
+
 
 class ScenarioElementImage(Base):
     __tablename__ = "scenario_element_images"
@@ -85,9 +119,107 @@ class ScenarioElementImage(Base):
     # Связь с проектом
     project = relationship("Project", backref="scenario_element_images")
 
+    # Одна запись на блок; индекс же обслуживает выборки по project_id и по блокам
+    __table_args__ = (
+        Index("uq_scenario_element_images_project_element", "project_id", "element_index", unique=True),
+    )
+
+
+class ProjectSummary(Base):
+    """
+    Сводка проекта для списка проектов (api/project_summary.py): счётчики блоков и
+    картинок пересчитываются при записи, а не при каждом запросе списка.
+    has_scenario NULL — счётчики сценария ещё не считались (проект создан до таблицы).
+    """
+    __tablename__ = "project_summary"
+    project_id = Column(Integer, ForeignKey("projects.id"), primary_key=True)
+    has_scenario = Column(Boolean, nullable=True)
+    blocks_count = Column(Integer, nullable=False, default=0)
+    action_blocks_count = Column(Integer, nullable=False, default=0)
+    images_count = Column(Integer, nullable=False, default=0)  # записи ScenarioElementImage
+    images_done = Column(Integer, nullable=False, default=0)  # по image_generation_status
+    images_in_progress = Column(Integer, nullable=False, default=0)
+    images_failed = Column(Integer, nullable=False, default=0)
+    last_activity_at = Column(DateTime(timezone=True), nullable=True)
+
+
+class ImageBlob(Base):
+    """
+    Изображение в хранилище, адресованное sha256 содержимого (api/image_store.py).
+    refcount — число ссылок на него из image_paths проектов и ScenarioElementImage;
+    блобы без ссылок удаляет сборщик мусора (api/scripts/image_gc.py).
+    """
+    __tablename__ = "image_blobs"
+    hash = Column(String(64), primary_key=True)  # sha256 содержимого (hex)
+    size = Column(Integer, nullable=False)  # Размер файла в байтах
+    refcount = Column(Integer, nullable=False, default=0)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+
+class BackgroundJob(Base):
+    """
+    Фоновая задача в общей очереди (JOB_QUEUE=db, api/scripts/job_queue.py).
+    Задача изображений — одна строка на блок; блоки пакетной задачи делят job_id.
+    active_key ("<project_id>:<block_index>") заполнен, пока задача блока не завершена
+    и не отменена: уникальность не даёт двум воркерам запустить две задачи одного блока.
+    """
+    __tablename__ = "background_jobs"
+    id = Column(Integer, primary_key=True, index=True)
+    job_id = Column(String(32), nullable=False, index=True)
+    kind = Column(String, nullable=True)  # обработчик: script / image.generate / image.batch / image.edit
+    payload = Column(Text, nullable=True)  # аргументы обработчика в JSON
+    project_id = Column(Integer, ForeignKey("projects.id"), nullable=True)
+    block_index = Column(Integer, nullable=True)
+    content_hash = Column(String(16), nullable=True)
+    active_key = Column(String, unique=True, nullable=True)
+    # new (ещё без payload) -> queued -> running -> done / cancelled / failed
+    status = Column(String, nullable=False, default="new", index=True)
+    cancelled = Column(Boolean, nullable=False, default=False)
+    claim = Column(String(32), nullable=True, index=True)  # кто из воркеров выполняет задачу
+    attempts = Column(Integer, nullable=False, default=0)
+    request_id = Column(String, nullable=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    started_at = Column(DateTime(timezone=True), nullable=True)
+    heartbeat_at = Column(DateTime(timezone=True), nullable=True)
+    finished_at = Column(DateTime(timezone=True), nullable=True)
+
+
+MIGRATIONS_DIR = Path(__file__).resolve().parents[2] / "migrations"
 
-# Создание таблиц
-Base.metadata.create_all(bind=engine)
+
+def _upgrade(conn):
+    try:
+        from alembic import command
+        from alembic.config import Config
+    except ImportError:
+        logging.getLogger("api.db").warning("alembic is not installed; creating tables without migrations")
+        Base.metadata.create_all(bind=conn)
+        return
+    config = Config()
+    config.set_main_option("script_location", str(MIGRATIONS_DIR))
+    config.attributes["connection"] = conn
+    command.upgrade(config, "head")
+
+
+def init_db(retries: int = 10):
+    """
+    Приводит схему БД к последней миграции (migrations/, alembic upgrade head).
+    Безопасно при одновременном старте нескольких воркеров: в PostgreSQL миграции
+    идут под advisory-блокировкой, в остальных БД ошибка от параллельной миграции
+    («таблица уже существует») приводит к повтору, который видит уже новую версию схемы.
+    """
+    for attempt in range(retries):
+        try:
+            with engine.begin() as conn:
+                if conn.dialect.name == "postgresql":
+                    conn.execute(text("SELECT pg_advisory_xact_lock(7265746)"))
+                _upgrade(conn)
+            return
+        except (OperationalError, ProgrammingError, IntegrityError):
+            if attempt == retries - 1:
+                raise
+            time.sleep(0.2 * (attempt + 1))
 
 # Dependency для сессии БД
 def get_db():
@@ -98,4 +230,4 @@ def get_db():
         db.close()
 
 # Экспортируем модели, чтобы их можно было импортировать
-__all__ = ["get_db", "User", "Folder", "Project", "ProjectStatus", "ScenarioElementImage"]
\ No newline at end of file
+__all__ = ["get_db", "User", "Folder", "Project", "ProjectStatus", "ScenarioElementImage", "ProjectSummary", "ImageBlob", "BackgroundJob", "init_db"]
\ No newline at end of file
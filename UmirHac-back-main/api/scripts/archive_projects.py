@@ -0,0 +1,37 @@
+"""
+Архивация проектов архивных папок (api/archive.py).
+Проекты, возвращённые из архива при обращении, снова переносятся в архив,
+если не менялись ARCHIVE_IDLE секунд; с --folder — все проекты папки сразу
+(например, папок, заархивированных до появления архивов).
+
+    python -m api.scripts.archive_projects [--idle 86400]
+    python -m api.scripts.archive_projects --folder 3
+"""
+import argparse
+import json
+
+from ..schemas.schemas import SessionLocal
+from ..archive import ARCHIVE_IDLE, archive_folder, archive_idle_projects
+
+
+def run_once(idle: float = ARCHIVE_IDLE, folder_id: int = None) -> int:
+    db = SessionLocal()
+    try:
+        if folder_id is not None:
+            return archive_folder(db, folder_id)
+        return archive_idle_projects(db, idle)
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    from ..logging_config import setup_logging
+
+    parser = argparse.ArgumentParser(description="Archive projects of archived folders")
+    parser.add_argument("--idle", type=float, default=ARCHIVE_IDLE,
+                        help="архивировать проекты, не менявшиеся столько секунд")
+    parser.add_argument("--folder", type=int, default=None, help="архивировать все проекты этой папки")
+    args = parser.parse_args()
+
+    setup_logging()
+    print(json.dumps({"archived": run_once(args.idle, args.folder)}))
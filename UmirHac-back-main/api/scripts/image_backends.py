@@ -0,0 +1,314 @@
+import asyncio
+import base64
+import hashlib
+import io
+import logging
+import os
+import random
+import threading
+import time
+from abc import ABC, abstractmethod
+from typing import Any, Dict, List, Optional, Tuple
+
+import httpx
+from PIL import Image
+
+from ..tracing import inject_headers
+
+logger = logging.getLogger("api.images")
+
+
+class ImageBackendError(Exception):
+    """Сервис изображений не смог выполнить запрос (ошибка, отмена, нет живых узлов)"""
+    pass
+
+
+class ImageBackend(ABC):
+    """
+    Интерфейс сервиса изображений (см. image_generate_module.py).
+    Методы возвращают JSON-ответ сервиса:
+    - generate:       {"image": base64, "seed": int, ...}
+    - generate_batch: {"images": [base64, ...], "seed": int}
+    - edit:           {"image": base64, "seed": int, ...}
+    При неуспехе — ImageBackendError.
+    """
+
+    @abstractmethod
+    async def generate(self, prompt: str, preview: bool = False, seed: Optional[int] = None,
+                       job_id: Optional[str] = None) -> Dict[str, Any]:
+        ...
+
+    @abstractmethod
+    async def generate_batch(self, prompts: List[str], seed: Optional[int] = None,
+                             job_id: Optional[str] = None) -> Dict[str, Any]:
+        ...
+
+    @abstractmethod
+    async def edit(self, prompt: str, image_base64: str, seed: Optional[int] = None,
+                   job_id: Optional[str] = None) -> Dict[str, Any]:
+        ...
+
+    @abstractmethod
+    async def cancel(self, job_id: str):
+        """Прервать задачу на стороне сервиса (best effort)"""
+
+    @abstractmethod
+    async def health(self) -> bool:
+        ...
+
+
+class HttpImageBackend(ImageBackend):
+    """Один HTTP-сервис изображений"""
+
+    def __init__(self, base_url: str, timeout: float = 6000.0):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+
+    async def _post(self, path: str, payload: Dict[str, Any]) -> Dict[str, Any]:
+        # Клиент на каждый вызов: фоновые задачи крутят свой event loop через asyncio.run
+        async with httpx.AsyncClient() as client:
+            response = await client.post(
+                f"{self.base_url}{path}", json=payload, timeout=self.timeout, headers=inject_headers()
+            )
+        if response.status_code != 200:
+            raise ImageBackendError(f"{self.base_url}{path} returned {response.status_code}")
+        return response.json()
+
+    async def generate(self, prompt, preview=False, seed=None, job_id=None):
+        return await self._post("/generate_image", {
+            "prompt": prompt, "preview": preview, "seed": seed, "job_id": job_id
+        })
+
+    async def generate_batch(self, prompts, seed=None, job_id=None):
+        return await self._post("/generate_images", {
+            "prompts": prompts, "seed": seed, "job_id": job_id
+        })
+
+    async def edit(self, prompt, image_base64, seed=None, job_id=None):
+        return await self._post("/edit_image", {
+            "prompt": prompt, "image_base64": image_base64, "seed": seed,
+            "job_id": job_id, "cache_latents": True
+        })
+
+    async def cancel(self, job_id):
+        try:
+            async with httpx.AsyncClient() as client:
+                await client.post(f"{self.base_url}/cancel/{job_id}", timeout=5.0)
+        except httpx.HTTPError as e:
+            logger.warning("cancel propagation failed", extra={"node": self.base_url, "error": str(e)})
+
+    async def health(self):
+        try:
+            async with httpx.AsyncClient() as client:
+                response = await client.get(f"{self.base_url}/health", timeout=2.0)
+            return response.status_code == 200
+        except httpx.HTTPError:
+            return False
+
+
+class FakeImageBackend(ImageBackend):
+    """
+    Сервис изображений в процессе API — для нагрузочного тестирования без GPU.
+    Возвращает детерминированные картинки (цвет зависит от промпта и seed)
+    с настраиваемой задержкой; concurrency > 0 имитирует ограниченное число GPU.
+    """
+
+    def __init__(self, latency: float = 0.5, size: int = 512, preview_size: int = 256,
+                 concurrency: int = 0):
+        self.latency = latency
+        self.size = size
+        self.preview_size = preview_size
+        self._slots = threading.BoundedSemaphore(concurrency) if concurrency > 0 else None
+        self._cancelled: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def _render(self, prompt: str, seed: int, size: int) -> str:
+        digest = hashlib.sha256(f"{prompt}|{seed}".encode("utf-8")).digest()
+        img = Image.new("RGB", (size, size), tuple(digest[:3]))
+        buf = io.BytesIO()
+        img.save(buf, "PNG")
+        return base64.b64encode(buf.getvalue()).decode("utf-8")
+
+    def _is_cancelled(self, job_id: Optional[str]) -> bool:
+        with self._lock:
+            return job_id is not None and job_id in self._cancelled
+
+    async def _work(self, seconds: float, job_id: Optional[str]):
+        if self._slots is not None:
+            await asyncio.to_thread(self._slots.acquire)
+        try:
+            deadline = time.perf_counter() + seconds
+            while time.perf_counter() < deadline:
+                if self._is_cancelled(job_id):
+                    raise ImageBackendError(f"job {job_id} cancelled")
+                await asyncio.sleep(min(0.05, max(0.0, deadline - time.perf_counter())))
+        finally:
+            if self._slots is not None:
+                self._slots.release()
+
+    async def generate(self, prompt, preview=False, seed=None, job_id=None):
+        seed = seed if seed is not None else random.randrange(2**31)
+        size = self.preview_size if preview else self.size
+        await self._work(self.latency / 4 if preview else self.latency, job_id)
+        return {"image": self._render(prompt, seed, size), "preview": preview,
+                "width": size, "height": size, "seed": seed}
+
+    async def generate_batch(self, prompts, seed=None, job_id=None):
+        seed = seed if seed is not None else random.randrange(2**31)
+        await self._work(self.latency * len(prompts), job_id)
+        return {"images": [self._render(p, seed, self.size) for p in prompts], "seed": seed}
+
+    async def edit(self, prompt, image_base64, seed=None, job_id=None):
+        seed = seed if seed is not None else 42
+        await self._work(self.latency, job_id)
+        return {"image": self._render(f"{prompt}|{image_base64[:64]}", seed, self.size),
+                "seed": seed, "latent_cache_hit": False}
+
+    async def cancel(self, job_id):
+        with self._lock:
+            self._cancelled[job_id] = time.time()
+            # отмены старше часа больше не нужны
+            cutoff = time.time() - 3600
+            for key in [k for k, t in self._cancelled.items() if t < cutoff]:
+                del self._cancelled[key]
+
+    async def health(self):
+        return True
+
+
+class PooledHttpImageBackend(ImageBackend):
+    """
+    Несколько GPU-узлов с весами.
+    Узел выбирается случайно пропорционально весу среди живых; здоровье узлов
+    проверяется через /health не чаще health_interval секунд, а узел, на котором
+    упал запрос, помечается мёртвым до следующей проверки (запрос повторяется на другом).
+    """
+
+    def __init__(self, endpoints: List[Tuple[str, float]], health_interval: float = 10.0,
+                 timeout: float = 6000.0):
+        if not endpoints:
+            raise ValueError("PooledHttpImageBackend needs at least one endpoint")
+        self.nodes = [HttpImageBackend(url, timeout=timeout) for url, _ in endpoints]
+        self.weights = [weight for _, weight in endpoints]
+        self.health_interval = health_interval
+        self._healthy = [True] * len(self.nodes)
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+        self._jobs: Dict[str, HttpImageBackend] = {}  # job_id -> узел (для cancel)
+
+    async def _refresh_health(self):
+        with self._lock:
+            if time.monotonic() - self._checked_at < self.health_interval:
+                return
+            self._checked_at = time.monotonic()
+        results = await asyncio.gather(*(node.health() for node in self.nodes))
+        with self._lock:
+            self._healthy = list(results)
+
+    def _pick(self, exclude: List[HttpImageBackend]) -> Optional[HttpImageBackend]:
+        with self._lock:
+            candidates = [
+                (node, weight) for node, weight, ok in zip(self.nodes, self.weights, self._healthy)
+                if ok and weight > 0 and node not in exclude
+            ]
+        if not candidates:
+            return None
+        nodes, weights = zip(*candidates)
+        return random.choices(nodes, weights=weights, k=1)[0]
+
+    def _mark_down(self, node: HttpImageBackend):
+        with self._lock:
+            self._healthy[self.nodes.index(node)] = False
+
+    async def _call(self, method: str, job_id: Optional[str], *args, **kwargs) -> Dict[str, Any]:
+        await self._refresh_health()
+        tried: List[HttpImageBackend] = []
+        while True:
+            node = self._pick(exclude=tried)
+            if node is None:
+                raise ImageBackendError("No healthy image service nodes")
+            tried.append(node)
+            if job_id:
+                with self._lock:
+                    self._jobs[job_id] = node
+            try:
+                return await getattr(node, method)(*args, job_id=job_id, **kwargs)
+            except httpx.TransportError as e:
+                # узел недоступен — пробуем следующий
+                logger.warning("image node failed", extra={"node": node.base_url, "error": str(e)})
+                self._mark_down(node)
+            finally:
+                if job_id:
+                    with self._lock:
+                        self._jobs.pop(job_id, None)
+
+    async def generate(self, prompt, preview=False, seed=None, job_id=None):
+        return await self._call("generate", job_id, prompt, preview=preview, seed=seed)
+
+    async def generate_batch(self, prompts, seed=None, job_id=None):
+        return await self._call("generate_batch", job_id, prompts, seed=seed)
+
+    async def edit(self, prompt, image_base64, seed=None, job_id=None):
+        return await self._call("edit", job_id, prompt, image_base64, seed=seed)
+
+    async def cancel(self, job_id):
+        with self._lock:
+            node = self._jobs.get(job_id)
+        if node is not None:
+            await node.cancel(job_id)
+
+    async def health(self):
+        await self._refresh_health()
+        with self._lock:
+            return any(self._healthy)
+
+
+def _parse_endpoints(raw: str) -> List[Tuple[str, float]]:
+    """IMAGE_SERVICE_URLS="http://gpu1:3339=2,http://gpu2:3339" — вес по умолчанию 1"""
+    endpoints = []
+    for item in raw.split(","):
+        item = item.strip()
+        if not item:
+            continue
+        url, _, weight = item.partition("=")
+        endpoints.append((url.strip(), float(weight) if weight else 1.0))
+    return endpoints
+
+
+_backend: Optional[ImageBackend] = None
+
+
+def get_image_backend() -> ImageBackend:
+    """
+    Сервис изображений процесса, выбирается переменными окружения:
+    IMAGE_BACKEND=http (по умолчанию, IMAGE_SERVICE_URL)
+                 =pool (IMAGE_SERVICE_URLS, IMAGE_HEALTH_INTERVAL)
+                 =fake (FAKE_IMAGE_LATENCY, FAKE_IMAGE_SIZE, FAKE_IMAGE_CONCURRENCY)
+    """
+    global _backend
+    if _backend is not None:
+        return _backend
+
+    kind = os.getenv("IMAGE_BACKEND", "http").lower()
+    if kind == "fake":
+        _backend = FakeImageBackend(
+            latency=float(os.getenv("FAKE_IMAGE_LATENCY", "0.5")),
+            size=int(os.getenv("FAKE_IMAGE_SIZE", "512")),
+            concurrency=int(os.getenv("FAKE_IMAGE_CONCURRENCY", "0")),
+        )
+    elif kind == "pool":
+        _backend = PooledHttpImageBackend(
+            _parse_endpoints(os.getenv("IMAGE_SERVICE_URLS", "http://127.0.0.1:3339")),
+            health_interval=float(os.getenv("IMAGE_HEALTH_INTERVAL", "10")),
+        )
+    elif kind == "http":
+        _backend = HttpImageBackend(os.getenv("IMAGE_SERVICE_URL", "http://127.0.0.1:3339"))
+    else:
+        raise ValueError(f"Unknown IMAGE_BACKEND: {kind}")
+    return _backend
+
+
+def set_image_backend(backend: Optional[ImageBackend]):
+    """Подменить сервис изображений (бенчмарки, отладка); None — заново прочитать окружение"""
+    global _backend
+    _backend = backend
@@ -0,0 +1,225 @@
+"""
+Сборщик мусора изображений в хранилище.
+Сверяет ссылки из БД (Project.image_paths, ScenarioElementImage.image_path)
+с PNG-файлами в хранилище:
+- исправляет ImageBlob.refcount, если счётчик разошёлся со ссылками
+- удаляет файлы без ссылок: блобы с refcount 0 и старые файлы блоков
+  (правки, черновики, картинки удалённых блоков, результаты отменённых задач)
+Файлы и счётчики, менявшиеся за последние grace секунд, не трогаются —
+их может сейчас записывать идущая задача генерации.
+
+Запускается в фоне каждые IMAGE_GC_INTERVAL секунд (0 — выключен) или вручную:
+    python -m api.scripts.image_gc --dry-run
+"""
+import argparse
+import json
+import logging
+import os
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Optional
+
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from ..schemas.schemas import SessionLocal, Project, ScenarioElementImage, ImageBlob
+from ..storage import Storage, get_storage, storage_key
+from ..image_store import IMAGE_FIELDS, blob_hash, blob_key
+from ..metrics import GC_RECLAIMED_BYTES, GC_DELETED_FILES
+
+logger = logging.getLogger("api.images")
+
+GC_INTERVAL = float(os.getenv("IMAGE_GC_INTERVAL", "3600"))
+GC_GRACE = float(os.getenv("IMAGE_GC_GRACE", "600"))
+
+_worker: Optional[threading.Thread] = None
+
+
+def _aware(value: Optional[datetime]) -> datetime:
+    # SQLite отдаёт время без зоны (это UTC)
+    if value is None:
+        return datetime.min.replace(tzinfo=timezone.utc)
+    return value if value.tzinfo else value.replace(tzinfo=timezone.utc)
+
+
+def collect_references(db: Session) -> Counter:
+    """Число ссылок на каждый ключ изображения в БД"""
+    refs: Counter = Counter()
+    for (image_paths,) in db.query(Project.image_paths).filter(Project.image_paths.isnot(None)).yield_per(500):
+        try:
+            blocks = json.loads(image_paths).get("blocks") or []
+        except (json.JSONDecodeError, TypeError, AttributeError):
+            continue
+        for entry in blocks:
+            if not isinstance(entry, dict):
+                continue
+            for field in IMAGE_FIELDS:
+                key = storage_key(entry.get(field))
+                if key:
+                    refs[key] += 1
+
+    for (image_path,) in db.query(ScenarioElementImage.image_path).filter(ScenarioElementImage.image_path.isnot(None)):
+        key = storage_key(image_path)
+        if key:
+            refs[key] += 1
+    return refs
+
+
+def _claim_blob(db: Session, digest: str, cutoff: datetime) -> bool:
+    """
+    Забирает блоб на удаление: удаляет его строку, если на неё нет ссылок и она
+    не менялась с cutoff. У файла без строки (задача упала до коммита) строка
+    сначала создаётся. Пока транзакция не закрыта, put_image того же содержимого
+    ждёт на этой строке, а после — создаёт её заново и записывает файл.
+    """
+    if db.get(ImageBlob, digest) is None:
+        try:
+            db.add(ImageBlob(hash=digest, size=0, refcount=0, updated_at=datetime.min.replace(tzinfo=timezone.utc)))
+            db.flush()
+        except IntegrityError:
+            # Строку только что создал put_image — блоб снова используется
+            db.rollback()
+            return False
+    deleted = db.query(ImageBlob).filter(
+        ImageBlob.hash == digest, ImageBlob.refcount <= 0, ImageBlob.updated_at < cutoff
+    ).delete(synchronize_session=False)
+    return deleted == 1
+
+
+def collect_garbage(db: Session, storage: Optional[Storage] = None, grace: float = GC_GRACE,
+                    dry_run: bool = False) -> Dict[str, Any]:
+    """
+    Один проход сборщика. Возвращает отчёт: сколько файлов просмотрено и удалено,
+    сколько байт освобождено, сколько счётчиков исправлено и какие ссылки
+    указывают на отсутствующие файлы.
+    """
+    storage = storage or get_storage()
+    started = time.perf_counter()
+    cutoff = datetime.now(timezone.utc) - timedelta(seconds=grace)
+    cutoff_ts = cutoff.timestamp()
+
+    refs = collect_references(db)
+    report: Dict[str, Any] = {
+        "dry_run": dry_run,
+        "scanned_files": 0,
+        "scanned_bytes": 0,
+        "referenced_keys": len(refs),
+        "deleted_files": 0,
+        "reclaimed_bytes": 0,
+        "refcounts_fixed": 0,
+        "missing_files": [],
+    }
+
+    # 1. Счётчики ссылок блобов
+    blobs = {blob.hash: blob for blob in db.query(ImageBlob)}
+    blob_refs = Counter()
+    for key, count in refs.items():
+        digest = blob_hash(key)
+        if digest is not None:
+            blob_refs[digest] += count
+
+    for digest, blob in blobs.items():
+        actual = blob_refs.get(digest, 0)
+        if blob.refcount != actual and _aware(blob.updated_at) < cutoff:
+            report["refcounts_fixed"] += 1
+            if not dry_run:
+                db.query(ImageBlob).filter(
+                    ImageBlob.hash == digest, ImageBlob.updated_at < cutoff
+                ).update({ImageBlob.refcount: actual}, synchronize_session=False)
+    if not dry_run:
+        db.commit()
+
+    # 2. Файлы изображений без ссылок
+    present = set()
+    for key, size, modified in storage.list():
+        if not key.endswith(".png"):
+            continue
+        present.add(key)
+        report["scanned_files"] += 1
+        report["scanned_bytes"] += size
+        if refs.get(key) or modified >= cutoff_ts:
+            continue
+
+        digest = blob_hash(key)
+        if dry_run:
+            blob = blobs.get(digest) if digest else None
+            if blob is not None and _aware(blob.updated_at) >= cutoff:
+                continue
+        elif digest is not None:
+            if not _claim_blob(db, digest, cutoff):
+                db.rollback()
+                continue
+
+        if not dry_run:
+            try:
+                storage.delete(key)
+            except Exception as e:
+                db.rollback()
+                logger.warning("gc delete failed: %s", e, extra={"key": key})
+                continue
+            db.commit()
+        report["deleted_files"] += 1
+        report["reclaimed_bytes"] += size
+
+    # 3. Строки блобов без файлов и без ссылок; ссылки на отсутствующие файлы
+    for digest, blob in blobs.items():
+        if blob_key(digest) not in present and not blob_refs.get(digest) and not dry_run:
+            db.query(ImageBlob).filter(
+                ImageBlob.hash == digest, ImageBlob.refcount <= 0, ImageBlob.updated_at < cutoff
+            ).delete(synchronize_session=False)
+    if not dry_run:
+        db.commit()
+    report["missing_files"] = sorted(key for key in refs if key.endswith(".png") and key not in present)
+
+    if not dry_run:
+        GC_DELETED_FILES.inc(report["deleted_files"])
+        GC_RECLAIMED_BYTES.inc(report["reclaimed_bytes"])
+    logger.info(
+        "image gc finished: %d files, %d bytes reclaimed",
+        report["deleted_files"], report["reclaimed_bytes"],
+        extra={**{k: v for k, v in report.items() if k != "missing_files"},
+               "missing": len(report["missing_files"]),
+               "duration_ms": round((time.perf_counter() - started) * 1000, 1)},
+    )
+    return report
+
+
+def run_once(dry_run: bool = False, grace: float = GC_GRACE) -> Dict[str, Any]:
+    db = SessionLocal()
+    try:
+        return collect_garbage(db, grace=grace, dry_run=dry_run)
+    finally:
+        db.close()
+
+
+def _loop(interval: float):
+    while True:
+        time.sleep(interval)
+        try:
+            run_once()
+        except Exception:
+            logger.exception("image gc failed")
+
+
+def start_gc_worker(interval: float = GC_INTERVAL):
+    """Запускает фоновый поток сборщика (один на процесс)"""
+    global _worker
+    if _worker is not None or interval <= 0:
+        return
+    _worker = threading.Thread(target=_loop, args=(interval,), name="image-gc", daemon=True)
+    _worker.start()
+
+
+if __name__ == "__main__":
+    from ..logging_config import setup_logging
+
+    parser = argparse.ArgumentParser(description="Image storage garbage collector")
+    parser.add_argument("--dry-run", action="store_true", help="только отчёт, без удаления")
+    parser.add_argument("--grace", type=float, default=GC_GRACE,
+                        help="не трогать файлы моложе стольких секунд")
+    args = parser.parse_args()
+
+    setup_logging()
+    print(json.dumps(run_once(dry_run=args.dry_run, grace=args.grace), ensure_ascii=False, indent=2))
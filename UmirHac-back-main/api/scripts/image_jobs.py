@@ -0,0 +1,282 @@
+import hashlib
+import os
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError
+
+from ..schemas.schemas import SessionLocal, BackgroundJob
+from ..logging_config import request_id_var
+
+# memory — задачи и реестр в памяти процесса (один воркер API),
+# db — общая очередь в таблице background_jobs (несколько воркеров/узлов, см. job_queue.py)
+JOB_QUEUE = os.getenv("JOB_QUEUE", "memory").lower()
+
+# Как часто задача из общей очереди перечитывает флаг отмены из БД
+CANCEL_POLL_INTERVAL = float(os.getenv("JOB_CANCEL_POLL", "0.5"))
+
+
+def content_hash(text: str) -> str:
+    """Хэш содержимого блока (промпта), по которому склеиваются повторные запуски"""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()[:16]
+
+
+class ImageJob:
+    """
+    Задача генерации/редактирования изображения для одного блока.
+    Идентичность — (project_id, block_index, content_hash).
+    Несколько блоков пакетной задачи делят один job_id.
+    """
+
+    def __init__(self, job_id: str, project_id: int, block_index: int, content_hash: str):
+        self.job_id = job_id
+        self.project_id = project_id
+        self.block_index = block_index
+        self.content_hash = content_hash
+        self.cancelled = threading.Event()
+        self.created_at = time.monotonic()
+
+    @property
+    def is_cancelled(self) -> bool:
+        return self.cancelled.is_set()
+
+
+class ImageJobRegistry:
+    """
+    Реестр задач, которые сейчас выполняются в фоне.
+    - повторный запуск для того же блока с тем же содержимым возвращает уже идущую задачу
+    - новый запуск с другим содержимым отменяет устаревшую задачу блока
+    - отменённая задача не должна записывать результат (проверяется в фоновой задаче)
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._by_block: Dict[Tuple[int, int], ImageJob] = {}
+        self._by_id: Dict[str, List[ImageJob]] = {}
+
+    def submit(
+        self,
+        project_id: int,
+        block_index: int,
+        content: str,
+        job_id: Optional[str] = None
+    ) -> Tuple[ImageJob, bool]:
+        """
+        Регистрирует задачу для блока.
+        Возвращает (задача, создана_ли_новая). Если такая же задача уже идёт —
+        возвращает её и False, новую фоновую задачу запускать не нужно.
+        """
+        digest = content_hash(content)
+        key = (project_id, block_index)
+
+        with self._lock:
+            current = self._by_block.get(key)
+            if current and not current.is_cancelled and current.content_hash == digest:
+                return current, False
+
+            if current:
+                # Содержимое блока изменилось — старый результат уже не нужен
+                current.cancelled.set()
+
+            job = ImageJob(job_id or uuid.uuid4().hex, project_id, block_index, digest)
+            self._by_block[key] = job
+            self._by_id.setdefault(job.job_id, []).append(job)
+            return job, True
+
+    def pending(self) -> int:
+        """Число блоков, для которых сейчас выполняется задача"""
+        with self._lock:
+            return len(self._by_block)
+
+    def get(self, job_id: str) -> List[ImageJob]:
+        with self._lock:
+            return list(self._by_id.get(job_id, []))
+
+    def finish(self, job: ImageJob):
+        """Убирает задачу из реестра после завершения (успешного или нет)"""
+        with self._lock:
+            key = (job.project_id, job.block_index)
+            if self._by_block.get(key) is job:
+                del self._by_block[key]
+
+            jobs = self._by_id.get(job.job_id)
+            if jobs and job in jobs:
+                jobs.remove(job)
+                if not jobs:
+                    del self._by_id[job.job_id]
+
+    def cancel(self, job_id: str) -> List[ImageJob]:
+        """Отменяет все блоки задачи с данным job_id"""
+        with self._lock:
+            jobs = list(self._by_id.get(job_id, []))
+        for job in jobs:
+            job.cancelled.set()
+        return jobs
+
+    def cancel_for_blocks(self, project_id: int, block_indices: Optional[List[int]] = None) -> List[ImageJob]:
+        """
+        Отменяет задачи проекта для перечисленных block_indices
+        (если они не переданы — для всех блоков проекта).
+        """
+        with self._lock:
+            jobs = [
+                job for (pid, idx), job in self._by_block.items()
+                if pid == project_id and (block_indices is None or idx in block_indices)
+            ]
+        for job in jobs:
+            job.cancelled.set()
+        return jobs
+
+
+class DbImageJob(ImageJob):
+    """
+    Задача из общей очереди. Отменить её может любой воркер, поэтому флаг отмены
+    читается из БД (не чаще раза в CANCEL_POLL_INTERVAL секунд).
+    """
+
+    def __init__(self, row: BackgroundJob):
+        super().__init__(row.job_id, row.project_id, row.block_index, row.content_hash)
+        self.row_id = row.id
+        # created_at — по часам процесса (time.monotonic), как у задач в памяти
+        if row.created_at is not None:
+            created = row.created_at if row.created_at.tzinfo else row.created_at.replace(tzinfo=timezone.utc)
+            self.created_at -= max(0.0, (datetime.now(timezone.utc) - created).total_seconds())
+        if row.cancelled:
+            self.cancelled.set()
+        self._checked_at = time.monotonic()
+
+    @property
+    def is_cancelled(self) -> bool:
+        if self.cancelled.is_set():
+            return True
+        now = time.monotonic()
+        if now - self._checked_at >= CANCEL_POLL_INTERVAL:
+            self._checked_at = now
+            db = SessionLocal()
+            try:
+                if db.query(BackgroundJob.cancelled).filter(BackgroundJob.id == self.row_id).scalar():
+                    self.cancelled.set()
+            finally:
+                db.close()
+        return self.cancelled.is_set()
+
+
+class DbImageJobRegistry:
+    """
+    Реестр задач в таблице background_jobs — тот же интерфейс, что у ImageJobRegistry,
+    но общий для всех процессов API. Активная задача блока — строка с active_key;
+    его уникальность разрешает гонку двух воркеров, запускающих задачу одного блока.
+    """
+
+    _ACTIVE = ("new", "queued", "running")
+
+    @staticmethod
+    def _active_key(project_id: int, block_index: int) -> str:
+        return f"{project_id}:{block_index}"
+
+    def submit(
+        self,
+        project_id: int,
+        block_index: int,
+        content: str,
+        job_id: Optional[str] = None
+    ) -> Tuple[ImageJob, bool]:
+        digest = content_hash(content)
+        key = self._active_key(project_id, block_index)
+
+        for _ in range(5):
+            db = SessionLocal()
+            try:
+                current = db.query(BackgroundJob).filter(BackgroundJob.active_key == key).first()
+                if current and not current.cancelled and current.content_hash == digest:
+                    return DbImageJob(current), False
+
+                if current:
+                    # Содержимое блока изменилось — старый результат уже не нужен
+                    current.cancelled = True
+                    current.active_key = None
+                    db.flush()
+
+                row = BackgroundJob(
+                    job_id=job_id or uuid.uuid4().hex,
+                    project_id=project_id,
+                    block_index=block_index,
+                    content_hash=digest,
+                    active_key=key,
+                    status="new",
+                    request_id=request_id_var.get(),
+                    created_at=datetime.now(timezone.utc),
+                )
+                db.add(row)
+                db.commit()
+                return DbImageJob(row), True
+            except IntegrityError:
+                # Параллельно задачу этого блока поставил другой воркер — перечитываем
+                db.rollback()
+            finally:
+                db.close()
+        raise RuntimeError(f"Could not register image job for block {key}")
+
+    def pending(self) -> int:
+        db = SessionLocal()
+        try:
+            return db.query(func.count(BackgroundJob.id)).filter(BackgroundJob.active_key.isnot(None)).scalar()
+        finally:
+            db.close()
+
+    def get(self, job_id: str) -> List[ImageJob]:
+        db = SessionLocal()
+        try:
+            rows = db.query(BackgroundJob).filter(
+                BackgroundJob.job_id == job_id,
+                BackgroundJob.block_index.isnot(None),
+                BackgroundJob.status.in_(self._ACTIVE),
+            ).all()
+            return [DbImageJob(row) for row in rows]
+        finally:
+            db.close()
+
+    def finish(self, job: ImageJob):
+        db = SessionLocal()
+        try:
+            row = db.get(BackgroundJob, job.row_id)
+            if row is not None and row.finished_at is None:
+                row.status = "cancelled" if (row.cancelled or job.cancelled.is_set()) else "done"
+                row.active_key = None
+                row.finished_at = datetime.now(timezone.utc)
+                db.commit()
+        finally:
+            db.close()
+
+    def _cancel(self, *criteria) -> List[ImageJob]:
+        db = SessionLocal()
+        try:
+            rows = db.query(BackgroundJob).filter(
+                BackgroundJob.block_index.isnot(None),
+                BackgroundJob.status.in_(self._ACTIVE),
+                *criteria
+            ).all()
+            for row in rows:
+                row.cancelled = True
+                row.active_key = None
+            db.commit()
+            return [DbImageJob(row) for row in rows]
+        finally:
+            db.close()
+
+    def cancel(self, job_id: str) -> List[ImageJob]:
+        return self._cancel(BackgroundJob.job_id == job_id)
+
+    def cancel_for_blocks(self, project_id: int, block_indices: Optional[List[int]] = None) -> List[ImageJob]:
+        criteria = [BackgroundJob.project_id == project_id, BackgroundJob.active_key.isnot(None)]
+        if block_indices is not None:
+            criteria.append(BackgroundJob.block_index.in_(block_indices))
+        return self._cancel(*criteria)
+
+
+# Общий реестр процесса (при JOB_QUEUE=db — общий для всех процессов)
+image_jobs = DbImageJobRegistry() if JOB_QUEUE == "db" else ImageJobRegistry()
@@ -0,0 +1,275 @@
+"""
+Запуск фоновых задач (генерация сценария, изображений, правки изображений).
+
+JOB_QUEUE=memory (по умолчанию) — задача выполняется в том же процессе через
+    BackgroundTasks, реестр задач изображений живёт в памяти. Только один воркер API.
+JOB_QUEUE=db — задача пишется в таблицу background_jobs, её забирает любой процесс:
+    воркеры внутри API (JOB_WORKERS потоков на процесс, 0 — не выполнять задачи)
+    или отдельные процессы `python -m api.scripts.job_queue`. Отмена и склейка
+    повторных запусков идут через ту же таблицу, статусы — через Project, поэтому
+    status/images может обслуживать любой воркер и API масштабируется горизонтально.
+    Задачи упавшего процесса (нет heartbeat дольше JOB_STALE_AFTER секунд)
+    возвращаются в очередь, не более JOB_MAX_ATTEMPTS запусков; задачи, так и
+    не поставленные в очередь за это время, считаются проваленными.
+
+Обработчик задачи — handler(db, payload, jobs): payload — JSON-совместимый dict
+аргументов, jobs — задачи изображений блоков (ImageJob), для сценария пустой список.
+"""
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable, Dict, List, Optional, Sequence, Set
+
+from fastapi import BackgroundTasks
+from sqlalchemy.orm import Session
+
+from ..schemas.schemas import SessionLocal, BackgroundJob
+from ..logging_config import request_id_var
+from .image_jobs import JOB_QUEUE, DbImageJob, ImageJob, image_jobs
+
+logger = logging.getLogger("api.jobs")
+
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "4"))
+POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", "0.5"))
+STALE_AFTER = float(os.getenv("JOB_STALE_AFTER", "120"))
+MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "2"))
+
+Handler = Callable[[Session, Dict[str, Any], List[ImageJob]], None]
+
+_handlers: Dict[str, Handler] = {}
+
+
+def register(kind: str, handler: Handler):
+    """Регистрирует обработчик задач вида kind"""
+    _handlers[kind] = handler
+
+
+def dispatch(background_tasks: BackgroundTasks, db: Session, kind: str, payload: Dict[str, Any],
+             jobs: Sequence[ImageJob] = ()):
+    """
+    Ставит задачу на выполнение. jobs — задачи блоков, уже зарегистрированные
+    в image_jobs.submit (при JOB_QUEUE=db это строки background_jobs в статусе new).
+    """
+    if JOB_QUEUE != "db":
+        background_tasks.add_task(_handlers[kind], db, payload, list(jobs))
+        return
+
+    session = SessionLocal()
+    try:
+        body = json.dumps(payload, ensure_ascii=False)
+        if jobs:
+            session.query(BackgroundJob).filter(BackgroundJob.id.in_([job.row_id for job in jobs])).update(
+                {BackgroundJob.kind: kind, BackgroundJob.payload: body, BackgroundJob.status: "queued"},
+                synchronize_session=False,
+            )
+        else:
+            session.add(BackgroundJob(
+                job_id=uuid.uuid4().hex, kind=kind, payload=body, project_id=payload.get("project_id"),
+                status="queued", request_id=request_id_var.get(), created_at=datetime.now(timezone.utc),
+            ))
+        session.commit()
+    finally:
+        session.close()
+    _wakeup.set()
+
+
+# Будит воркеры этого процесса сразу после dispatch (остальные узнают при опросе)
+_wakeup = threading.Event()
+
+
+class JobWorker:
+    """Потоки, выполняющие задачи из background_jobs, и поток heartbeat/возврата зависших задач"""
+
+    def __init__(self, threads: int = JOB_WORKERS):
+        self.threads = threads
+        self.worker_id = uuid.uuid4().hex[:12]
+        self._running: Set[str] = set()
+        self._lock = threading.Lock()
+
+    def start(self):
+        for i in range(self.threads):
+            threading.Thread(target=self._loop, name=f"job-worker-{i}", daemon=True).start()
+        threading.Thread(target=self._heartbeat_loop, name="job-heartbeat", daemon=True).start()
+        logger.info("job worker started", extra={"worker": self.worker_id, "threads": self.threads})
+
+    def _loop(self):
+        while True:
+            try:
+                claimed = self._claim()
+            except Exception:
+                logger.exception("job claim failed")
+                claimed = None
+            if claimed is None:
+                _wakeup.wait(POLL_INTERVAL)
+                _wakeup.clear()
+                continue
+            self._run(*claimed)
+
+    def _claim(self):
+        """Забирает старейшую задачу из очереди (все строки её job_id) или None"""
+        db = SessionLocal()
+        try:
+            while True:
+                job_id = db.query(BackgroundJob.job_id).filter(
+                    BackgroundJob.status == "queued"
+                ).order_by(BackgroundJob.id).limit(1).scalar()
+                if job_id is None:
+                    return None
+
+                claim = uuid.uuid4().hex
+                now = datetime.now(timezone.utc)
+                # Условие status == queued делает захват атомарным: задачу получит один воркер
+                claimed = db.query(BackgroundJob).filter(
+                    BackgroundJob.job_id == job_id, BackgroundJob.status == "queued"
+                ).update({
+                    BackgroundJob.status: "running", BackgroundJob.claim: claim,
+                    BackgroundJob.started_at: now, BackgroundJob.heartbeat_at: now,
+                    BackgroundJob.attempts: BackgroundJob.attempts + 1,
+                }, synchronize_session=False)
+                db.commit()
+                if claimed:
+                    rows = db.query(BackgroundJob).filter(BackgroundJob.claim == claim).order_by(BackgroundJob.id).all()
+                    with self._lock:
+                        self._running.add(claim)
+                    return claim, rows
+        finally:
+            db.close()
+
+    def _run(self, claim: str, rows: List[BackgroundJob]):
+        kind = rows[0].kind
+        jobs = [DbImageJob(row) for row in rows if row.block_index is not None]
+        token = request_id_var.set(rows[0].request_id)
+        db = SessionLocal()
+        try:
+            if jobs and all(job.is_cancelled for job in jobs):
+                # Отменили, пока задача ждала в очереди
+                for job in jobs:
+                    image_jobs.finish(job)
+            else:
+                logger.info("job started", extra={"job_id": rows[0].job_id, "kind": kind, "worker": self.worker_id})
+                _handlers[kind](db, json.loads(rows[0].payload or "{}"), jobs)
+        except Exception:
+            logger.exception("job failed", extra={"job_id": rows[0].job_id, "kind": kind})
+        finally:
+            db.close()
+            request_id_var.reset(token)
+            with self._lock:
+                self._running.discard(claim)
+            self._close(claim)
+
+    @staticmethod
+    def _close(claim: str):
+        """Завершает строки задачи, которые не закрыл сам обработчик (например, сценарий)"""
+        db = SessionLocal()
+        try:
+            db.query(BackgroundJob).filter(
+                BackgroundJob.claim == claim, BackgroundJob.finished_at.is_(None)
+            ).update({
+                BackgroundJob.status: "done", BackgroundJob.active_key: None,
+                BackgroundJob.finished_at: datetime.now(timezone.utc),
+            }, synchronize_session=False)
+            db.commit()
+        finally:
+            db.close()
+
+    def _heartbeat_loop(self):
+        interval = max(1.0, STALE_AFTER / 4)
+        while True:
+            time.sleep(interval)
+            try:
+                self._heartbeat()
+                requeue_stale_jobs()
+            except Exception:
+                logger.exception("job heartbeat failed")
+
+    def _heartbeat(self):
+        with self._lock:
+            claims = list(self._running)
+        if not claims:
+            return
+        db = SessionLocal()
+        try:
+            db.query(BackgroundJob).filter(BackgroundJob.claim.in_(claims)).update(
+                {BackgroundJob.heartbeat_at: datetime.now(timezone.utc)}, synchronize_session=False
+            )
+            db.commit()
+        finally:
+            db.close()
+
+
+def requeue_stale_jobs(stale_after: float = STALE_AFTER) -> int:
+    """
+    Возвращает в очередь задачи, чей воркер перестал слать heartbeat (процесс упал);
+    после JOB_MAX_ATTEMPTS запусков задача считается проваленной.
+    Строки new, которые так и не поставили в очередь (запрос упал между
+    image_jobs.submit и dispatch), считаются проваленными, и их active_key
+    освобождается — иначе повторный запуск блока склеивался бы с ними навсегда.
+    """
+    now = datetime.now(timezone.utc)
+    cutoff = now - timedelta(seconds=stale_after)
+    db = SessionLocal()
+    try:
+        stale = db.query(BackgroundJob).filter(
+            BackgroundJob.status == "running", BackgroundJob.heartbeat_at < cutoff
+        ).all()
+        for row in stale:
+            if row.attempts < MAX_ATTEMPTS and not row.cancelled:
+                row.status = "queued"
+                row.claim = None
+            else:
+                row.status = "failed"
+                row.active_key = None
+                row.finished_at = now
+        abandoned = db.query(BackgroundJob).filter(
+            BackgroundJob.status == "new", BackgroundJob.created_at < cutoff
+        ).update({
+            BackgroundJob.status: "failed", BackgroundJob.active_key: None,
+            BackgroundJob.finished_at: now,
+        }, synchronize_session=False)
+        db.commit()
+        if stale:
+            logger.warning("stale jobs recovered", extra={"jobs": len(stale)})
+        if abandoned:
+            logger.warning("undispatched jobs expired", extra={"jobs": abandoned})
+        return len(stale) + abandoned
+    finally:
+        db.close()
+
+
+_worker: Optional[JobWorker] = None
+
+
+def start_job_workers(threads: int = JOB_WORKERS):
+    """Запускает воркеры очереди в этом процессе (только при JOB_QUEUE=db, один раз)"""
+    global _worker
+    if JOB_QUEUE != "db" or threads <= 0 or _worker is not None:
+        return
+    _worker = JobWorker(threads)
+    _worker.start()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    from ..logging_config import setup_logging
+    from ..tracing import setup_tracing
+    from ..schemas.schemas import init_db
+    from ..routers import script_generator  # noqa: F401 — регистрирует обработчики задач
+
+    parser = argparse.ArgumentParser(description="Background job worker (JOB_QUEUE=db)")
+    parser.add_argument("--threads", type=int, default=JOB_WORKERS)
+    args = parser.parse_args()
+
+    if JOB_QUEUE != "db":
+        raise SystemExit("Set JOB_QUEUE=db to run a standalone job worker")
+    setup_logging()
+    setup_tracing("umir-worker")
+    if os.getenv("DB_AUTO_CREATE", "1") != "0":
+        init_db()
+    start_job_workers(args.threads)
+    while True:
+        time.sleep(3600)
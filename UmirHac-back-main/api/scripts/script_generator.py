@@ -2,14 +2,21 @@ from openai import OpenAI
 import os
 import json
 from pydantic import BaseModel, Field, ConfigDict
-from typing import List, Literal, Dict, Any, Optional, Union
+from typing import List, Literal, Dict, Any, Optional, Union, Callable
 from dotenv import load_dotenv
+import time
+import logging
+
+from ..metrics import observe_llm_call
+from ..tracing import span
+from ..block_order import spread_ranks
 
 load_dotenv()
+logger = logging.getLogger("api.script_generator")
 
 # Настройка клиента
 client = OpenAI(
-    base_url="https://openrouter.ai/api/v1",
+    base_url=os.getenv("OPENROUTER_BASE_URL", "https://openrouter.ai/api/v1"),
     api_key=os.getenv("OPENROUTER_API_KEY"),
 )
 
@@ -54,11 +61,27 @@ class ScriptBlock(StrictModel):
 class FinalScript(StrictModel):
     blocks: List[ScriptBlock]
 
+def _parse_completion(stage: str, **kwargs):
+    """Запрос к LLM со структурированным ответом + метрики латентности и токенов"""
+    t0 = time.perf_counter()
+    with span("llm.chat", **{"llm.stage": stage, "llm.model": kwargs["model"]}) as current:
+        try:
+            completion = client.beta.chat.completions.parse(**kwargs)
+        except Exception:
+            observe_llm_call(stage, kwargs["model"], time.perf_counter() - t0, ok=False)
+            raise
+        observe_llm_call(stage, kwargs["model"], time.perf_counter() - t0, completion.usage)
+        if current is not None and completion.usage is not None:
+            current.set_attribute("llm.prompt_tokens", completion.usage.prompt_tokens)
+            current.set_attribute("llm.completion_tokens", completion.usage.completion_tokens)
+    return completion
+
 # 5. Функция для первого этапа - ПЛАНИРОВАНИЕ
 def create_script_plan(product_description: str) -> ScriptPlan:
     """Создает план сценария с последовательностью блоков"""
-    print(f"ЗАДАНЫЙ ПРОМПТ: {product_description}")
-    completion = client.beta.chat.completions.parse(
+    logger.debug("product description: %s", product_description)
+    completion = _parse_completion(
+        "plan",
         model="openai/gpt-4.1-nano",
         messages=[
             {
@@ -95,7 +118,8 @@ def generate_script_blocks(product_description: str, script_plan: ScriptPlan) ->
         for i, block_type in enumerate(script_plan.block_sequence)
     ])
 
-    completion = client.beta.chat.completions.parse(
+    completion = _parse_completion(
+        "blocks",
         model="openai/gpt-4.1-nano",
         messages=[
             {
@@ -129,8 +153,12 @@ def generate_script_blocks(product_description: str, script_plan: ScriptPlan) ->
     return completion.choices[0].message.parsed
 
 # 7. Пост-обработка: применение форматирования и удаление дубликатов
-def post_process_script(product_description: str, blocks: List[Dict], output_file: str = "final_script.json"):
-    """Применяет форматирование, удаляет дубликаты и сохраняет в JSON с индексацией блоков"""
+def post_process_script(product_description: str, blocks: List[Dict], output_file: str = "final_script.json",
+                        save: Optional[Callable[[Dict], None]] = None):
+    """
+    Применяет форматирование, удаляет дубликаты и сохраняет в JSON с индексацией блоков.
+    save — запись в хранилище вместо файла output_file (см. api/storage.py)
+    """
 
     # Стандартные параметры форматирования
     STANDARD_FORMATTING = {
@@ -185,7 +213,7 @@ def post_process_script(product_description: str, blocks: List[Dict], output_fil
             prev_block = processed_blocks[-1]
             if (prev_block["type"] == block_type and
                 prev_block["content"] == content):
-                print(f"⚠️ Пропущен дубликат блока типа {block_type}")
+                logger.debug("duplicate block skipped", extra={"block_type": block_type})
                 continue
 
         # Применяем форматирование
@@ -200,73 +228,76 @@ def post_process_script(product_description: str, blocks: List[Dict], output_fil
 
         processed_blocks.append(final_block)
 
-    # Добавляем индексы всем блокам
-    for idx, block in enumerate(processed_blocks, 1):
+    # Добавляем индексы (постоянные идентификаторы) и ранги порядка всем блокам
+    for idx, (block, rank) in enumerate(zip(processed_blocks, spread_ranks(len(processed_blocks))), 1):
         block["index"] = idx
+        block["rank"] = rank
 
     # Сохраняем в JSON
     script_data = {
         "product_description": product_description,
         "original_blocks_count": len(blocks),
         "final_blocks_count": len(processed_blocks),
+        "next_block_index": len(processed_blocks) + 1,
         "blocks": processed_blocks
     }
 
-    with open(output_file, 'w', encoding='utf-8') as f:
-        json.dump(script_data, f, ensure_ascii=False, indent=2)
+    if save is not None:
+        save(script_data)
+    else:
+        with open(output_file, 'w', encoding='utf-8') as f:
+            json.dump(script_data, f, ensure_ascii=False, indent=2)
 
-    print(f"\n✅ Сценарий успешно сохранен в {output_file}")
-    print(f"Статистика: {len(blocks)} исходных блоков → {len(processed_blocks)} финальных блоков")
+    logger.info("script saved", extra={
+        "output_file": output_file,
+        "original_blocks": len(blocks),
+        "final_blocks": len(processed_blocks),
+    })
 
     return processed_blocks
 
 # 8. Основная функция
-def generate_ad_script(product_description: str, output_file: str = "final_script.json"):
+def generate_ad_script(product_description: str, output_file: str = "final_script.json",
+                       save: Optional[Callable[[Dict], None]] = None):
     """Основная функция для генерации рекламного сценария"""
 
-    print("🎬 НАЧАЛО ГЕНЕРАЦИИ СЦЕНАРИЯ")
-    print("=" * 50)
+    logger.info("script generation started", extra={"output_file": output_file})
 
     # Этап 1: Планирование
-    print("\n📈 ЭТАП 1: ПЛАНИРОВАНИЕ СЦЕНАРИЯ")
-    print("-" * 40)
-
     try:
-        script_plan = create_script_plan(product_description)
-        print(f"ВЕСЬ ПЛАН:\n{script_plan}")
-        print(f"✅ План создан успешно!")
-        print(f"📊 Количество блоков: {script_plan.total_blocks}")
-        print(f"📖 Сюжет: {script_plan.story_summary}")
-        print(f"🔄 Последовательность: {script_plan.block_sequence}")
+        with span("create_script_plan"):
+            script_plan = create_script_plan(product_description)
+        logger.info("plan created", extra={
+            "total_blocks": script_plan.total_blocks,
+            "block_sequence": script_plan.block_sequence,
+        })
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("plan: %s", script_plan.model_dump_json())
     except Exception as e:
-        print(f"❌ Ошибка на этапе планирования: {e}")
+        logger.error("planning failed: %s", e)
         raise e
 
     # Этап 2: Генерация блоков
-    print("\n📝 ЭТАП 2: ГЕНЕРАЦИЯ БЛОКОВ СЦЕНАРИЯ")
-    print("-" * 40)
-
     try:
-        final_script = generate_script_blocks(product_description, script_plan)
-        print(f"ВСЕ БЛОКИ:\n{final_script}")
-        print(f"✅ Блоки сгенерированы успешно!")
-        print(f"🧱 Сгенерировано блоков: {len(final_script.blocks)}")
+        with span("generate_script_blocks", blocks_planned=script_plan.total_blocks):
+            final_script = generate_script_blocks(product_description, script_plan)
+        logger.info("blocks generated", extra={"blocks": len(final_script.blocks)})
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("blocks: %s", final_script.model_dump_json())
     except Exception as e:
-        print(f"❌ Ошибка на этапе генерации: {e}")
+        logger.error("block generation failed: %s", e)
         raise e
 
     # Преобразуем блоки в словари для пост-обработки
     blocks_dict = [block.model_dump() for block in final_script.blocks]
 
-    # Пост-обработка
-    print("\n✨ ЭТАП 3: ПОСТ-ОБРАБОТКА")
-    print("-" * 40)
-
+    # Этап 3: Пост-обработка
     try:
-        processed_blocks = post_process_script(product_description, blocks_dict, output_file)
+        with span("post_process_script", blocks=len(blocks_dict)):
+            processed_blocks = post_process_script(product_description, blocks_dict, output_file, save)
         return processed_blocks
     except Exception as e:
-        print(f"❌ Ошибка на этапе пост-обработки: {e}")
+        logger.error("post-processing failed: %s", e)
         raise e
 
 # 9. Пример использования
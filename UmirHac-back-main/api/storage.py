@@ -0,0 +1,346 @@
+"""
+Хранилище файлов проектов (сценарии и изображения).
+В БД (Project.result_path, image_paths, ScenarioElementImage.image_path) лежат
+ключи объектов вида "<user_id>/<project_id>/<имя файла>", не зависящие от узла.
+Старые значения ("api/users_data/1/2/...png") приводятся к ключу через storage_key().
+
+STORAGE_BACKEND=local (по умолчанию) — каталог STORAGE_ROOT (api/users_data),
+               ссылки на скачивание подписываются HMAC и отдаются через GET /files/...
+STORAGE_BACKEND=s3 — S3-совместимое хранилище (S3_BUCKET, S3_ENDPOINT_URL, S3_PREFIX,
+               ключи доступа — стандартные переменные AWS_*), ссылки — presigned URL.
+"""
+import hashlib
+import hmac
+import json
+import os
+import tempfile
+import time
+from abc import ABC, abstractmethod
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Iterable, Iterator, Optional, Tuple
+from urllib.parse import quote
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+LEGACY_ROOT = "api/users_data"
+CHUNK_SIZE = 64 * 1024
+# Пул для параллельного чтения нескольких объектов (Storage.read_many)
+_read_pool = ThreadPoolExecutor(max_workers=int(os.getenv("STORAGE_READ_WORKERS", "8")),
+                                thread_name_prefix="storage-read")
+
+
+def project_key(user_id: int, project_id: int, name: str) -> str:
+    """Ключ файла проекта"""
+    return f"{user_id}/{project_id}/{name}"
+
+
+def storage_key(value: Optional[str]) -> Optional[str]:
+    """Ключ объекта по значению из БД (старые значения — пути на диске)"""
+    if not value:
+        return None
+    value = value.replace("\\", "/")
+    marker = LEGACY_ROOT + "/"
+    if marker in value:
+        return value.split(marker, 1)[1]
+    return value.lstrip("/")
+
+
+class Storage(ABC):
+    """
+    Интерфейс хранилища. Отсутствующий объект — FileNotFoundError
+    (read, iter_read, size); delete для отсутствующего объекта ничего не делает.
+    """
+
+    @abstractmethod
+    def write(self, key: str, data: bytes, content_type: Optional[str] = None):
+        ...
+
+    @abstractmethod
+    def write_stream(self, key: str, chunks: Iterable[bytes], content_type: Optional[str] = None):
+        ...
+
+    @abstractmethod
+    def read(self, key: str) -> bytes:
+        ...
+
+    @abstractmethod
+    def iter_read(self, key: str, chunk_size: int = CHUNK_SIZE) -> Iterator[bytes]:
+        ...
+
+    @abstractmethod
+    def exists(self, key: str) -> bool:
+        ...
+
+    @abstractmethod
+    def size(self, key: str) -> int:
+        ...
+
+    @abstractmethod
+    def delete(self, key: str):
+        ...
+
+    @abstractmethod
+    def list(self, prefix: str = "") -> Iterator[Tuple[str, int, float]]:
+        """(ключ, размер, время изменения в unix-секундах) всех объектов с префиксом"""
+
+    @abstractmethod
+    def url(self, key: str, expires: int = 3600) -> str:
+        """Ссылка для прямого скачивания, действительная expires секунд"""
+
+    def _read_or_none(self, key: str) -> Optional[bytes]:
+        try:
+            return self.read(key)
+        except OSError:
+            return None
+
+    def read_many(self, keys: Iterable[str]) -> Dict[str, bytes]:
+        """
+        Содержимое нескольких объектов, читаются параллельно в пуле потоков
+        (медленный диск / S3 не выстраивает чтения в очередь). Отсутствующие
+        и нечитаемые объекты в результат не попадают.
+        """
+        keys = list(dict.fromkeys(keys))
+        if len(keys) < 2:
+            pairs = ((key, self._read_or_none(key)) for key in keys)
+        else:
+            pairs = zip(keys, _read_pool.map(self._read_or_none, keys))
+        return {key: data for key, data in pairs if data is not None}
+
+    def iter_read_many(self, keys: Iterable[str], window: int = 2) -> Iterator[Tuple[str, Optional[bytes]]]:
+        """
+        (ключ, содержимое или None) по порядку keys. Следующие window объектов
+        читаются заранее в пуле потоков, в памяти одновременно не больше window + 1.
+        """
+        keys = iter(keys)
+        pending = deque()
+        for key in keys:
+            pending.append((key, _read_pool.submit(self._read_or_none, key)))
+            if len(pending) > window:
+                done_key, future = pending.popleft()
+                yield done_key, future.result()
+        while pending:
+            done_key, future = pending.popleft()
+            yield done_key, future.result()
+
+    def read_json(self, key: str) -> Any:
+        return json.loads(self.read(key).decode("utf-8"))
+
+    def write_json(self, key: str, data: Any):
+        self.write(key, json.dumps(data, ensure_ascii=False, indent=2).encode("utf-8"),
+                   content_type="application/json")
+
+
+class LocalStorage(Storage):
+    """Файлы в каталоге на диске; запись атомарная (временный файл + rename)"""
+
+    def __init__(self, root: str, url_secret: str, public_url: str = ""):
+        self.root = os.path.abspath(root)
+        self.url_secret = url_secret.encode("utf-8")
+        self.public_url = public_url.rstrip("/")
+
+    def path(self, key: str) -> str:
+        path = os.path.abspath(os.path.join(self.root, key))
+        if not path.startswith(self.root + os.sep):
+            raise ValueError(f"Invalid storage key: {key}")
+        return path
+
+    def write(self, key, data, content_type=None):
+        self.write_stream(key, [data], content_type)
+
+    def write_stream(self, key, chunks, content_type=None):
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                for chunk in chunks:
+                    f.write(chunk)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def read(self, key):
+        with open(self.path(key), "rb") as f:
+            return f.read()
+
+    def iter_read(self, key, chunk_size=CHUNK_SIZE):
+        # файл открываем сразу, чтобы FileNotFoundError был до начала ответа
+        f = open(self.path(key), "rb")
+
+        def chunks():
+            with f:
+                while True:
+                    chunk = f.read(chunk_size)
+                    if not chunk:
+                        break
+                    yield chunk
+        return chunks()
+
+    def exists(self, key):
+        return os.path.isfile(self.path(key))
+
+    def size(self, key):
+        return os.path.getsize(self.path(key))
+
+    def delete(self, key):
+        try:
+            os.remove(self.path(key))
+        except FileNotFoundError:
+            pass
+
+    def list(self, prefix=""):
+        for dirpath, _, filenames in os.walk(self.root):
+            for name in filenames:
+                if name.startswith(".tmp-"):
+                    continue
+                full = os.path.join(dirpath, name)
+                key = os.path.relpath(full, self.root).replace(os.sep, "/")
+                if key.startswith(prefix):
+                    stat = os.stat(full)
+                    yield key, stat.st_size, stat.st_mtime
+
+    def sign(self, key: str, expires_at: int) -> str:
+        message = f"{key}\n{expires_at}".encode("utf-8")
+        return hmac.new(self.url_secret, message, hashlib.sha256).hexdigest()
+
+    def verify(self, key: str, expires_at: int, signature: str) -> bool:
+        if expires_at < time.time():
+            return False
+        return hmac.compare_digest(self.sign(key, expires_at), signature)
+
+    def url(self, key, expires=3600):
+        expires_at = int(time.time()) + expires
+        return f"{self.public_url}/files/{quote(key)}?expires={expires_at}&sig={self.sign(key, expires_at)}"
+
+
+class S3Storage(Storage):
+    """S3-совместимое хранилище (AWS S3, MinIO и т.п.), нужен boto3"""
+
+    def __init__(self, bucket: str, prefix: str = "", endpoint_url: Optional[str] = None,
+                 region: Optional[str] = None):
+        import boto3
+        from botocore.exceptions import ClientError
+
+        self._client_error = ClientError
+        self.bucket = bucket
+        self.prefix = prefix.strip("/") + "/" if prefix.strip("/") else ""
+        self.client = boto3.client("s3", endpoint_url=endpoint_url, region_name=region)
+
+    def _key(self, key: str) -> str:
+        return self.prefix + key
+
+    def _missing(self, error) -> bool:
+        return error.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound")
+
+    def write(self, key, data, content_type=None):
+        extra = {"ContentType": content_type} if content_type else {}
+        self.client.put_object(Bucket=self.bucket, Key=self._key(key), Body=data, **extra)
+
+    def write_stream(self, key, chunks, content_type=None):
+        extra = {"ContentType": content_type} if content_type else None
+        # multipart-загрузка частями, без сборки всего файла в памяти
+        self.client.upload_fileobj(_ChunkReader(chunks), self.bucket, self._key(key), ExtraArgs=extra)
+
+    def _get(self, key):
+        try:
+            return self.client.get_object(Bucket=self.bucket, Key=self._key(key))
+        except self._client_error as e:
+            if self._missing(e):
+                raise FileNotFoundError(key)
+            raise
+
+    def read(self, key):
+        return self._get(key)["Body"].read()
+
+    def iter_read(self, key, chunk_size=CHUNK_SIZE):
+        return self._get(key)["Body"].iter_chunks(chunk_size)
+
+    def exists(self, key):
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=self._key(key))
+            return True
+        except self._client_error as e:
+            if self._missing(e):
+                return False
+            raise
+
+    def size(self, key):
+        try:
+            return self.client.head_object(Bucket=self.bucket, Key=self._key(key))["ContentLength"]
+        except self._client_error as e:
+            if self._missing(e):
+                raise FileNotFoundError(key)
+            raise
+
+    def delete(self, key):
+        self.client.delete_object(Bucket=self.bucket, Key=self._key(key))
+
+    def list(self, prefix=""):
+        paginator = self.client.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=self._key(prefix)):
+            for obj in page.get("Contents", []):
+                yield obj["Key"][len(self.prefix):], obj["Size"], obj["LastModified"].timestamp()
+
+    def url(self, key, expires=3600):
+        return self.client.generate_presigned_url(
+            "get_object", Params={"Bucket": self.bucket, "Key": self._key(key)}, ExpiresIn=expires
+        )
+
+
+class _ChunkReader:
+    """Файлоподобная обёртка над итератором байтов (для upload_fileobj)"""
+
+    def __init__(self, chunks: Iterable[bytes]):
+        self._chunks = iter(chunks)
+        self._buffer = b""
+
+    def read(self, size: int = -1) -> bytes:
+        while size < 0 or len(self._buffer) < size:
+            try:
+                self._buffer += next(self._chunks)
+            except StopIteration:
+                break
+        if size < 0:
+            data, self._buffer = self._buffer, b""
+        else:
+            data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
+
+
+_storage: Optional[Storage] = None
+
+
+def get_storage() -> Storage:
+    """Хранилище процесса по STORAGE_BACKEND"""
+    global _storage
+    if _storage is not None:
+        return _storage
+
+    kind = os.getenv("STORAGE_BACKEND", "local").lower()
+    if kind == "local":
+        _storage = LocalStorage(
+            os.getenv("STORAGE_ROOT", LEGACY_ROOT),
+            url_secret=os.getenv("STORAGE_URL_SECRET") or os.getenv("SECRET_KEY", "your-secret-key-here"),
+            public_url=os.getenv("STORAGE_PUBLIC_URL", ""),
+        )
+    elif kind == "s3":
+        _storage = S3Storage(
+            os.environ["S3_BUCKET"],
+            prefix=os.getenv("S3_PREFIX", ""),
+            endpoint_url=os.getenv("S3_ENDPOINT_URL"),
+            region=os.getenv("S3_REGION"),
+        )
+    else:
+        raise ValueError(f"Unknown STORAGE_BACKEND: {kind}")
+    return _storage
+
+
+def set_storage(storage: Optional[Storage]):
+    """Подменить хранилище (бенчмарки, отладка); None — заново прочитать окружение"""
+    global _storage
+    _storage = storage
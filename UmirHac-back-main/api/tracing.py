@@ -0,0 +1,120 @@
+"""
+Трассировка запросов (OpenTelemetry).
+Включается переменной TRACING:
+- off (по умолчанию) — спаны не создаются
+- console — печать спанов в stdout
+- file — JSON по строке на спан в TRACE_FILE (по умолчанию traces.jsonl)
+- otlp — отправка в коллектор (OTEL_EXPORTER_OTLP_ENDPOINT, нужен opentelemetry-exporter-otlp)
+Без установленного opentelemetry-sdk трассировка тоже выключена.
+Контекст передаётся сервису изображений заголовком traceparent (W3C).
+"""
+import atexit
+import logging
+import os
+import threading
+from contextlib import contextmanager
+from typing import Dict, Optional
+
+from fastapi import Request
+
+try:
+    from opentelemetry import propagate, trace
+    from opentelemetry.sdk.resources import Resource
+    from opentelemetry.sdk.trace import TracerProvider
+    from opentelemetry.sdk.trace.export import (
+        BatchSpanProcessor, ConsoleSpanExporter, SpanExporter, SpanExportResult
+    )
+    OTEL_AVAILABLE = True
+except ImportError:
+    OTEL_AVAILABLE = False
+
+logger = logging.getLogger("api.tracing")
+
+_tracer = None
+
+
+if OTEL_AVAILABLE:
+    class FileSpanExporter(SpanExporter):
+        """Пишет спаны в файл, по одному JSON на строку"""
+
+        def __init__(self, path: str):
+            self.path = path
+            self._lock = threading.Lock()
+
+        def export(self, spans):
+            with self._lock, open(self.path, "a", encoding="utf-8") as f:
+                for s in spans:
+                    f.write(s.to_json(indent=None) + "\n")
+            return SpanExportResult.SUCCESS
+
+        def shutdown(self):
+            pass
+
+
+def setup_tracing(service_name: str = "umir-api"):
+    """Настраивает провайдер спанов процесса по TRACING (один раз)"""
+    global _tracer
+    mode = os.getenv("TRACING", "off").lower()
+    if _tracer is not None or mode == "off":
+        return
+    if not OTEL_AVAILABLE:
+        logger.warning("TRACING=%s, but opentelemetry-sdk is not installed; tracing disabled", mode)
+        return
+
+    if mode == "console":
+        exporter = ConsoleSpanExporter()
+    elif mode == "file":
+        exporter = FileSpanExporter(os.getenv("TRACE_FILE", "traces.jsonl"))
+    elif mode == "otlp":
+        try:
+            from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+        except ImportError:
+            logger.warning("TRACING=otlp needs opentelemetry-exporter-otlp; tracing disabled")
+            return
+        exporter = OTLPSpanExporter()
+    else:
+        raise ValueError(f"Unknown TRACING: {mode}")
+
+    provider = TracerProvider(resource=Resource.create({"service.name": service_name}))
+    provider.add_span_processor(BatchSpanProcessor(exporter))
+    trace.set_tracer_provider(provider)
+    atexit.register(provider.shutdown)
+    _tracer = trace.get_tracer("api")
+
+
+@contextmanager
+def span(name: str, **attributes):
+    """Спан вокруг этапа; при выключенной трассировке ничего не делает"""
+    if _tracer is None:
+        yield None
+        return
+    attrs = {k: v for k, v in attributes.items() if v is not None}
+    with _tracer.start_as_current_span(name, attributes=attrs) as current:
+        yield current
+
+
+def inject_headers(headers: Optional[Dict[str, str]] = None) -> Dict[str, str]:
+    """Заголовки с контекстом текущего спана для исходящего HTTP-запроса"""
+    headers = dict(headers or {})
+    if _tracer is not None:
+        propagate.inject(headers)
+    return headers
+
+
+async def tracing_middleware(request: Request, call_next):
+    """Корневой спан HTTP-запроса (с родителем из traceparent, если он пришёл)"""
+    if _tracer is None:
+        return await call_next(request)
+
+    parent = propagate.extract(dict(request.headers))
+    with _tracer.start_as_current_span(
+        f"{request.method} {request.url.path}", context=parent, kind=trace.SpanKind.SERVER,
+        attributes={"http.request.method": request.method, "url.path": request.url.path},
+    ) as current:
+        response = await call_next(request)
+        route = request.scope.get("route")
+        if route is not None:
+            current.update_name(f"{request.method} {route.path}")
+            current.set_attribute("http.route", route.path)
+        current.set_attribute("http.response.status_code", response.status_code)
+        return response
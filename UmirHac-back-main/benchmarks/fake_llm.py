@@ -0,0 +1,77 @@
+"""
+Локальная замена OpenRouter для бенчмарков: OpenAI-совместимый /chat/completions,
+который отвечает валидным ScriptPlan / FinalScript (api/scripts/script_generator.py)
+с настраиваемой задержкой.
+
+    FAKE_LLM_LATENCY=0.2 FAKE_LLM_BLOCKS=12 uvicorn benchmarks.fake_llm:app --port 8401
+"""
+import asyncio
+import json
+import os
+import time
+import uuid
+
+from fastapi import FastAPI, Request
+
+app = FastAPI(title="Fake LLM")
+
+LATENCY = float(os.getenv("FAKE_LLM_LATENCY", "0.2"))
+BLOCKS = min(15, max(8, int(os.getenv("FAKE_LLM_BLOCKS", "12"))))
+
+# Повторяющийся «сценарий»: на каждый action-блок потом генерируется картинка
+_SEQUENCE = ["scene_heading", "action", "character", "dialogue", "action", "transition"]
+
+_CONTENT = {
+    "scene_heading": {"location_type": "INT", "location": "Кухня", "time": "MORNING"},
+    "action": {"description": "Герой открывает упаковку продукта и улыбается"},
+    "character": {"name": "АННА", "parenthetical": None},
+    "dialogue": {"text": "Это именно то, что мне было нужно!"},
+    "transition": {"transition_type": "CUT TO"},
+}
+
+
+def _block_sequence():
+    return [_SEQUENCE[i % len(_SEQUENCE)] for i in range(BLOCKS)]
+
+
+def _answer(schema_name: str) -> dict:
+    if schema_name == "ScriptPlan":
+        return {
+            "total_blocks": BLOCKS,
+            "block_sequence": _block_sequence(),
+            "story_summary": "Короткая история о продукте для бенчмарка",
+        }
+    blocks = []
+    for i, block_type in enumerate(_block_sequence()):
+        content = dict(_CONTENT[block_type])
+        if block_type == "action":
+            content["description"] = f"{content['description']} (кадр {i + 1})"
+        blocks.append({"block_type": block_type, "content": content})
+    return {"blocks": blocks}
+
+
+@app.post("/chat/completions")
+async def chat_completions(request: Request):
+    body = await request.json()
+    schema_name = (body.get("response_format") or {}).get("json_schema", {}).get("name", "")
+    await asyncio.sleep(LATENCY)
+
+    content = json.dumps(_answer(schema_name), ensure_ascii=False)
+    prompt_tokens = sum(len(m.get("content") or "") for m in body.get("messages", [])) // 4
+    completion_tokens = len(content) // 4
+    return {
+        "id": f"chatcmpl-{uuid.uuid4().hex}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": body.get("model", "fake"),
+        "choices": [{
+            "index": 0,
+            "message": {"role": "assistant", "content": content, "refusal": None},
+            "finish_reason": "stop",
+        }],
+        "usage": {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+        },
+    }
@@ -0,0 +1,350 @@
+"""
+Нагрузочный бенчмарк API.
+
+Поднимает API (uvicorn) на временной SQLite-базе вместе с локальной заменой LLM
+(benchmarks/fake_llm.py) и сервисом изображений в процессе (IMAGE_BACKEND=fake),
+прогоняет сценарии на нескольких уровнях конкурентности и размерах данных
+и пишет результаты в JSON. С --baseline сравнивает с прошлым прогоном.
+
+    python -m benchmarks.run_benchmarks --concurrency 1,8,32 --datasets 10,100 \\
+        --out bench_results.json --baseline bench_baseline.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Awaitable, Callable, Dict, List, Optional
+
+import httpx
+
+BACKEND_DIR = Path(__file__).resolve().parents[1]
+
+# Сценарии, для которых лучше меньше (латентность) и больше (пропускная способность)
+SCENARIOS = ["login", "folders", "projects", "scenario_edit", "generate_flow"]
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _percentile(sorted_values: List[float], q: float) -> float:
+    if not sorted_values:
+        return 0.0
+    k = max(0, min(len(sorted_values) - 1, int(round(q / 100 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[k]
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "HEAD"], cwd=BACKEND_DIR, stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Services:
+    """Процессы fake LLM и API во временной рабочей директории"""
+
+    def __init__(self, workdir: Path, args):
+        self.workdir = workdir
+        self.args = args
+        self.llm_port = _free_port()
+        self.api_port = _free_port()
+        self.procs: List[subprocess.Popen] = []
+
+    @property
+    def api_url(self) -> str:
+        return f"http://127.0.0.1:{self.api_port}"
+
+    def _spawn(self, app: str, port: int, env: Dict[str, str], workers: int = 1):
+        log_file = open(self.workdir / f"{app.split(':')[0].replace('.', '_')}.log", "w")
+        proc = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", app, "--app-dir", str(BACKEND_DIR),
+             "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning",
+             "--workers", str(workers)],
+            cwd=self.workdir, env={**os.environ, **env}, stdout=log_file, stderr=subprocess.STDOUT,
+        )
+        self.procs.append(proc)
+
+    def start(self):
+        self._spawn("benchmarks.fake_llm:app", self.llm_port, {
+            "FAKE_LLM_LATENCY": str(self.args.fake_llm_latency),
+        })
+        self._spawn("api.app:app", self.api_port, {
+            "DATABASE_URL": f"sqlite:///{self.workdir / 'bench.sqlite'}",
+            "OPENROUTER_BASE_URL": f"http://127.0.0.1:{self.llm_port}",
+            "OPENROUTER_API_KEY": "benchmark",
+            "IMAGE_BACKEND": "fake",
+            "FAKE_IMAGE_LATENCY": str(self.args.fake_image_latency),
+            "FAKE_IMAGE_CONCURRENCY": "1",
+            "TRANSLATOR": "none",
+            # несколько процессов API — задачи через общую очередь в БД
+            "JOB_QUEUE": "db" if self.args.api_workers > 1 else "memory",
+        }, workers=self.args.api_workers)
+        deadline = time.monotonic() + 60
+        while time.monotonic() < deadline:
+            try:
+                if httpx.get(f"{self.api_url}/openapi.json", timeout=1.0).status_code == 200:
+                    return
+            except httpx.HTTPError:
+                pass
+            time.sleep(0.3)
+        raise RuntimeError(f"API did not start, see logs in {self.workdir}")
+
+    def stop(self):
+        for proc in self.procs:
+            proc.terminate()
+        for proc in self.procs:
+            try:
+                proc.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+
+
+class Bench:
+    def __init__(self, client: httpx.AsyncClient, args):
+        self.client = client
+        self.args = args
+        self.headers: Dict[str, str] = {}
+        self.login = ""
+        self.project_ids: List[int] = []
+        self.edit_targets: Dict[int, int] = {}  # project_id -> index не-action блока
+
+    # ---------- данные ----------
+    async def setup_user(self, dataset: int):
+        self.login = f"bench_{dataset}_{int(time.time() * 1000)}"
+        r = await self.client.post("/auth/register", json={"login": self.login, "password": "bench"})
+        r.raise_for_status()
+        self.headers = {"Authorization": f"Bearer {r.json()['access_token']}"}
+
+        r = await self.client.post("/folders/", json={"name": "bench"}, headers=self.headers)
+        r.raise_for_status()
+        folder_id = r.json()["id"]
+
+        sem = asyncio.Semaphore(8)
+
+        async def create(i: int):
+            async with sem:
+                r = await self.client.post("/script-generator/generate", headers=self.headers, json={
+                    "product_description": f"Продукт №{i} для бенчмарка",
+                    "project_name": f"bench {i}",
+                    "folder_id": folder_id,
+                })
+                r.raise_for_status()
+                pid = r.json()["project_id"]
+                await self.wait_scenario(pid)
+                return pid
+
+        self.project_ids = list(await asyncio.gather(*(create(i) for i in range(dataset))))
+
+        for pid in self.project_ids:
+            r = await self.client.get(f"/script-generator/scenario/{pid}", headers=self.headers)
+            r.raise_for_status()
+            for block in r.json()["blocks"]:
+                if block["type"] == "dialogue":
+                    self.edit_targets[pid] = block["index"]
+                    break
+
+    async def wait_scenario(self, pid: int) -> dict:
+        while True:
+            r = await self.client.get(f"/script-generator/status/{pid}", headers=self.headers)
+            r.raise_for_status()
+            data = r.json()
+            if data["status"] != "in_progress":
+                return data
+            await asyncio.sleep(0.05)
+
+    async def wait_images(self, pid: int, count: int):
+        while True:
+            r = await self.client.get(f"/script-generator/status/{pid}", headers=self.headers)
+            r.raise_for_status()
+            statuses = r.json().get("image_generation_status") or []
+            done = [s for s in statuses if s["status"] != "in_progress"]
+            if len(statuses) >= count and len(done) == len(statuses):
+                return
+            await asyncio.sleep(0.05)
+
+    # ---------- сценарии ----------
+    async def op_login(self, i: int):
+        r = await self.client.post("/auth/login", json={"login": self.login, "password": "bench"})
+        r.raise_for_status()
+
+    async def op_folders(self, i: int):
+        r = await self.client.get("/folders/", headers=self.headers)
+        r.raise_for_status()
+
+    async def op_projects(self, i: int):
+        r = await self.client.get("/script-generator/projects", headers=self.headers)
+        r.raise_for_status()
+
+    async def op_scenario_edit(self, i: int):
+        pids = [pid for pid in self.project_ids if pid in self.edit_targets]
+        pid = pids[i % len(pids)]
+        r = await self.client.patch(
+            f"/script-generator/scenario/{pid}/blocks/{self.edit_targets[pid]}",
+            headers=self.headers,
+            json={"content": {"text": f"Правка №{i}"}},
+        )
+        r.raise_for_status()
+
+    async def op_generate_flow(self, i: int):
+        r = await self.client.post("/script-generator/generate", headers=self.headers, json={
+            "product_description": f"Полный цикл №{i}",
+        })
+        r.raise_for_status()
+        pid = r.json()["project_id"]
+        status = await self.wait_scenario(pid)
+        if status["status"] != "completed":
+            raise RuntimeError(f"scenario generation failed for project {pid}")
+
+        r = await self.client.post(f"/script-generator/generate_images/{pid}", headers=self.headers, json={})
+        r.raise_for_status()
+        await self.wait_images(pid, len(r.json()["block_indices"]))
+
+
+async def _measure(op: Callable[[int], Awaitable[None]], total: int, concurrency: int) -> dict:
+    latencies: List[float] = []
+    errors = 0
+    counter = iter(range(total))
+
+    async def worker():
+        nonlocal errors
+        for i in counter:
+            t0 = time.perf_counter()
+            try:
+                await op(i)
+                latencies.append((time.perf_counter() - t0) * 1000)
+            except Exception:
+                errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        "requests": total,
+        "errors": errors,
+        "duration_s": round(elapsed, 3),
+        "throughput_rps": round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+        "mean_ms": round(sum(latencies) / len(latencies), 2) if latencies else 0.0,
+        "p50_ms": round(_percentile(latencies, 50), 2),
+        "p95_ms": round(_percentile(latencies, 95), 2),
+        "p99_ms": round(_percentile(latencies, 99), 2),
+        "max_ms": round(latencies[-1], 2) if latencies else 0.0,
+    }
+
+
+async def run(args, api_url: str) -> List[dict]:
+    results = []
+    limits = httpx.Limits(max_connections=max(args.concurrency) * 2)
+    async with httpx.AsyncClient(base_url=api_url, timeout=120.0, limits=limits) as client:
+        for dataset in args.datasets:
+            bench = Bench(client, args)
+            print(f"== dataset: {dataset} projects")
+            await bench.setup_user(dataset)
+
+            for scenario in args.scenarios:
+                op = getattr(bench, f"op_{scenario}")
+                for concurrency in args.concurrency:
+                    total = args.flow_runs if scenario == "generate_flow" else args.requests
+                    total = max(total, concurrency)
+                    stats = await _measure(op, total, concurrency)
+                    row = {"scenario": scenario, "dataset_projects": dataset, "concurrency": concurrency, **stats}
+                    results.append(row)
+                    print(f"{scenario:>14} c={concurrency:<4} rps={stats['throughput_rps']:<9} "
+                          f"p50={stats['p50_ms']:<9} p95={stats['p95_ms']:<9} p99={stats['p99_ms']:<9} "
+                          f"errors={stats['errors']}")
+    return results
+
+
+def compare(results: List[dict], baseline_path: str, tolerance: float) -> List[str]:
+    """Регрессии относительно baseline: рост p95 или падение throughput больше tolerance"""
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = json.load(f)
+    key = lambda r: (r["scenario"], r["dataset_projects"], r["concurrency"])
+    old = {key(r): r for r in baseline.get("results", [])}
+
+    regressions = []
+    for row in results:
+        prev = old.get(key(row))
+        if not prev:
+            continue
+        name = f"{row['scenario']} dataset={row['dataset_projects']} c={row['concurrency']}"
+        if prev["p95_ms"] and row["p95_ms"] > prev["p95_ms"] * (1 + tolerance):
+            regressions.append(f"{name}: p95 {prev['p95_ms']}ms -> {row['p95_ms']}ms")
+        if prev["throughput_rps"] and row["throughput_rps"] < prev["throughput_rps"] * (1 - tolerance):
+            regressions.append(f"{name}: throughput {prev['throughput_rps']} -> {row['throughput_rps']} rps")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="API load benchmark")
+    parser.add_argument("--concurrency", default="1,8,32", help="уровни конкурентности через запятую")
+    parser.add_argument("--datasets", default="10,100", help="число проектов пользователя через запятую")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS))
+    parser.add_argument("--requests", type=int, default=200, help="запросов на сценарий и уровень")
+    parser.add_argument("--flow-runs", type=int, default=8, help="прогонов generate_flow на уровень")
+    parser.add_argument("--fake-llm-latency", type=float, default=0.2)
+    parser.add_argument("--fake-image-latency", type=float, default=0.2)
+    parser.add_argument("--api-workers", type=int, default=1, help="процессов API (>1 — JOB_QUEUE=db)")
+    parser.add_argument("--out", default="bench_results.json")
+    parser.add_argument("--baseline", default=None, help="прошлый результат для сравнения")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="допустимое ухудшение (доля)")
+    parser.add_argument("--keep-workdir", action="store_true")
+    args = parser.parse_args()
+    args.concurrency = [int(c) for c in args.concurrency.split(",") if c.strip()]
+    args.datasets = [int(d) for d in args.datasets.split(",") if d.strip()]
+    args.scenarios = [s.strip() for s in args.scenarios.split(",") if s.strip()]
+    unknown = set(args.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {sorted(unknown)}")
+
+    workdir = Path(tempfile.mkdtemp(prefix="umir_bench_"))
+    services = Services(workdir, args)
+    try:
+        services.start()
+        results = asyncio.run(run(args, services.api_url))
+    finally:
+        services.stop()
+        if not args.keep_workdir:
+            import shutil
+            shutil.rmtree(workdir, ignore_errors=True)
+        else:
+            print(f"workdir kept: {workdir}")
+
+    report = {
+        "meta": {
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "git_commit": _git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "args": {k: v for k, v in vars(args).items() if k not in ("out", "baseline")},
+        },
+        "results": results,
+    }
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    print(f"results saved to {args.out}")
+
+    if args.baseline:
+        regressions = compare(results, args.baseline, args.tolerance)
+        for line in regressions:
+            print(f"REGRESSION {line}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
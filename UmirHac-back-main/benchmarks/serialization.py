@@ -0,0 +1,93 @@
+"""
+Микробенчмарк сериализации ответов списка проектов (без HTTP и БД).
+
+Сравнивает прежний путь ответов-dict — jsonable_encoder + json.dumps (так FastAPI
+отдаёт dict без response_model) — с ORJSONResponse (api/responses.py).
+
+    python -m benchmarks.serialization --projects 100,1000 --blocks 12
+"""
+import argparse
+import json
+import os
+import time
+from datetime import datetime, timezone
+from typing import Callable, Dict, List
+
+# Модели ответов живут в роутерах: для импорта нужны БД и ключ LLM, хоть они и не используются
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+os.environ.setdefault("OPENROUTER_API_KEY", "benchmark")
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+
+from api.responses import ORJSONResponse, orjson
+from api.routers.script_generator import ImageDescriptionData, ImageGenerationStatus, ImagePathData
+
+NOW = datetime(2025, 1, 1, 12, 30, 15, 123456, tzinfo=timezone.utc)
+
+
+def _entries(blocks: int) -> Dict[str, List[dict]]:
+    key = "blobs/ab/" + "ab" * 32 + ".png"
+    return {
+        "status": [{"index": i, "status": "completed", "stage": "final", "job_id": "f" * 32} for i in range(1, blocks + 1)],
+        "paths": [{"index": i, "image_path": key, "preview_path": None, "image_url": "/files/" + key + "?expires=1&sig=" + "0" * 64,
+                   "preview_url": None} for i in range(1, blocks + 1)],
+        "descriptions": [{"index": i, "image_description": "Действие: " + "описание " * 12, "seed": 777}
+                         for i in range(1, blocks + 1)],
+    }
+
+
+def _projects(count: int, blocks: int) -> List[dict]:
+    entries = _entries(blocks)
+    return [{
+        "id": i,
+        "name": f"project {i}",
+        "folder_id": None,
+        "status": "completed",
+        "created_at": NOW,
+        "updated_at": NOW,
+        "has_scenario": True,
+        "has_images": True,
+        "images_count": blocks,
+        "result_path": f"1/{i}/1_{i}_scenario.json",
+        "image_path": None,
+        "product_description": "Описание продукта " * 20,
+        "image_generation_status": [ImageGenerationStatus(**e) for e in entries["status"]],
+        "image_paths": [ImagePathData(**e) for e in entries["paths"]],
+        "image_descriptions": [ImageDescriptionData(**e) for e in entries["descriptions"]],
+    } for i in range(count)]
+
+
+def _timeit(fn: Callable[[], object], repeat: int) -> float:
+    """Лучшее время одного вызова в мс"""
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t0)
+    return round(best * 1000, 2)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Response serialization micro-benchmark")
+    parser.add_argument("--projects", default="100,1000", help="размеры списка проектов через запятую")
+    parser.add_argument("--blocks", type=int, default=12, help="блоков с картинками в проекте")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    if orjson is None:
+        print("orjson is not installed: ORJSONResponse falls back to the standard encoder")
+
+    for count in [int(x) for x in args.projects.split(",")]:
+        payload = {"user_id": 1, "projects": _projects(count, args.blocks)}
+        before = lambda: JSONResponse(jsonable_encoder(payload)).body
+        after = lambda: ORJSONResponse(payload).body
+
+        assert json.loads(before()) == json.loads(after())
+        row = {"projects": count, "before_ms": _timeit(before, args.repeat), "after_ms": _timeit(after, args.repeat)}
+        row["speedup"] = round(row["before_ms"] / row["after_ms"], 1)
+        print(json.dumps(row))
+
+
+if __name__ == "__main__":
+    main()
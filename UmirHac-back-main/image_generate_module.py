@@ -1,9 +1,30 @@
-import os, io, gc, base64, asyncio, time
+import os, io, gc, base64, asyncio, time, hashlib, secrets, json, resource, argparse, statistics
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from contextvars import ContextVar
 from time import localtime, strftime
-from typing import Optional
+from typing import List, Optional, Set, Tuple
+from contextlib import asynccontextmanager, contextmanager
 
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request, Response
 from pydantic import BaseModel
+from prometheus_client import CONTENT_TYPE_LATEST, Gauge, Histogram, generate_latest
+
+# Трассировка — из пакета API (api/tracing.py); сервис, развёрнутый без него, работает без спанов
+try:
+    from api.tracing import setup_tracing, span, tracing_middleware
+except ImportError:
+    def setup_tracing(service_name: str = ""):
+        if os.getenv("TRACING", "off").lower() != "off":
+            log("TRACING is set, but api.tracing is not available; tracing disabled", "red")
+
+    @contextmanager
+    def span(name: str, **attributes):
+        yield None
+
+    async def tracing_middleware(request: Request, call_next):
+        return await call_next(request)
 from PIL import Image, ImageFilter
 import torch
 
@@ -33,17 +54,144 @@ def log(text: str, color: str = "yellow", fmt: str = "[bold {color}]{time}[/] =>
 # ---------- schemas ----------
 class TxtReq(BaseModel):
     prompt: str
+    preview: bool = False  # быстрый черновик: низкое разрешение, 1 шаг
+    job_id: Optional[str] = None  # для отмены через /cancel/{job_id}
+    seed: Optional[int] = None  # None — случайный; фактический seed возвращается в ответе
+
+class TxtBatchReq(BaseModel):
+    prompts: List[str]
+    job_id: Optional[str] = None
+    seed: Optional[int] = None  # общий seed раскадровки → единый визуальный стиль блоков
 
 class EditReq(BaseModel):
     prompt: str
     image_base64: str  # PNG/JPEG в base64
+    job_id: Optional[str] = None
+    seed: Optional[int] = None  # None — SEED из окружения
+    cache_latents: bool = True  # кэшировать VAE-латенты входной картинки
 
 # ---------- globals ----------
 _pipe_schnell: Optional[FluxPipeline] = None
 _pipe_kontext: Optional[FluxKontextPipeline] = None
 
-# один общий семафор → максимум 1 инференс на GPU одновременно
-_gpu_lock = asyncio.Semaphore(1)
+class _PriorityGpuLock:
+    """
+    Максимум 1 инференс на GPU одновременно.
+    Ожидающие превью пропускаются вперёд полноразмерных задач из очереди,
+    чтобы черновик появлялся за секунду-две даже под нагрузкой.
+    """
+    def __init__(self):
+        self._lock = asyncio.Lock()
+        self._priority_waiting = 0
+        self.waiting = 0  # задач в очереди к GPU (для метрик)
+
+    async def acquire(self, priority: bool = False):
+        """Ждёт своей очереди к GPU; парный вызов — release() (см. _gpu_slot)"""
+        self.waiting += 1
+        try:
+            await self._wait(priority)
+        finally:
+            self.waiting -= 1
+
+    def release(self):
+        self._lock.release()
+
+    async def _wait(self, priority: bool):
+        if priority:
+            self._priority_waiting += 1
+            try:
+                await self._lock.acquire()
+            finally:
+                self._priority_waiting -= 1
+        else:
+            while True:
+                await self._lock.acquire()
+                if self._priority_waiting == 0:
+                    break
+                # уступаем очередь превью
+                self._lock.release()
+                await asyncio.sleep(0)
+
+_gpu_lock = _PriorityGpuLock()
+
+# ---------- metrics ----------
+HTTP_REQUEST_DURATION = Histogram(
+    "image_service_http_request_duration_seconds", "Длительность запросов к сервису",
+    ["method", "route", "status"],
+)
+GPU_QUEUE_WAIT = Histogram(
+    "image_service_gpu_queue_wait_seconds", "Ожидание GPU перед инференсом", ["pipeline"],
+    buckets=(0.01, 0.05, 0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300),
+)
+GPU_INFERENCE = Histogram(
+    "image_service_gpu_inference_seconds", "Время инференса на GPU", ["pipeline", "outcome"],
+    buckets=(0.1, 0.25, 0.5, 1, 2, 4, 8, 15, 30, 60, 120),
+)
+GPU_QUEUE_DEPTH = Gauge("image_service_gpu_queue_depth", "Задач в очереди к GPU")
+GPU_QUEUE_DEPTH.set_function(lambda: _gpu_lock.waiting)
+
+@asynccontextmanager
+async def _gpu_slot(pipeline: str, priority: bool = False):
+    """Захват GPU с замером ожидания и времени инференса (pipeline: schnell_preview/schnell/schnell_batch/kontext)"""
+    t0 = time.perf_counter()
+    with span("gpu.wait", pipeline=pipeline, queue_depth=_gpu_lock.waiting):
+        await _gpu_lock.acquire(priority)
+    try:
+        GPU_QUEUE_WAIT.labels(pipeline).observe(time.perf_counter() - t0)
+        t1 = time.perf_counter()
+        outcome = "error"
+        try:
+            with span("gpu.inference", pipeline=pipeline):
+                yield
+            outcome = "ok"
+        except JobCancelled:
+            outcome = "cancelled"
+            raise
+        finally:
+            GPU_INFERENCE.labels(pipeline, outcome).observe(time.perf_counter() - t1)
+    finally:
+        _gpu_lock.release()
+
+def _encode_png(img: Image.Image) -> str:
+    """PNG -> base64 для ответа"""
+    with span("png.encode", width=img.width, height=img.height):
+        buf = io.BytesIO(); img.save(buf, "PNG")
+        return base64.b64encode(buf.getvalue()).decode("utf-8")
+
+@app.middleware("http")
+async def metrics_middleware(request: Request, call_next):
+    t0 = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        route = request.scope.get("route")
+        HTTP_REQUEST_DURATION.labels(
+            request.method, route.path if route else "unmatched", str(status)
+        ).observe(time.perf_counter() - t0)
+
+# Добавлен после metrics_middleware — внутренний слой, родитель берётся из traceparent API
+setup_tracing("umir-image-service")
+app.middleware("http")(tracing_middleware)
+
+@app.get("/metrics")
+def metrics():
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+# отменённые job_id (ограниченный размер: отмены для уже завершённых задач не копятся)
+_cancelled_jobs: "OrderedDict[str, float]" = OrderedDict()
+_CANCELLED_MAX = 1024
+
+class JobCancelled(Exception):
+    pass
+
+# LRU-кэш VAE-латентов входных картинок kontext: повторные правки того же
+# изображения блока не кодируют его заново. Ключ — хэш картинки + размер прогона.
+_latent_cache: "OrderedDict[str, torch.Tensor]" = OrderedDict()
+_latent_key: ContextVar[Optional[str]] = ContextVar("latent_key", default=None)
+_latent_hit: ContextVar[bool] = ContextVar("latent_hit", default=False)
 
 # ---------- helpers ----------
 def _dtype_for_device() -> torch.dtype:
@@ -65,6 +213,55 @@ def _enable_memory_savers(pipe):
     except Exception as e:
         log(f"memory opts skipped: {e}", "red")
 
+def _is_cancelled(job_id: Optional[str]) -> bool:
+    return job_id is not None and job_id in _cancelled_jobs
+
+def _check_cancelled(job_id: Optional[str]):
+    if _is_cancelled(job_id):
+        raise JobCancelled(job_id)
+
+def _interrupt_on_cancel(job_id: Optional[str]):
+    """
+    callback_on_step_end для пайплайнов diffusers: при отмене задачи
+    выставляет pipe._interrupt, и оставшиеся шаги денойзинга пропускаются.
+    """
+    def _callback(pipe, step, timestep, callback_kwargs):
+        if _is_cancelled(job_id):
+            pipe._interrupt = True
+        return callback_kwargs
+    return _callback
+
+def _resolve_seed(seed: Optional[int]) -> int:
+    return seed if seed is not None else secrets.randbelow(2**31)
+
+def _install_latent_cache(pipe):
+    """
+    Оборачивает pipe._encode_vae_image кэшем по _latent_key.
+    Кодирование в FLUX идёт в режиме argmax, поэтому результат детерминирован
+    и его можно переиспользовать без изменения картинки на выходе.
+    """
+    encode = pipe._encode_vae_image
+    max_size = int(os.getenv("LATENT_CACHE_SIZE", "32"))
+
+    def _cached_encode(image, generator):
+        key = _latent_key.get()
+        if key is None or max_size <= 0:
+            return encode(image=image, generator=generator)
+
+        cached = _latent_cache.get(key)
+        if cached is not None:
+            _latent_cache.move_to_end(key)
+            _latent_hit.set(True)
+            return cached.to(image.device)
+
+        latents = encode(image=image, generator=generator)
+        _latent_cache[key] = latents.detach().to("cpu")  # VRAM не тратим
+        while len(_latent_cache) > max_size:
+            _latent_cache.popitem(last=False)
+        return latents
+
+    pipe._encode_vae_image = _cached_encode
+
 def _round8(x: int) -> int:
     return max(8, int(round(x / 8)) * 8)
 
@@ -76,62 +273,168 @@ def _post_sharpen(img: Image.Image) -> Image.Image:
     thresh = int(os.getenv("SHARP_THRESHOLD", "3"))
     return img.filter(ImageFilter.UnsharpMask(radius=radius, percent=amount, threshold=thresh))
 
-# ---------- startup ----------
-@app.on_event("startup")
-def load_models():
-    global _pipe_schnell, _pipe_kontext
-    if _pipe_schnell and _pipe_kontext:
-        return
-
+# ---------- performance mode ----------
+# PERF_MODE — список через запятую: compile, channels_last, int8, int4 (пусто — как раньше, без оптимизаций).
+# Всё недоступное на текущем железе пропускается с логом, на CPU остаётся обычный fp32.
+_PERF_OPTIONS = {"compile", "channels_last", "int8", "int4"}
+
+def _parse_perf_mode(raw: str) -> Set[str]:
+    opts = {o.strip().lower() for o in raw.replace("+", ",").split(",") if o.strip()}
+    opts.discard("off")
+    unknown = opts - _PERF_OPTIONS
+    if unknown:
+        log(f"unknown PERF_MODE options ignored: {sorted(unknown)}", "red")
+    return opts & _PERF_OPTIONS
+
+def _apply_perf_mode(pipe, name: str, opts: Set[str]) -> Set[str]:
+    """Применяет оптимизации к пайплайну, возвращает реально применённые"""
+    applied: Set[str] = set()
     use_cuda = torch.cuda.is_available()
-    dtype = _dtype_for_device()
 
-    id_schnell = os.getenv("MODEL_SCHNELL", "black-forest-labs/FLUX.1-schnell")
-    id_kontext = os.getenv("MODEL_KONTEXT", "black-forest-labs/FLUX.1-Kontext-dev")
+    # весовая квантизация трансформера (torchao); int4 — только на GPU
+    quant = "int4" if "int4" in opts else ("int8" if "int8" in opts else None)
+    if quant == "int4" and not use_cuda:
+        log(f"{name}: int4 needs CUDA, quantization skipped", "red")
+        quant = None
+    if quant:
+        try:
+            from torchao.quantization import quantize_, int4_weight_only, int8_weight_only
+            quantize_(pipe.transformer, int4_weight_only() if quant == "int4" else int8_weight_only())
+            applied.add(quant)
+        except Exception as e:
+            log(f"{name}: {quant} quantization skipped: {e}", "red")
 
-    # Бюджеты VRAM/RAM (для device_map='balanced')
-    # Для V100 32GB типично 17/13 ГиБ с запасом под буферы.
-    s_cuda = os.getenv("SCHNELL_CUDA_GB", "17GiB")
-    k_cuda = os.getenv("KONTEXT_CUDA_GB", "13GiB")
+    if "channels_last" in opts:
+        try:
+            pipe.vae.to(memory_format=torch.channels_last)
+            applied.add("channels_last")
+        except Exception as e:
+            log(f"{name}: channels_last skipped: {e}", "red")
+
+    if "compile" in opts:
+        try:
+            pipe.transformer = torch.compile(
+                pipe.transformer, mode=os.getenv("COMPILE_MODE", "max-autotune-no-cudagraphs")
+            )
+            applied.add("compile")
+        except Exception as e:
+            log(f"{name}: torch.compile skipped: {e}", "red")
+
+    log(f"{name}: perf mode {sorted(applied) if applied else 'off'}")
+    return applied
+
+def _warmup_sizes() -> List[Tuple[int, int]]:
+    """WARMUP_SIZES="512x512,256x256" — по умолчанию рабочий размер и размер превью"""
+    h = os.getenv("HEIGHT", "512"); w = os.getenv("WIDTH", "512")
+    p = os.getenv("PREVIEW_SIZE", "256")
+    raw = os.getenv("WARMUP_SIZES", f"{h}x{w},{p}x{p}")
+    sizes = []
+    for item in raw.split(","):
+        try:
+            hh, ww = item.lower().split("x")
+            sizes.append((int(hh), int(ww)))
+        except ValueError:
+            log(f"bad WARMUP_SIZES item skipped: {item}", "red")
+    return list(dict.fromkeys(sizes))
+
+# ---------- loading ----------
+def _placement_kwargs(cuda_budget: str, offload_subdir: str) -> dict:
+    """device_map='balanced' с бюджетами VRAM/RAM на GPU; на CPU — обычная загрузка"""
+    if not torch.cuda.is_available():
+        return {}
     cpu_mem = os.getenv("CPU_MAX_GB", "10GiB")
     offload = os.getenv("OFFLOAD_DIR", "/tmp/umirhack_offload")
     os.makedirs(offload, exist_ok=True)
+    return dict(
+        device_map="balanced",  # у FLUX поддержаны 'balanced' и 'cuda'
+        max_memory={0: cuda_budget, "cpu": cpu_mem},
+        offload_folder=os.path.join(offload, offload_subdir),
+    )
 
-    # ---- SCHNELL ----
-    log(f"Loading {id_schnell} (dtype={dtype}, device_map=balanced VRAM={s_cuda})")
-    _pipe_schnell = FluxPipeline.from_pretrained(
-        id_schnell,
+def _load_schnell() -> FluxPipeline:
+    dtype = _dtype_for_device()
+    model_id = os.getenv("MODEL_SCHNELL", "black-forest-labs/FLUX.1-schnell")
+    # Для V100 32GB типично 17/13 ГиБ с запасом под буферы.
+    budget = os.getenv("SCHNELL_CUDA_GB", "17GiB")
+    log(f"Loading {model_id} (dtype={dtype}, VRAM={budget if torch.cuda.is_available() else 'cpu'})")
+    pipe = FluxPipeline.from_pretrained(
+        model_id,
         torch_dtype=dtype,
         use_safetensors=True,
         low_cpu_mem_usage=True,
-        device_map="balanced",  # у FLUX поддержаны 'balanced' и 'cuda'
-        max_memory={0: s_cuda, "cpu": cpu_mem},
-        offload_folder=os.path.join(offload, "schnell"),
+        **_placement_kwargs(budget, "schnell"),
     )
-    _enable_memory_savers(_pipe_schnell)
+    _enable_memory_savers(pipe)
+    return pipe
 
-    # ---- KONTEXT ----
-    log(f"Loading {id_kontext} (dtype={dtype}, device_map=balanced VRAM={k_cuda})")
-    _pipe_kontext = FluxKontextPipeline.from_pretrained(
-        id_kontext,
+def _load_kontext() -> FluxKontextPipeline:
+    dtype = _dtype_for_device()
+    model_id = os.getenv("MODEL_KONTEXT", "black-forest-labs/FLUX.1-Kontext-dev")
+    budget = os.getenv("KONTEXT_CUDA_GB", "13GiB")
+    log(f"Loading {model_id} (dtype={dtype}, VRAM={budget if torch.cuda.is_available() else 'cpu'})")
+    pipe = FluxKontextPipeline.from_pretrained(
+        model_id,
         torch_dtype=dtype,  # на V100 — fp16
         use_safetensors=True,
         low_cpu_mem_usage=True,
-        device_map="balanced",
-        max_memory={0: k_cuda, "cpu": cpu_mem},
-        offload_folder=os.path.join(offload, "kontext"),
+        **_placement_kwargs(budget, "kontext"),
     )
-    _enable_memory_savers(_pipe_kontext)
+    _enable_memory_savers(pipe)
+    _install_latent_cache(pipe)
+    return pipe
+
+def _warmup(schnell_compiled: bool, kontext_compiled: bool):
+    """
+    Прогрев по 1 шагу. С torch.compile — на каждом размере из WARMUP_SIZES,
+    чтобы компиляция случилась здесь, а не на первом реальном запросе.
+    """
+    sizes = _warmup_sizes() if schnell_compiled else [(256, 256)]
+    for h, w in sizes:
+        try:
+            t0 = time.perf_counter()
+            with torch.inference_mode():
+                _ = _pipe_schnell("warmup", height=h, width=w, num_inference_steps=1, guidance_scale=0.0).images[0]
+            log(f"schnell warmup {h}x{w} in {time.perf_counter()-t0:.2f}s")
+        except Exception as e:
+            log(f"warmup skipped: {e}", "red")
+
+    if kontext_compiled:
+        side = _round8(int(os.getenv("KONTEXT_NATIVE_MAX", "768")))
+        try:
+            t0 = time.perf_counter()
+            with torch.inference_mode():
+                _ = _pipe_kontext(
+                    image=Image.new("RGB", (side, side)), prompt="warmup",
+                    num_inference_steps=1, width=side, height=side,
+                ).images[0]
+            log(f"kontext warmup {side}x{side} in {time.perf_counter()-t0:.2f}s")
+        except Exception as e:
+            log(f"kontext warmup skipped: {e}", "red")
+
+# ---------- startup ----------
+_perf_applied = {"schnell": set(), "kontext": set()}
+
+@app.on_event("startup")
+def load_models():
+    global _pipe_schnell, _pipe_kontext
+    if _pipe_schnell and _pipe_kontext:
+        return
+
+    opts = _parse_perf_mode(os.getenv("PERF_MODE", ""))
+
+    # ---- SCHNELL ----
+    _pipe_schnell = _load_schnell()
+    _perf_applied["schnell"] = _apply_perf_mode(_pipe_schnell, "schnell", opts)
+
+    # ---- KONTEXT ----
+    _pipe_kontext = _load_kontext()
+    _perf_applied["kontext"] = _apply_perf_mode(_pipe_kontext, "kontext", opts)
 
     # warmup для снижения пиков на первом реальном запросе
     gc.collect()
-    if use_cuda:
+    if torch.cuda.is_available():
         torch.cuda.empty_cache()
-    try:
-        with torch.inference_mode():
-            _ = _pipe_schnell("warmup", height=256, width=256, num_inference_steps=1, guidance_scale=0.0).images[0]
-    except Exception as e:
-        log(f"warmup skipped: {e}", "red")
+    _warmup("compile" in _perf_applied["schnell"], "compile" in _perf_applied["kontext"])
 
     log("Both models are ready")
 
@@ -142,35 +445,120 @@ def health():
         "ok": True,
         "cuda": torch.cuda.is_available(),
         "torch": torch.__version__,
+        "perf_mode": {name: sorted(applied) for name, applied in _perf_applied.items()},
     }
 
+# ---------- cancel ----------
+@app.post("/cancel/{job_id}")
+def cancel_job(job_id: str):
+    _cancelled_jobs[job_id] = time.time()
+    _cancelled_jobs.move_to_end(job_id)
+    while len(_cancelled_jobs) > _CANCELLED_MAX:
+        _cancelled_jobs.popitem(last=False)
+    log(f"job {job_id} cancelled", "red")
+    return {"ok": True, "job_id": job_id}
+
 # ---------- t2i: schnell ----------
 @app.post("/generate_image")
 async def generate_image(req: TxtReq):
     assert _pipe_schnell is not None, "schnell not loaded"
 
+    if req.preview:
+        h = w = int(os.getenv("PREVIEW_SIZE", "256"))
+        steps = int(os.getenv("PREVIEW_STEPS", "1"))
+    else:
+        h = int(os.getenv("HEIGHT", "512"))
+        w = int(os.getenv("WIDTH",  "512"))
+        steps = int(os.getenv("STEPS", "3"))
+    gscale = float(os.getenv("SCHNELL_GUIDANCE", "0.0"))
+    kind = "preview" if req.preview else "full"
+    seed = _resolve_seed(req.seed)
+    log(f"schnell {kind} request: {h}x{w}, steps={steps}, guidance={gscale}, seed={seed}")
+    t0 = time.perf_counter()
+
+    def _run():
+        _check_cancelled(req.job_id)  # отменили, пока ждали GPU
+        with torch.inference_mode():
+            out = _pipe_schnell(
+                req.prompt, height=h, width=w, num_inference_steps=steps, guidance_scale=gscale,
+                generator=torch.Generator().manual_seed(seed),
+                callback_on_step_end=_interrupt_on_cancel(req.job_id),
+            ).images[0]
+            if torch.cuda.is_available():
+                torch.cuda.synchronize()
+        _check_cancelled(req.job_id)
+        return out
+
+    try:
+        async with _gpu_slot("schnell_preview" if req.preview else "schnell", priority=req.preview):
+            # инференс в отдельном потоке, чтобы event loop принимал новые запросы (и превью)
+            img = await asyncio.to_thread(_run)
+    except JobCancelled:
+        log(f"schnell {kind} job {req.job_id} cancelled", "red")
+        raise HTTPException(status_code=409, detail="job cancelled")
+    except Exception as e:
+        log(f"schnell error: {e}", "red")
+        raise HTTPException(status_code=500, detail=f"schnell failed: {e}")
+
+    image_b64 = _encode_png(img)
+    log(f"schnell {kind} done in {time.perf_counter()-t0:.2f}s")
+    return {
+        "image": image_b64,
+        "preview": req.preview,
+        "width": w,
+        "height": h,
+        "seed": seed,
+    }
+
+# ---------- t2i batch: schnell ----------
+@app.post("/generate_images")
+async def generate_images(req: TxtBatchReq):
+    """Пакетная генерация: один захват GPU на всю раскадровку, промпты идут батчами по BATCH_SIZE."""
+    assert _pipe_schnell is not None, "schnell not loaded"
+    if not req.prompts:
+        return {"images": []}
+
     h = int(os.getenv("HEIGHT", "512"))
     w = int(os.getenv("WIDTH",  "512"))
     steps = int(os.getenv("STEPS", "3"))
     gscale = float(os.getenv("SCHNELL_GUIDANCE", "0.0"))
-    log(f"schnell request: {h}x{w}, steps={steps}, guidance={gscale}")
+    batch_size = max(1, int(os.getenv("BATCH_SIZE", "4")))  # ограничивает пик VRAM
+    seed = _resolve_seed(req.seed)
+    log(f"schnell batch request: {len(req.prompts)} prompts, batch={batch_size}, {h}x{w}, steps={steps}, seed={seed}")
     t0 = time.perf_counter()
 
+    def _run():
+        images = []
+        with torch.inference_mode():
+            for i in range(0, len(req.prompts), batch_size):
+                _check_cancelled(req.job_id)
+                chunk = req.prompts[i:i + batch_size]
+                images.extend(_pipe_schnell(
+                    chunk, height=h, width=w, num_inference_steps=steps, guidance_scale=gscale,
+                    # один seed на каждый промпт — блоки раскадровки в одном стиле
+                    generator=[torch.Generator().manual_seed(seed) for _ in chunk],
+                    callback_on_step_end=_interrupt_on_cancel(req.job_id),
+                ).images)
+            if torch.cuda.is_available():
+                torch.cuda.synchronize()
+        _check_cancelled(req.job_id)
+        return images
+
     try:
-        async with _gpu_lock:
-            with torch.inference_mode():
-                img = _pipe_schnell(
-                    req.prompt, height=h, width=w, num_inference_steps=steps, guidance_scale=gscale
-                ).images[0]
-                if torch.cuda.is_available():
-                    torch.cuda.synchronize()
+        async with _gpu_slot("schnell_batch"):
+            images = await asyncio.to_thread(_run)
+    except JobCancelled:
+        log(f"schnell batch job {req.job_id} cancelled", "red")
+        raise HTTPException(status_code=409, detail="job cancelled")
     except Exception as e:
-        log(f"schnell error: {e}", "red")
-        raise HTTPException(status_code=500, detail=f"schnell failed: {e}")
+        log(f"schnell batch error: {e}", "red")
+        raise HTTPException(status_code=500, detail=f"schnell batch failed: {e}")
 
-    buf = io.BytesIO(); img.save(buf, "PNG"); buf.seek(0)
-    log(f"schnell done in {time.perf_counter()-t0:.2f}s")
-    return {"image": base64.b64encode(buf.getvalue()).decode("utf-8")}
+    encoded = []
+    for img in images:
+        encoded.append(_encode_png(img))
+    log(f"schnell batch done in {time.perf_counter()-t0:.2f}s")
+    return {"images": encoded, "seed": seed}
 
 # ---------- edit: kontext ----------
 @app.post("/edit_image")
@@ -189,7 +577,7 @@ async def edit_image(req: EditReq):
     # параметры «неон без каши»
     steps  = int(os.getenv("KONTEXT_STEPS",  "22"))       # 20–24
     gscale = float(os.getenv("KONTEXT_GUIDANCE", "4.0"))  # 3.8–5.0 (ниже ~3.5 бывает «чёрный»)
-    seed   = int(os.getenv("SEED", "42"))
+    seed   = req.seed if req.seed is not None else int(os.getenv("SEED", "42"))
 
     # negative_prompt опционален (по умолчанию выключен)
     neg_env = os.getenv("KONTEXT_NEGATIVE", "").strip()
@@ -224,6 +612,7 @@ async def edit_image(req: EditReq):
         generator=torch.Generator().manual_seed(seed),  # CPU-генератор ок
         output_type="pil",
         width=tgt_w, height=tgt_h,                      # фиксируем размер прогона
+        callback_on_step_end=_interrupt_on_cancel(req.job_id),
     )
     if negative:
         kwargs["negative_prompt"] = negative
@@ -231,19 +620,117 @@ async def edit_image(req: EditReq):
     log(f"kontext: in={W}x{H} mode={mode} -> run={tgt_w}x{tgt_h} return={return_size}, steps={steps}, g={gscale}, neg={'on' if negative else 'off'}")
     t0 = time.perf_counter()
 
+    latent_key = None
+    if req.cache_latents:
+        latent_key = f"{hashlib.sha256(raw).hexdigest()}:{tgt_w}x{tgt_h}"
+
+    def _run():
+        _check_cancelled(req.job_id)
+        _latent_key.set(latent_key)
+        with torch.inference_mode():
+            out = _pipe_kontext(**kwargs).images[0]
+            _check_cancelled(req.job_id)
+            if return_size != (out.width, out.height):
+                out = out.resize(return_size, Image.Resampling.LANCZOS)
+            out = _post_sharpen(out)  # опциональный шейпинг
+            if torch.cuda.is_available():
+                torch.cuda.synchronize()
+        return out, _latent_hit.get()
+
     try:
-        async with _gpu_lock:
-            with torch.inference_mode():
-                out = _pipe_kontext(**kwargs).images[0]
-                if return_size != (out.width, out.height):
-                    out = out.resize(return_size, Image.Resampling.LANCZOS)
-                out = _post_sharpen(out)  # опциональный шейпинг
-                if torch.cuda.is_available():
-                    torch.cuda.synchronize()
+        async with _gpu_slot("kontext"):
+            out, latent_hit = await asyncio.to_thread(_run)
+    except JobCancelled:
+        log(f"kontext job {req.job_id} cancelled", "red")
+        raise HTTPException(status_code=409, detail="job cancelled")
     except Exception as e:
         log(f"kontext error: {e}", "red")
         raise HTTPException(status_code=500, detail=f"kontext failed: {e}")
 
-    buf = io.BytesIO(); out.save(buf, "PNG"); buf.seek(0)
-    log(f"kontext done in {time.perf_counter()-t0:.2f}s")
-    return {"image": base64.b64encode(buf.getvalue()).decode("utf-8")}
\ No newline at end of file
+    image_b64 = _encode_png(out)
+    log(f"kontext done in {time.perf_counter()-t0:.2f}s (latent cache {'hit' if latent_hit else 'miss'})")
+    return {
+        "image": image_b64,
+        "seed": seed,
+        "latent_cache_hit": latent_hit,
+    }
+
+# ---------- benchmark ----------
+def _peak_memory_mb() -> float:
+    if torch.cuda.is_available():
+        return torch.cuda.max_memory_allocated() / 2**20
+    # на CPU — пиковый RSS процесса (ru_maxrss в КиБ на Linux); сбросить его нельзя,
+    # поэтому каждый режим замеряется в отдельном процессе (см. run_benchmark)
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def _benchmark_mode(mode: str, h: int, w: int, steps: int, runs: int) -> dict:
+    """Замер одного режима PERF_MODE; выполняется в свежем процессе"""
+    global _pipe_schnell
+    _pipe_schnell = _load_schnell()
+    applied = _apply_perf_mode(_pipe_schnell, "schnell", _parse_perf_mode(mode))
+    if torch.cuda.is_available():
+        torch.cuda.reset_peak_memory_stats()
+
+    def _once() -> float:
+        t0 = time.perf_counter()
+        with torch.inference_mode():
+            _pipe_schnell("benchmark", height=h, width=w, num_inference_steps=steps, guidance_scale=0.0)
+            if torch.cuda.is_available():
+                torch.cuda.synchronize()
+        return time.perf_counter() - t0
+
+    first = _once()
+    latencies = sorted(_once() for _ in range(runs))
+    return {
+        "mode": mode,
+        "applied": sorted(applied),
+        "first_run_s": round(first, 3),
+        "mean_s": round(statistics.mean(latencies), 3),
+        "p50_s": round(statistics.median(latencies), 3),
+        "min_s": round(latencies[0], 3),
+        "max_s": round(latencies[-1], 3),
+        "peak_memory_mb": round(_peak_memory_mb(), 1),
+    }
+
+def run_benchmark(modes: List[str], runs: int, out_path: str) -> dict:
+    """
+    Сравнивает задержку и память schnell по режимам PERF_MODE.
+    Каждый режим — отдельный процесс (spawn): пиковая память и кэши компиляции
+    не переходят из режима в режим. Первый прогон (с компиляцией) замеряется отдельно.
+    """
+    h = int(os.getenv("HEIGHT", "512"))
+    w = int(os.getenv("WIDTH",  "512"))
+    steps = int(os.getenv("STEPS", "3"))
+    report = {
+        "device": torch.cuda.get_device_name(0) if torch.cuda.is_available() else "cpu",
+        "dtype": str(_dtype_for_device()),
+        "torch": torch.__version__,
+        "height": h, "width": w, "steps": steps, "runs": runs,
+        "modes": [],
+    }
+
+    spawn = multiprocessing.get_context("spawn")
+    for mode in modes:
+        with ProcessPoolExecutor(max_workers=1, mp_context=spawn) as pool:
+            entry = pool.submit(_benchmark_mode, mode, h, w, steps, runs).result()
+        report["modes"].append(entry)
+        log(f"{mode:>20}: mean={entry['mean_s']}s p50={entry['p50_s']}s first={entry['first_run_s']}s mem={entry['peak_memory_mb']}MB", "green")
+
+    with open(out_path, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    log(f"benchmark report saved to {out_path}")
+    return report
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="FLUX image service")
+    parser.add_argument("--benchmark", action="store_true", help="сравнить режимы PERF_MODE вместо запуска сервиса")
+    parser.add_argument("--modes", default="off,channels_last,int8,compile,int8+compile,int4+compile")
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--out", default="image_benchmark.json")
+    args = parser.parse_args()
+
+    if args.benchmark:
+        run_benchmark([m.strip() for m in args.modes.split(",") if m.strip()], args.runs, args.out)
+    else:
+        import uvicorn
+        uvicorn.run(app, host="0.0.0.0", port=int(os.getenv("PORT", "3339")))
@@ -1,4 +1,11 @@
+import os
+
 import uvicorn
 
 if __name__ == "__main__":
-    uvicorn.run("api.app:app", host="0.0.0.0", port=8324, reload=False)
\ No newline at end of file
+    # WEB_CONCURRENCY > 1 — несколько процессов API; задачи и их реестр тогда
+    # должны быть общими, поэтому по умолчанию включается очередь в БД
+    workers = int(os.getenv("WEB_CONCURRENCY", "1"))
+    if workers > 1:
+        os.environ.setdefault("JOB_QUEUE", "db")
+    uvicorn.run("api.app:app", host="0.0.0.0", port=8324, reload=False, workers=workers)
@@ -0,0 +1,53 @@
+"""
+Окружение alembic. Подключение — engine из api/schemas/schemas.py (DATABASE_URL);
+init_db() передаёт своё соединение через config.attributes["connection"].
+"""
+from logging.config import fileConfig
+
+from alembic import context
+
+from api.schemas.schemas import Base, engine
+
+config = context.config
+
+if config.config_file_name is not None and config.attributes.get("connection") is None:
+    fileConfig(config.config_file_name)
+
+target_metadata = Base.metadata
+
+
+def include_object(obj, name, type_, reflected, compare_to):
+    # Поиск проектов (миграция 0004) живёт вне моделей: таблица FTS5 со служебными
+    # таблицами в SQLite и GIN-индекс в PostgreSQL — autogenerate их не трогает
+    if type_ == "table" and name.startswith("projects_fts"):
+        return False
+    return not (type_ == "index" and name == "ix_projects_fts")
+
+
+def run_migrations(connection):
+    context.configure(
+        connection=connection,
+        target_metadata=target_metadata,
+        # SQLite не умеет ALTER для большинства изменений — alembic пересоздаёт таблицу
+        render_as_batch=connection.dialect.name == "sqlite",
+        include_object=include_object,
+    )
+    with context.begin_transaction():
+        context.run_migrations()
+
+
+def run_migrations_offline():
+    context.configure(url=str(engine.url), target_metadata=target_metadata, literal_binds=True,
+                      include_object=include_object)
+    with context.begin_transaction():
+        context.run_migrations()
+
+
+if context.is_offline_mode():
+    run_migrations_offline()
+elif config.attributes.get("connection") is not None:
+    run_migrations(config.attributes["connection"])
+else:
+    with engine.connect() as connection:
+        run_migrations(connection)
+        connection.commit()
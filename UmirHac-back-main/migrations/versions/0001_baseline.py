@@ -0,0 +1,147 @@
+"""baseline
+
+Схема на момент подключения миграций. В базах, созданных раньше через
+Base.metadata.create_all, таблицы уже есть — создаются только недостающие, а в
+существующие дописываются недостающие колонки (create_all не меняет таблицы,
+поэтому в базах старых версий, например, нет projects.image_seed).
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-19 06:27:29.837403
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = '0001'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+project_status = sa.Enum('in_progress', 'completed', 'failed', name='projectstatus')
+
+
+def _missing(table: str, *columns: sa.Column) -> bool:
+    """
+    True — таблицы нет, её нужно создать. Если есть — добавляет в неё колонки
+    из columns, которых там нет (все такие колонки допускают NULL).
+    """
+    inspector = sa.inspect(op.get_bind())
+    if not inspector.has_table(table):
+        return True
+    existing = {column["name"] for column in inspector.get_columns(table)}
+    for column in columns:
+        if column.name not in existing:
+            op.add_column(table, column)
+    return False
+
+
+def upgrade():
+    if _missing('users'):
+        op.create_table('users',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('login', sa.String(), nullable=False),
+        sa.Column('email', sa.String(), nullable=True),
+        sa.Column('hashed_password', sa.String(), nullable=False),
+        sa.PrimaryKeyConstraint('id')
+        )
+        op.create_index('ix_users_email', 'users', ['email'], unique=True)
+        op.create_index('ix_users_id', 'users', ['id'], unique=False)
+        op.create_index('ix_users_login', 'users', ['login'], unique=True)
+
+    if _missing('folders'):
+        op.create_table('folders',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('name', sa.String(), nullable=False),
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('archived', sa.Boolean(), nullable=True),
+        sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.func.now(), nullable=True),
+        sa.Column('updated_at', sa.DateTime(timezone=True), nullable=True),
+        sa.ForeignKeyConstraint(['user_id'], ['users.id'], ),
+        sa.PrimaryKeyConstraint('id')
+        )
+        op.create_index('ix_folders_id', 'folders', ['id'], unique=False)
+
+    if _missing('projects', sa.Column('image_seed', sa.Integer(), nullable=True)):
+        op.create_table('projects',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('name', sa.String(), nullable=True),
+        sa.Column('folder_id', sa.Integer(), nullable=True),
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('status', project_status, nullable=False),
+        sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.func.now(), nullable=True),
+        sa.Column('updated_at', sa.DateTime(timezone=True), nullable=True),
+        sa.Column('result_path', sa.String(), nullable=True),
+        sa.Column('product_description', sa.Text(), nullable=True),
+        sa.Column('image_generation_status', sa.Text(), nullable=True),
+        sa.Column('image_paths', sa.Text(), nullable=True),
+        sa.Column('image_descriptions', sa.Text(), nullable=True),
+        sa.Column('image_seed', sa.Integer(), nullable=True),
+        sa.ForeignKeyConstraint(['folder_id'], ['folders.id'], ),
+        sa.ForeignKeyConstraint(['user_id'], ['users.id'], ),
+        sa.PrimaryKeyConstraint('id')
+        )
+        op.create_index('ix_projects_id', 'projects', ['id'], unique=False)
+
+    if _missing('scenario_element_images'):
+        op.create_table('scenario_element_images',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('project_id', sa.Integer(), nullable=False),
+        sa.Column('element_index', sa.Integer(), nullable=False),
+        sa.Column('image_path', sa.String(), nullable=True),
+        sa.Column('image_description', sa.Text(), nullable=True),
+        sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.func.now(), nullable=True),
+        sa.Column('updated_at', sa.DateTime(timezone=True), nullable=True),
+        sa.Column('status', project_status, nullable=False),
+        sa.ForeignKeyConstraint(['project_id'], ['projects.id'], ),
+        sa.PrimaryKeyConstraint('id')
+        )
+        op.create_index('ix_scenario_element_images_id', 'scenario_element_images', ['id'], unique=False)
+
+    if _missing('image_blobs'):
+        op.create_table('image_blobs',
+        sa.Column('hash', sa.String(length=64), nullable=False),
+        sa.Column('size', sa.Integer(), nullable=False),
+        sa.Column('refcount', sa.Integer(), nullable=False),
+        sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.func.now(), nullable=True),
+        sa.Column('updated_at', sa.DateTime(timezone=True), server_default=sa.func.now(), nullable=True),
+        sa.PrimaryKeyConstraint('hash')
+        )
+
+    if _missing('background_jobs'):
+        op.create_table('background_jobs',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('job_id', sa.String(length=32), nullable=False),
+        sa.Column('kind', sa.String(), nullable=True),
+        sa.Column('payload', sa.Text(), nullable=True),
+        sa.Column('project_id', sa.Integer(), nullable=True),
+        sa.Column('block_index', sa.Integer(), nullable=True),
+        sa.Column('content_hash', sa.String(length=16), nullable=True),
+        sa.Column('active_key', sa.String(), nullable=True),
+        sa.Column('status', sa.String(), nullable=False),
+        sa.Column('cancelled', sa.Boolean(), nullable=False),
+        sa.Column('claim', sa.String(length=32), nullable=True),
+        sa.Column('attempts', sa.Integer(), nullable=False),
+        sa.Column('request_id', sa.String(), nullable=True),
+        sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.func.now(), nullable=True),
+        sa.Column('started_at', sa.DateTime(timezone=True), nullable=True),
+        sa.Column('heartbeat_at', sa.DateTime(timezone=True), nullable=True),
+        sa.Column('finished_at', sa.DateTime(timezone=True), nullable=True),
+        sa.ForeignKeyConstraint(['project_id'], ['projects.id'], ),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('active_key')
+        )
+        op.create_index('ix_background_jobs_claim', 'background_jobs', ['claim'], unique=False)
+        op.create_index('ix_background_jobs_id', 'background_jobs', ['id'], unique=False)
+        op.create_index('ix_background_jobs_job_id', 'background_jobs', ['job_id'], unique=False)
+        op.create_index('ix_background_jobs_status', 'background_jobs', ['status'], unique=False)
+
+
+def downgrade():
+    op.drop_table('background_jobs')
+    op.drop_table('image_blobs')
+    op.drop_table('scenario_element_images')
+    op.drop_table('projects')
+    op.drop_table('folders')
+    op.drop_table('users')
+    project_status.drop(op.get_bind(), checkfirst=True)
@@ -0,0 +1,40 @@
+"""hot path indexes
+
+Индексы под фильтры folders.py / script_generator.py и уникальность
+(project_id, element_index) у scenario_element_images.
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-19 06:28:01.737710
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = '0002'
+down_revision = '0001'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_folders_user_id_id', 'folders', ['user_id', 'id'], unique=False)
+    op.create_index('ix_projects_user_id_id', 'projects', ['user_id', 'id'], unique=False)
+    op.create_index('ix_projects_folder_id', 'projects', ['folder_id'], unique=False)
+
+    # Дубликаты записей блока (оставляем последнюю), иначе уникальный индекс не создать;
+    # файлы удалённых записей подберёт сборщик мусора изображений
+    op.execute(sa.text(
+        "DELETE FROM scenario_element_images WHERE id NOT IN ("
+        " SELECT max_id FROM (SELECT MAX(id) AS max_id FROM scenario_element_images"
+        " GROUP BY project_id, element_index) AS latest)"
+    ))
+    op.create_index('uq_scenario_element_images_project_element', 'scenario_element_images',
+                    ['project_id', 'element_index'], unique=True)
+
+
+def downgrade():
+    op.drop_index('uq_scenario_element_images_project_element', table_name='scenario_element_images')
+    op.drop_index('ix_projects_folder_id', table_name='projects')
+    op.drop_index('ix_projects_user_id_id', table_name='projects')
+    op.drop_index('ix_folders_user_id_id', table_name='folders')
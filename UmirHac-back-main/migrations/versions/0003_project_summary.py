@@ -0,0 +1,37 @@
+"""project summary
+
+Таблица сводок проектов для GET /script-generator/projects. Строки существующих
+проектов создаются при первом запросе списка (api/project_summary.py).
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-19 06:44:53.948157
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = '0003'
+down_revision = '0002'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('project_summary',
+    sa.Column('project_id', sa.Integer(), nullable=False),
+    sa.Column('has_scenario', sa.Boolean(), nullable=True),
+    sa.Column('blocks_count', sa.Integer(), nullable=False),
+    sa.Column('action_blocks_count', sa.Integer(), nullable=False),
+    sa.Column('images_count', sa.Integer(), nullable=False),
+    sa.Column('images_done', sa.Integer(), nullable=False),
+    sa.Column('images_in_progress', sa.Integer(), nullable=False),
+    sa.Column('images_failed', sa.Integer(), nullable=False),
+    sa.Column('last_activity_at', sa.DateTime(timezone=True), nullable=True),
+    sa.ForeignKeyConstraint(['project_id'], ['projects.id'], ),
+    sa.PrimaryKeyConstraint('project_id')
+    )
+
+
+def downgrade():
+    op.drop_table('project_summary')
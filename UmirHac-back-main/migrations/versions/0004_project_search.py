@@ -0,0 +1,75 @@
+"""project search
+
+Индексы сортировки списка проектов и полнотекстовый поиск по name /
+product_description (api/listing.py):
+- SQLite: таблица FTS5 projects_fts (external content над projects), её держат
+  в актуальном состоянии триггеры; без FTS5 в сборке SQLite поиск идёт через LIKE.
+  Batch-миграции, пересоздающие projects, удаляют и триггеры — их нужно создать заново;
+- PostgreSQL: GIN-индекс по to_tsvector('simple', ...).
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-19 06:48:11.760611
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = '0004'
+down_revision = '0003'
+branch_labels = None
+depends_on = None
+
+FTS_TRIGGERS = {
+    'projects_fts_ai': "AFTER INSERT ON projects BEGIN "
+                       "INSERT INTO projects_fts(rowid, name, product_description) "
+                       "VALUES (new.id, new.name, new.product_description); END",
+    'projects_fts_ad': "AFTER DELETE ON projects BEGIN "
+                       "INSERT INTO projects_fts(projects_fts, rowid, name, product_description) "
+                       "VALUES ('delete', old.id, old.name, old.product_description); END",
+    'projects_fts_au': "AFTER UPDATE OF name, product_description ON projects BEGIN "
+                       "INSERT INTO projects_fts(projects_fts, rowid, name, product_description) "
+                       "VALUES ('delete', old.id, old.name, old.product_description); "
+                       "INSERT INTO projects_fts(rowid, name, product_description) "
+                       "VALUES (new.id, new.name, new.product_description); END",
+}
+
+
+def _sqlite_has_fts5(bind) -> bool:
+    try:
+        bind.exec_driver_sql("CREATE VIRTUAL TABLE temp._fts5_probe USING fts5(x)")
+    except sa.exc.OperationalError:
+        return False
+    bind.exec_driver_sql("DROP TABLE temp._fts5_probe")
+    return True
+
+
+def upgrade():
+    bind = op.get_bind()
+    op.create_index('ix_projects_user_activity', 'projects',
+                    ['user_id', sa.text('coalesce(updated_at, created_at)'), 'id'], unique=False)
+    op.create_index('ix_projects_user_name', 'projects', ['user_id', sa.text("coalesce(name, '')"), 'id'], unique=False)
+
+    if bind.dialect.name == 'sqlite' and _sqlite_has_fts5(bind):
+        op.execute("CREATE VIRTUAL TABLE projects_fts USING fts5("
+                   "name, product_description, content='projects', content_rowid='id', "
+                   "tokenize='unicode61 remove_diacritics 2')")
+        for name, body in FTS_TRIGGERS.items():
+            op.execute(f"CREATE TRIGGER {name} {body}")
+        op.execute("INSERT INTO projects_fts(projects_fts) VALUES ('rebuild')")
+    elif bind.dialect.name == 'postgresql':
+        op.execute("CREATE INDEX ix_projects_fts ON projects USING gin "
+                   "(to_tsvector('simple', coalesce(name, '') || ' ' || coalesce(product_description, '')))")
+
+
+def downgrade():
+    bind = op.get_bind()
+    if bind.dialect.name == 'sqlite':
+        for name in FTS_TRIGGERS:
+            op.execute(f"DROP TRIGGER IF EXISTS {name}")
+        op.execute("DROP TABLE IF EXISTS projects_fts")
+    elif bind.dialect.name == 'postgresql':
+        op.execute("DROP INDEX IF EXISTS ix_projects_fts")
+
+    op.drop_index('ix_projects_user_name', table_name='projects')
+    op.drop_index('ix_projects_user_activity', table_name='projects')
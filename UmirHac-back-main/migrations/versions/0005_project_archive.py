@@ -0,0 +1,28 @@
+"""project archive
+
+Ключ архива проекта (api/archive.py): проекты архивных папок переносятся в
+сжатые архивы в хранилище. Колонки добавляются и удаляются без пересоздания
+таблицы (batch-миграция потеряла бы триггеры FTS и индексы по выражениям из 0004).
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-19 06:52:32.509851
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = '0005'
+down_revision = '0004'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('projects', sa.Column('archive_key', sa.String(), nullable=True))
+    op.add_column('projects', sa.Column('archived_at', sa.DateTime(timezone=True), nullable=True))
+
+
+def downgrade():
+    op.drop_column('projects', 'archived_at')
+    op.drop_column('projects', 'archive_key')
@@ -0,0 +1,31 @@
+"""project image seed
+
+Колонка projects.image_seed для баз, в которых её нет: модель получила её до
+появления миграций, а create_all не меняет существующие таблицы. Базы,
+поднятые до исправления 0001 (она пропускала существующие таблицы целиком),
+отмечены последней версией, но колонки в них нет — её добавляет эта миграция.
+Если колонка уже есть, ничего не делается.
+
+Revision ID: 0006
+Revises: 0005
+Create Date: 2026-10-19 07:31:05.114208
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = '0006'
+down_revision = '0005'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    columns = {column["name"] for column in sa.inspect(op.get_bind()).get_columns('projects')}
+    if 'image_seed' not in columns:
+        op.add_column('projects', sa.Column('image_seed', sa.Integer(), nullable=True))
+
+
+def downgrade():
+    # Колонка входит в схему 0001, откат этой миграции её не удаляет
+    pass
@@ -34,6 +34,15 @@ export interface Project {
   image_description?: string
   user_id?: number
   folder_id?: number
+  // Сводка проекта (GET /script-generator/projects)
+  blocks_count?: number
+  action_blocks_count?: number
+  images_done?: number
+  images_in_progress?: number
+  images_failed?: number
+  last_activity_at?: string | null
+  // Файлы проекта в архиве: вернутся при открытии проекта
+  archived?: boolean
 }
 
 export interface Folder {
@@ -131,6 +140,11 @@ export interface BlockImage {
   data_base64: string
 }
 
+// Строка потока /blocks/images/stream: картинка блока или завершающая строка
+export type BlockImageStreamLine =
+  | (BlockImage & { block_index: number; done?: undefined })
+  | { done: true; project_id: number; images_count: number }
+
 export interface BlockImagesResponse {
   project_id: number
   results: Array<{
@@ -385,6 +399,46 @@ class ApiService {
       },
     )
   }
+
+  // Картинки блоков потоком NDJSON: onImage вызывается для каждой картинки сразу по получении
+  async streamBlockImages(
+    projectId: number,
+    blockIndices: number[],
+    onImage: (blockIndex: number, image: BlockImage) => void,
+  ): Promise<number> {
+    const response = await fetch(
+      `${this.baseURL}/script-generator/scenario/${projectId}/blocks/images/stream`,
+      {
+        method: 'POST',
+        headers: {
+          'Content-Type': 'application/json',
+          ...this.getAuthHeader(),
+        },
+        body: JSON.stringify({ block_indices: blockIndices }),
+      },
+    )
+    if (!response.ok || !response.body) {
+      throw new Error(`HTTP error! status: ${response.status}`)
+    }
+
+    const reader = response.body.getReader()
+    const decoder = new TextDecoder()
+    let buffer = ''
+    for (;;) {
+      const { value, done } = await reader.read()
+      buffer += decoder.decode(value, { stream: !done })
+      let newline: number
+      while ((newline = buffer.indexOf('\n')) >= 0) {
+        const line = buffer.slice(0, newline).trim()
+        buffer = buffer.slice(newline + 1)
+        if (!line) continue
+        const data = JSON.parse(line) as BlockImageStreamLine
+        if (data.done) return data.images_count
+        onImage(data.block_index, data)
+      }
+      if (done) throw new Error('Image stream ended unexpectedly')
+    }
+  }
 }
 
 export const apiService = new ApiService()